@@ -0,0 +1,391 @@
+"""Backend SQLite embebido para conexion_bd.
+
+La base es un archivo en modo WAL: lectores concurrentes y un escritor, que el
+resto espera hasta `espera_bloqueo` segundos. Si el archivo no tiene tablas se
+crea con esquema_sqlite.sql, equivalente a biblioteca.sql con las migraciones
+aplicadas. El SQL de MySQL de los servicios se adapta al ejecutarse:
+
+- marcadores %s -> ?
+- INSERT IGNORE -> INSERT OR IGNORE
+- ON DUPLICATE KEY UPDATE -> ON CONFLICT DO UPDATE SET (SQLite 3.35+)
+- SELECT ... FOR UPDATE -> toma el bloqueo de escritura (BEGIN IMMEDIATE)
+- ESCAPE '\\\\' (una barra en MySQL) -> ESCAPE '\\' (SQLite no interpreta la barra)
+- GREATEST, CONCAT, DATE_FORMAT y CURDATE se registran como funciones
+
+Cualquier INSERT/UPDATE/DELETE abre la transacción con BEGIN IMMEDIATE, de
+modo que dos préstamos del mismo libro se serializan como con el bloqueo de
+fila de InnoDB. Un bloqueo agotado se convierte en el error 1205 de MySQL y
+ConexionBDAsync.transaccion lo reintenta.
+"""
+import asyncio
+import atexit
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+import mysql.connector
+
+ESQUEMA = os.path.join(os.path.dirname(__file__), "esquema_sqlite.sql")
+
+_LITERAL_O_MARCADOR = re.compile(r"'(?:[^']|'')*'|%s|%%")
+_INSERT_IGNORE = re.compile(r"\bINSERT\s+IGNORE\b", re.IGNORECASE)
+_DUPLICADO = re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", re.IGNORECASE)
+_ESCAPE_BARRA = re.compile(r"\bESCAPE\s+'\\\\'", re.IGNORECASE)
+_FOR_UPDATE = re.compile(r"\s+FOR\s+UPDATE\s*$", re.IGNORECASE)
+_ESCRITURA = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+_INSERT_VALUES = re.compile(r"^\s*INSERT\s+INTO\s+\w+\s*(?:\([^)]*\)\s*)?VALUES\b", re.IGNORECASE)
+_CONFLICTO = re.compile(r"\bON\s+CONFLICT\b", re.IGNORECASE)
+
+def traducir(sql: str, con_parametros: bool) -> tuple:
+    """Devuelve (sql para SQLite, si necesita el bloqueo de escritura)."""
+    if con_parametros:
+        # Solo fuera de los literales: '%Y-%m' entre comillas no es un marcador
+        sql = _LITERAL_O_MARCADOR.sub(lambda m: {"%s": "?", "%%": "%"}.get(m.group(0), m.group(0)), sql)
+    sql = _INSERT_IGNORE.sub("INSERT OR IGNORE", sql)
+    sql = _DUPLICADO.sub("ON CONFLICT DO UPDATE SET", sql)
+    sql = _ESCAPE_BARRA.sub(lambda m: "ESCAPE '\\'", sql)
+    bloqueo = bool(_ESCRITURA.match(sql))
+    if _FOR_UPDATE.search(sql):
+        sql = _FOR_UPDATE.sub("", sql)
+        bloqueo = True
+    return sql, bloqueo
+
+def _date_format(valor, formato):
+    if valor is None:
+        return None
+    if not isinstance(valor, (date, datetime)):
+        valor = datetime.fromisoformat(str(valor))
+    return valor.strftime(formato)
+
+def _concat(*valores):
+    if any(v is None for v in valores):
+        return None
+    return "".join(str(v) for v in valores)
+
+def _greatest(*valores):
+    return None if any(v is None for v in valores) else max(valores)
+
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(sep=" "))
+sqlite3.register_converter("DATE", lambda b: date.fromisoformat(b.decode()))
+sqlite3.register_converter("DATETIME", lambda b: datetime.fromisoformat(b.decode()))
+
+def _fila_dict(cursor, fila):
+    return {columna[0]: valor for columna, valor in zip(cursor.description, fila)}
+
+def _error_mysql(e: sqlite3.Error) -> mysql.connector.Error:
+    mensaje = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        return mysql.connector.errors.IntegrityError(msg=mensaje, errno=1062 if "UNIQUE" in mensaje else 1452)
+    if "locked" in mensaje or "busy" in mensaje:
+        return mysql.connector.errors.DatabaseError(msg=mensaje, errno=1205)
+    return mysql.connector.errors.DatabaseError(msg=mensaje)
+
+class CursorSQLite:
+    """Cursor con la interfaz de un cursor de diccionarios de mysql.connector."""
+
+    def __init__(self, conexion: "ConexionSQLite"):
+        self._conexion = conexion
+        self._cursor = conexion.sqlite.cursor()
+        self.rowcount = -1
+        self.lastrowid = None
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, query, params=None):
+        sql, bloqueo = traducir(query, params is not None)
+        try:
+            if bloqueo and not self._conexion.sqlite.in_transaction:
+                self._conexion.sqlite.execute("BEGIN IMMEDIATE")
+            self._cursor.execute(sql, tuple(params) if params is not None else ())
+        except sqlite3.Error as e:
+            raise _error_mysql(e) from e
+        self.rowcount = self._cursor.rowcount
+        # MySQL devuelve el id de la primera fila de un INSERT multi-fila; SQLite, el de la última.
+        # Solo en un INSERT ... VALUES sin IGNORE ni ON CONFLICT se sabe que rowcount son las filas
+        # insertadas (o entran todas o ninguna); en el resto queda el valor de SQLite
+        if _INSERT_VALUES.match(sql) and not _CONFLICTO.search(sql) and self.rowcount > 1:
+            self.lastrowid = self._cursor.lastrowid - self.rowcount + 1
+        else:
+            self.lastrowid = self._cursor.lastrowid
+
+    def executemany(self, query, filas):
+        sql, _ = traducir(query, True)
+        try:
+            if not self._conexion.sqlite.in_transaction:
+                self._conexion.sqlite.execute("BEGIN IMMEDIATE")
+            self._cursor.executemany(sql, [tuple(fila) for fila in filas])
+        except sqlite3.Error as e:
+            raise _error_mysql(e) from e
+        self.rowcount = self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, tamano=1):
+        return self._cursor.fetchmany(tamano)
+
+    def close(self):
+        self._cursor.close()
+
+class ConexionSQLite:
+    """Conexión con la parte de la interfaz de mysql.connector que usan PoolConexiones y los servicios."""
+
+    unread_result = False
+
+    def __init__(self, ruta: str, espera_bloqueo: float):
+        # (marca, versiones) de la última lectura de version_tabla, ver BackendSQLite.version_tablas
+        self.versiones = None
+        self.sqlite = sqlite3.connect(
+            ruta,
+            timeout=espera_bloqueo,
+            isolation_level=None,
+            check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+        )
+        self.sqlite.row_factory = _fila_dict
+        self.sqlite.execute("PRAGMA journal_mode = WAL")
+        self.sqlite.execute("PRAGMA synchronous = NORMAL")
+        self.sqlite.execute("PRAGMA foreign_keys = ON")
+        self.sqlite.create_function("GREATEST", -1, _greatest, deterministic=True)
+        self.sqlite.create_function("CONCAT", -1, _concat, deterministic=True)
+        self.sqlite.create_function("DATE_FORMAT", 2, _date_format, deterministic=True)
+        self.sqlite.create_function("CURDATE", 0, lambda: date.today().isoformat())
+
+    def cursor(self, dictionary=True):
+        return CursorSQLite(self)
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.sqlite.in_transaction
+
+    def commit(self):
+        self.sqlite.commit()
+
+    def rollback(self):
+        self.sqlite.rollback()
+
+    def consume_results(self):
+        pass
+
+    def ping(self, reconnect=False):
+        try:
+            self.sqlite.execute("SELECT 1")
+        except sqlite3.Error as e:
+            raise _error_mysql(e) from e
+
+    def close(self):
+        self.sqlite.close()
+
+class CursorSQLiteAsync:
+    """Cursor con la interfaz de aiomysql; las llamadas a SQLite se hacen en los hilos del pool."""
+
+    def __init__(self, conexion: "ConexionSQLiteAsync", servidor: bool):
+        self._cursor = CursorSQLite(conexion.sincrona)
+        self._en_hilo = conexion.en_hilo
+        self._servidor = servidor
+        self._filas = None
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def _ejecutar(self, metodo, query, params):
+        metodo(query, params)
+        # Como DictCursor, el resultado se descarga entero; el de servidor se lee por lotes
+        if not self._servidor and self._cursor.description is not None:
+            return self._cursor.fetchall()
+        return None
+
+    async def _llamar(self, metodo, query, params):
+        import pymysql
+        try:
+            self._filas = await self._en_hilo(self._ejecutar, metodo, query, params)
+        except mysql.connector.errors.IntegrityError as e:
+            raise pymysql.err.IntegrityError(e.errno, e.msg) from e
+        except mysql.connector.errors.DatabaseError as e:
+            raise pymysql.err.OperationalError(e.errno or 2013, e.msg) from e
+        return self.rowcount
+
+    async def execute(self, query, params=None):
+        return await self._llamar(self._cursor.execute, query, params)
+
+    async def executemany(self, query, filas):
+        return await self._llamar(self._cursor.executemany, query, filas)
+
+    async def fetchone(self):
+        if self._filas is not None:
+            return self._filas.pop(0) if self._filas else None
+        return await self._en_hilo(self._cursor.fetchone)
+
+    async def fetchall(self):
+        if self._filas is not None:
+            filas, self._filas = self._filas, []
+            return filas
+        return await self._en_hilo(self._cursor.fetchall)
+
+    async def fetchmany(self, tamano=1):
+        if self._filas is not None:
+            filas, self._filas = self._filas[:tamano], self._filas[tamano:]
+            return filas
+        return await self._en_hilo(self._cursor.fetchmany, tamano)
+
+    async def close(self):
+        self._cursor.close()
+
+class ConexionSQLiteAsync:
+    def __init__(self, sincrona: ConexionSQLite, hilos: ThreadPoolExecutor):
+        self.sincrona = sincrona
+        self.closed = False
+        self._hilos = hilos
+
+    def en_hilo(self, funcion, *args):
+        return asyncio.get_running_loop().run_in_executor(self._hilos, funcion, *args)
+
+    async def ping(self, reconnect=True):
+        pass
+
+    def get_transaction_status(self) -> bool:
+        return self.sincrona.in_transaction
+
+    async def commit(self):
+        await self.en_hilo(self.sincrona.commit)
+
+    async def rollback(self):
+        await self.en_hilo(self.sincrona.rollback)
+
+    def close(self):
+        self.closed = True
+        self.sincrona.close()
+
+class PoolSQLiteAsync:
+    """Pool con la parte de la interfaz de aiomysql.Pool que usa ConexionBDAsync.
+
+    Tiene un hilo por conexión: una transacción que espera el bloqueo de
+    escritura ocupa su hilo, y con hilos compartidos el commit de la que lo
+    tiene podría quedarse sin hilo hasta agotar la espera.
+    """
+
+    def __init__(self, backend: "BackendSQLite", maximo: int):
+        self.backend = backend
+        self.maxsize = maximo
+        self.size = 0
+        self._libres = []
+        self._semaforo = asyncio.Semaphore(maximo)
+        self._hilos = ThreadPoolExecutor(max_workers=maximo, thread_name_prefix="sqlite")
+
+    @property
+    def freesize(self) -> int:
+        return len(self._libres)
+
+    async def acquire(self):
+        await self._semaforo.acquire()
+        if self._libres:
+            return self._libres.pop()
+        try:
+            sincrona = await asyncio.get_running_loop().run_in_executor(self._hilos, self.backend.conectar)
+        except Exception:
+            self._semaforo.release()
+            raise
+        self.size += 1
+        return ConexionSQLiteAsync(sincrona, self._hilos)
+
+    def release(self, conexion) -> None:
+        if conexion.closed:
+            self.size -= 1
+        else:
+            self._libres.append(conexion)
+        self._semaforo.release()
+
+    def close(self) -> None:
+        for conexion in self._libres:
+            conexion.close()
+        self.size -= len(self._libres)
+        self._libres.clear()
+        self._hilos.shutdown(wait=False)
+
+    async def wait_closed(self) -> None:
+        pass
+
+class BackendSQLite:
+    """SQLite embebido. Con `ruta` None la base es temporal y vive en memoria
+    (/dev/shm si existe); la borra al salir el proceso que la creó."""
+
+    nombre = "sqlite"
+
+    def __init__(self, ruta: Optional[str] = None, espera_bloqueo: float = 10.0):
+        self.memoria = ruta is None
+        if self.memoria:
+            directorio = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            descriptor, ruta = tempfile.mkstemp(prefix="biblioteca_", suffix=".db", dir=directorio)
+            os.close(descriptor)
+            atexit.register(self._borrar, os.getpid())
+        self.ruta = os.path.abspath(ruta)
+        self.espera_bloqueo = espera_bloqueo
+        self._preparada = False
+        self._lock = threading.Lock()
+
+    def _borrar(self, propietario: int) -> None:
+        if os.getpid() != propietario:
+            return
+        for sufijo in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.ruta + sufijo)
+            except OSError:
+                pass
+
+    def _preparar(self, conexion: ConexionSQLite) -> None:
+        # libro_cambio es lo último que añadió el esquema: un archivo anterior se completa
+        existe = conexion.sqlite.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'libro_cambio'").fetchone()
+        if not existe:
+            with open(ESQUEMA, encoding="utf-8") as archivo:
+                # El esquema es idempotente (IF NOT EXISTS): otro proceso puede estar creándolo a la vez
+                conexion.sqlite.executescript(archivo.read())
+
+    def conectar(self) -> ConexionSQLite:
+        conexion = ConexionSQLite(self.ruta, self.espera_bloqueo)
+        if not self._preparada:
+            with self._lock:
+                if not self._preparada:
+                    try:
+                        self._preparar(conexion)
+                    except sqlite3.Error as e:
+                        conexion.close()
+                        raise _error_mysql(e) from e
+                    self._preparada = True
+        return conexion
+
+    async def crear_pool(self, minimo: int, maximo: int, reciclar: float) -> PoolSQLiteAsync:
+        return PoolSQLiteAsync(self, maximo)
+
+    async def cursor_async(self, conexion: ConexionSQLiteAsync, servidor: bool) -> CursorSQLiteAsync:
+        return CursorSQLiteAsync(conexion, servidor)
+
+    def version_tablas(self, cursor, conexion: ConexionSQLite, tablas: tuple) -> Dict[str, Any]:
+        # Los contadores de version_tabla (triggers del esquema) solo se releen si la base cambió:
+        # PRAGMA data_version cambia con los commits de otras conexiones y total_changes con
+        # los de esta
+        cursor.execute("PRAGMA data_version")
+        marca = (cursor.fetchone()["data_version"], conexion.sqlite.total_changes)
+        if conexion.versiones is None or conexion.versiones[0] != marca:
+            cursor.execute("SELECT tabla, SUM(version) AS version FROM version_tabla GROUP BY tabla")
+            conexion.versiones = (marca, {row["tabla"]: row["version"] for row in cursor.fetchall()})
+        return {tabla: conexion.versiones[1][tabla] for tabla in tablas if tabla in conexion.versiones[1]}
+
+    def __repr__(self) -> str:
+        return f"sqlite:///{self.ruta}"
@@ -0,0 +1,83 @@
+"""Catálogo sintético y reproducible para los benchmarks."""
+import random
+from datetime import date, timedelta
+
+import estadisticas
+
+PALABRAS = [
+    "sombra", "viento", "ciudad", "noche", "memoria", "jardin", "silencio", "mar", "camino",
+    "historia", "tiempo", "fuego", "agua", "piedra", "luz", "isla", "casa", "guerra", "amor",
+    "sueño", "rio", "montaña", "invierno", "verano", "cielo", "tierra", "nombre", "puerta",
+    "secreto", "ultimo", "primer", "largo", "oscuro", "perdido", "viaje", "mundo", "reino",
+    "lluvia", "espejo", "laberinto", "ceniza", "estrella", "biblioteca", "cronica", "leyenda",
+    "sangre", "ciencia", "arte", "teoria", "manual", "introduccion", "python", "datos", "redes",
+]
+CONECTORES = ["de", "del", "la", "el", "y", "en", "los"]
+NOMBRES = [
+    "Ana", "Luis", "Carmen", "Jorge", "Elena", "Pablo", "Lucia", "Miguel", "Sofia", "Diego",
+    "Marta", "Javier", "Paula", "Andres", "Irene", "Raul", "Clara", "Tomas", "Julia", "Hugo",
+]
+APELLIDOS = [
+    "Garcia", "Lopez", "Martinez", "Sanchez", "Perez", "Gomez", "Ruiz", "Diaz", "Moreno", "Alvarez",
+    "Romero", "Navarro", "Torres", "Dominguez", "Vazquez", "Ramos", "Gil", "Serrano", "Molina", "Castro",
+]
+
+# Fracción de los libros que tiene un préstamo activo
+FRACCION_PRESTADOS = 0.3
+
+def titulo(rnd: random.Random) -> str:
+    palabras = rnd.sample(PALABRAS, rnd.randint(1, 3))
+    if len(palabras) > 1 and rnd.random() < 0.6:
+        palabras.insert(1, rnd.choice(CONECTORES))
+    return " ".join(palabras).capitalize()
+
+def autor(rnd: random.Random) -> str:
+    return f"{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}"
+
+def sembrar(bd, libros: int, usuarios: int, prestamos: int, semilla: int = 42) -> dict:
+    """Inserta el catálogo con la ConexionBD `bd` (base vacía) y reconstruye las estadísticas."""
+    rnd = random.Random(semilla)
+    hoy = date.today()
+    with bd.obtener_cursor() as (cursor, conexion):
+        cursor.execute("SELECT COUNT(*) AS n FROM libro")
+        if cursor.fetchone()["n"]:
+            raise RuntimeError("La base de datos de los benchmarks debe estar vacía")
+        cursor.executemany(
+            "INSERT INTO libro (titulo, autor, disponible) VALUES (%s, %s, 1)",
+            [(titulo(rnd), autor(rnd)) for _ in range(libros)]
+        )
+        cursor.execute("SELECT MIN(id) AS primero FROM libro")
+        primer_libro = cursor.fetchone()["primero"]
+        cursor.executemany(
+            "INSERT INTO usuario (nombre, correo) VALUES (%s, %s)",
+            [(autor(rnd), f"usuario{i}@biblioteca.test") for i in range(1, usuarios + 1)]
+        )
+        cursor.execute("SELECT MIN(id) AS primero FROM usuario")
+        primer_usuario = cursor.fetchone()["primero"]
+
+        def prestamo(id_libro, devuelto):
+            inicio = hoy - timedelta(days=rnd.randint(30, 720) if devuelto else rnd.randint(0, 40))
+            return (id_libro, primer_usuario + rnd.randrange(usuarios), inicio, inicio + timedelta(days=21), int(devuelto))
+
+        # Primero el historial (devueltos) y después los activos, como en una base real
+        prestados = [primer_libro + i for i in rnd.sample(range(libros), min(int(libros * FRACCION_PRESTADOS), prestamos))]
+        filas = [prestamo(primer_libro + rnd.randrange(libros), True) for _ in range(prestamos - len(prestados))]
+        filas += [prestamo(id_libro, False) for id_libro in prestados]
+        cursor.executemany(
+            "INSERT INTO prestamo (id_libro, id_usuario, fecha_prestamo, fecha_devolucion, devuelto) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            filas
+        )
+        cursor.execute("SELECT MIN(id) AS primero FROM prestamo")
+        primer_prestamo = cursor.fetchone()["primero"]
+        cursor.executemany("UPDATE libro SET disponible = 0 WHERE id = %s", [(id,) for id in prestados])
+        conexion.commit()
+    return {
+        "libros": libros,
+        "usuarios": usuarios,
+        "prestamos": prestamos,
+        "activos": len(prestados),
+        # Los ids no empiezan en 1 si la base reutiliza contadores (AUTO_INCREMENT de MySQL)
+        "primeros": {"libro": primer_libro, "usuario": primer_usuario, "prestamo": primer_prestamo},
+        "estadisticas": estadisticas.reconstruir(bd),
+    }
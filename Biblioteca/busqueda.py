@@ -0,0 +1,374 @@
+import heapq
+import math
+import re
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+import consultas
+
+_PALABRA = re.compile(r"\w+")
+
+# Peso de cada campo y de cada forma de coincidencia en el ranking
+PESO_CAMPO = {"titulo": 2.0, "autor": 1.0}
+PESO_EXACTO = 1.0
+PESO_PREFIJO = 0.6
+PESO_ERRATA = 0.4
+
+# Los candidatos se evalúan en trozos de este tamaño para poder cortar pronto
+TAMANO_TROZO = 2048
+
+# Palabras demasiado frecuentes para discriminar; se ignoran salvo que la consulta
+# no tenga otras
+PALABRAS_VACIAS = {
+    "a", "al", "con", "de", "del", "el", "en", "la", "las", "lo", "los", "para",
+    "por", "un", "una", "y", "o", "the", "of", "and", "an", "to", "in",
+}
+
+def normalizar(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+def tokenizar(texto: str) -> List[str]:
+    return _PALABRA.findall(normalizar(texto))
+
+def _variantes(termino: str) -> set:
+    # Vecindario de borrado (estilo SymSpell): dos términos a distancia de edición 1
+    # comparten al menos una variante con una letra menos
+    return {termino[:i] + termino[i + 1:] for i in range(len(termino))}
+
+class IndiceLibros:
+    """Índice invertido en memoria sobre libro.titulo y libro.autor.
+
+    Admite prefijos, una errata por término (para términos de 4 letras o más),
+    filtro por disponibilidad y ranking por campo, tipo de coincidencia e IDF.
+    Se carga completo al arrancar y se mantiene al día con las escrituras de
+    ServicioCRUD y ServicioPrestamos de este proceso y, a través de
+    SincronizacionLibros, con las de los demás.
+    """
+
+    def __init__(self, max_expansiones: int = 30, limite_puntuar: int = 2000):
+        self.max_expansiones = max_expansiones
+        self.limite_puntuar = limite_puntuar
+        self.cargando = False
+        # (titulo, autor) por id: una tupla ocupa la cuarta parte que un dict, y con un
+        # millón de libros es la mayor parte de la memoria del índice
+        self._docs: Dict[int, Tuple[str, str]] = {}
+        self._disponibles = set()
+        self._postings = {campo: {} for campo in PESO_CAMPO}
+        self._terminos = set()
+        self._vocabulario: List[str] = []
+        self._vocabulario_sucio = False
+        self._borrados: Dict[str, set] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _indexar_termino(self, termino: str) -> None:
+        if termino in self._terminos:
+            return
+        self._terminos.add(termino)
+        if self.cargando:
+            self._vocabulario_sucio = True
+        else:
+            insort(self._vocabulario, termino)
+        if len(termino) >= 4:
+            for variante in _variantes(termino) | {termino}:
+                self._borrados.setdefault(variante, set()).add(termino)
+
+    def agregar(self, id: int, datos: dict) -> None:
+        with self._lock:
+            if id in self._docs:
+                self.quitar(id)
+            # Un mismo autor firma muchos libros: se guarda una sola copia del texto
+            doc = (datos.get("titulo") or "", sys.intern(datos.get("autor") or ""))
+            self._docs[id] = doc
+            if datos.get("disponible", True):
+                self._disponibles.add(id)
+            for campo, texto in zip(PESO_CAMPO, doc):
+                for termino in set(tokenizar(texto)):
+                    self._postings[campo].setdefault(termino, set()).add(id)
+                    self._indexar_termino(termino)
+
+    def actualizar(self, id: int, datos: dict) -> None:
+        with self._lock:
+            actual = self._documento(id) if id in self._docs else {}
+            self.agregar(id, {**actual, **datos})
+
+    def quitar(self, id: int) -> None:
+        with self._lock:
+            doc = self._docs.pop(id, None)
+            if doc is None:
+                return
+            self._disponibles.discard(id)
+            for campo, texto in zip(PESO_CAMPO, doc):
+                for termino in set(tokenizar(texto)):
+                    ids = self._postings[campo].get(termino)
+                    if ids is not None:
+                        ids.discard(id)
+                        if not ids:
+                            del self._postings[campo][termino]
+
+    def marcar_disponible(self, id: int, disponible: bool) -> None:
+        with self._lock:
+            if id not in self._docs:
+                return
+            if disponible:
+                self._disponibles.add(id)
+            else:
+                self._disponibles.discard(id)
+
+    def _documento(self, id: int) -> dict:
+        titulo, autor = self._docs[id]
+        return {"id": id, "titulo": titulo, "autor": autor, "disponible": id in self._disponibles}
+
+    def terminar_carga(self) -> None:
+        with self._lock:
+            self.cargando = False
+            if self._vocabulario_sucio:
+                self._vocabulario = sorted(self._terminos)
+                self._vocabulario_sucio = False
+
+    def _expandir(self, token: str, prefijo: bool) -> Dict[str, float]:
+        """Términos del vocabulario que cubren el token: exacto, por prefijo o con una errata."""
+        if self._vocabulario_sucio:
+            self._vocabulario = sorted(self._terminos)
+            self._vocabulario_sucio = False
+        pesos = {}
+        if token in self._terminos:
+            pesos[token] = PESO_EXACTO
+        if prefijo and len(token) >= 2:
+            i = bisect_left(self._vocabulario, token)
+            encontrados = 0
+            while i < len(self._vocabulario) and encontrados < self.max_expansiones:
+                termino = self._vocabulario[i]
+                if not termino.startswith(token):
+                    break
+                pesos.setdefault(termino, PESO_PREFIJO)
+                encontrados += 1
+                i += 1
+        if len(token) >= 4:
+            for variante in _variantes(token) | {token}:
+                for termino in self._borrados.get(variante, ()):
+                    pesos.setdefault(termino, PESO_ERRATA)
+        return pesos
+
+    def _niveles(self, token: str, total_docs: int, prefijo: bool) -> List[Tuple[float, set]]:
+        # (peso, ids) por término y campo, de mayor a menor peso
+        niveles = []
+        for termino, peso in self._expandir(token, prefijo).items():
+            for campo, peso_campo in PESO_CAMPO.items():
+                ids = self._postings[campo].get(termino)
+                if ids:
+                    idf = math.log(1 + total_docs / len(ids))
+                    niveles.append((peso * peso_campo * idf, ids))
+        niveles.sort(key=lambda nivel: nivel[0], reverse=True)
+        return niveles
+
+    def _filtrar(self, trozo: set, disponible: Optional[bool], resto: List[List[Tuple[float, set]]],
+                 base: float) -> Dict[int, float]:
+        # Deja en el trozo solo los libros que coinciden con todos los tokens y suma a
+        # `base` el peso del mejor nivel de cada uno; todo son operaciones de conjuntos en C.
+        # Los diccionarios de puntajes y la disponibilidad se calculan ya sobre el
+        # trozo filtrado, que suele ser mucho menor
+        puntajes = None
+        for niveles in resto:
+            # Cada libro se lleva el primer nivel (el de más peso) en el que aparece
+            pesos = {}
+            faltan = trozo
+            ultimo = len(niveles) - 1
+            for i, (peso, ids) in enumerate(niveles):
+                encontrados = faltan & ids
+                if encontrados:
+                    pesos.update(dict.fromkeys(encontrados, peso if puntajes is not None else peso + base))
+                    if i == ultimo:
+                        break
+                    faltan = faltan - encontrados
+                    if not faltan:
+                        break
+            trozo = pesos.keys()
+            puntajes = pesos if puntajes is None else {id: puntajes[id] + peso for id, peso in pesos.items()}
+            if not pesos:
+                return {}
+        if disponible is True:
+            trozo = self._disponibles.intersection(trozo)
+        elif disponible is False:
+            trozo = set(trozo).difference(self._disponibles)
+        else:
+            return puntajes if puntajes is not None else dict.fromkeys(trozo, base)
+        if puntajes is None:
+            return dict.fromkeys(trozo, base)
+        return {id: puntajes[id] for id in trozo}
+
+    def buscar(self, consulta: str, disponible: Optional[bool] = None,
+               limite: int = 20, desplazamiento: int = 0) -> Tuple[List[dict], int, bool]:
+        """Devuelve (resultados de la página, total de coincidencias, si el total es exacto).
+
+        Los libros se recorren por niveles de peso del token más selectivo y en
+        trozos; al reunir `limite_puntuar` candidatos se deja de buscar, así que
+        en consultas muy genéricas el total es una cota inferior.
+        """
+        tokens = list(dict.fromkeys(tokenizar(consulta)))
+        significativos = [t for t in tokens if t not in PALABRAS_VACIAS]
+        # El último token se trata como prefijo: es el que el usuario está escribiendo
+        prefijo = bool(significativos) and significativos[-1] == tokens[-1]
+        tokens = significativos or tokens
+        if not tokens:
+            return [], 0, True
+        with self._lock:
+            total_docs = max(len(self._docs), 1)
+            niveles_por_token = [
+                self._niveles(token, total_docs, prefijo=prefijo and i == len(tokens) - 1)
+                for i, token in enumerate(tokens)
+            ]
+            if any(not niveles for niveles in niveles_por_token):
+                return [], 0, True
+            niveles_por_token.sort(key=lambda niveles: sum(len(ids) for _, ids in niveles))
+            principal, resto = niveles_por_token[0], niveles_por_token[1:]
+            necesarios = desplazamiento + limite
+            objetivo = max(self.limite_puntuar, necesarios)
+
+            # Fracción estimada de los libros del token principal que pasan el filtro: si
+            # un nivel entero no llega al objetivo no se podrá cortar pronto, así que se
+            # filtra de una vez y sin copiarlo en trozos
+            fraccion = math.prod(min(1.0, sum(len(ids) for _, ids in niveles) / total_docs) for niveles in resto)
+            if disponible is not None:
+                disponibles = len(self._disponibles) if disponible else total_docs - len(self._disponibles)
+                fraccion *= disponibles / total_docs
+
+            puntajes: Dict[int, float] = {}
+            exacto = True
+            for nivel, (peso, ids) in enumerate(principal):
+                entero = len(ids) * fraccion < objetivo - len(puntajes)
+                iterador = iter(ids)
+                while exacto:
+                    if entero:
+                        trozo, entero, iterador = ids, False, iter(())
+                    else:
+                        trozo = set(islice(iterador, TAMANO_TROZO))
+                    if not trozo:
+                        break
+                    # Los trozos de un mismo nivel no se solapan; con los de niveles anteriores sí
+                    if nivel and puntajes:
+                        trozo = trozo.difference(puntajes)
+                    puntajes.update(self._filtrar(trozo, disponible, resto, peso))
+                    if len(puntajes) >= objetivo:
+                        exacto = False
+                if not exacto:
+                    break
+
+            mejores = heapq.nlargest(necesarios, ((puntaje, -id) for id, puntaje in puntajes.items()))
+            resultados = []
+            for valor, id_negativo in mejores[desplazamiento:]:
+                doc = self._documento(-id_negativo)
+                doc["puntaje"] = round(valor, 4)
+                resultados.append(doc)
+            return resultados, len(puntajes), exacto
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "libros": len(self._docs),
+                "disponibles": len(self._disponibles),
+                "terminos": len(self._terminos),
+                "cargando": self.cargando,
+            }
+
+class SincronizacionLibros:
+    """Carga el índice desde la tabla libro y le aplica los cambios de cualquier proceso.
+
+    Los triggers de libro_cambio (migración 0009) apuntan cada libro escrito;
+    sincronizar() lee los cambios posteriores al último visto y relee esos
+    libros. Un id que falta por debajo del último puede ser de una transacción
+    sin confirmar todavía, así que se vuelve a pedir durante ESPERA_HUECOS
+    segundos. Usa el pool síncrono: se llama desde un hilo para no ocupar el
+    bucle de eventos.
+    """
+
+    ESPERA_HUECOS = 60.0
+    MAX_HUECOS = 10000
+    # Los cambios se conservan al menos este tiempo antes de borrarse
+    RETENCION = 3600.0
+    LOTE = 1000
+
+    def __init__(self, bd, indice: IndiceLibros):
+        self.bd = bd
+        self.indice = indice
+        self.ultimo: Optional[int] = None
+        self.huecos: Dict[int, float] = {}
+        self.aplicados = 0
+        self._purga: Optional[Tuple[float, int]] = None
+        self.detenida = False
+
+    def cargar(self, lote: int = 5000) -> None:
+        """Carga completa; los cambios que lleguen durante la carga los aplica la siguiente sincronización."""
+        with self.bd.obtener_cursor() as (cursor, _):
+            cursor.execute(consultas.SQL_ULTIMO_CAMBIO_LIBRO)
+            self.ultimo = int(cursor.fetchone()["ultimo"])
+        self.indice.cargando = True
+        try:
+            for filas in self.bd.iterar(consultas.SQL_LIBROS_INDICE, lote=lote):
+                if self.detenida:
+                    break
+                for row in filas:
+                    self.indice.agregar(row["id"], row)
+        finally:
+            self.indice.terminar_carga()
+
+    def sincronizar(self) -> int:
+        """Aplica los cambios pendientes y devuelve cuántos libros se releyeron."""
+        if self.ultimo is None or self.detenida:
+            return 0
+        ahora = time.monotonic()
+        self.huecos = {id: visto for id, visto in self.huecos.items() if ahora - visto < self.ESPERA_HUECOS}
+        with self.bd.obtener_cursor() as (cursor, conexion):
+            cursor.execute(consultas.SQL_CAMBIOS_LIBRO, (self.ultimo,))
+            cambios = list(cursor.fetchall())
+            if self.huecos:
+                cursor.execute(consultas.cambios_libro(len(self.huecos)), list(self.huecos))
+                cambios += cursor.fetchall()
+            ids = set()
+            for cambio in cambios:
+                id = cambio["id"]
+                self.huecos.pop(id, None)
+                if id > self.ultimo:
+                    for hueco in range(self.ultimo + 1, id):
+                        if len(self.huecos) >= self.MAX_HUECOS:
+                            break
+                        self.huecos.setdefault(hueco, ahora)
+                    self.ultimo = id
+                ids.add(cambio["id_libro"])
+            ids = sorted(ids)
+            for i in range(0, len(ids), self.LOTE):
+                trozo = ids[i:i + self.LOTE]
+                cursor.execute(consultas.libros_por_id(len(trozo)), trozo)
+                encontrados = {row["id"]: row for row in cursor.fetchall()}
+                for id in trozo:
+                    if id in encontrados:
+                        self.indice.agregar(id, encontrados[id])
+                    else:
+                        self.indice.quitar(id)
+            self._purgar(cursor, conexion, ahora)
+        self.aplicados += len(ids)
+        return len(ids)
+
+    def _purgar(self, cursor, conexion, ahora: float) -> None:
+        # Borra los cambios que ya se veían hace RETENCION segundos: todos los workers
+        # vivos los han aplicado hace mucho
+        if self._purga is None or ahora - self._purga[0] >= self.RETENCION:
+            if self._purga is not None:
+                cursor.execute("DELETE FROM libro_cambio WHERE id <= %s", (self._purga[1],))
+                conexion.commit()
+            self._purga = (ahora, self.ultimo)
+
+    def detener(self) -> None:
+        # Al cerrar la app: la carga se corta en el siguiente lote
+        self.detenida = True
+
+    def estadisticas(self) -> dict:
+        return {"ultimo_cambio": self.ultimo, "huecos": len(self.huecos), "releidos": self.aplicados}
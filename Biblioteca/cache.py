@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+class Entrada:
+    __slots__ = ("valor", "etag", "expira")
+
+    def __init__(self, valor: Any, etag: str, expira: float):
+        self.valor = valor
+        self.etag = etag
+        self.expira = expira
+
+class CacheLecturas:
+    """Cache en proceso TTL + LRU para lecturas frecuentes.
+
+    Las claves se agrupan por espacio (normalmente el nombre de la tabla).
+    Invalidar un espacio incrementa su versión, así que las entradas antiguas
+    dejan de ser alcanzables en O(1) y el LRU las desaloja con el tiempo.
+    Cada entrada guarda un ETag calculado sobre su contenido.
+    """
+
+    def __init__(self, maximo: int = 1024, ttl: float = 30.0):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._entradas: "OrderedDict[tuple, Entrada]" = OrderedDict()
+        self._versiones: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.invalidaciones = 0
+
+    def _clave(self, espacio: str, clave: Hashable) -> tuple:
+        return (espacio, self._versiones.get(espacio, 0), clave)
+
+    @staticmethod
+    def _calcular_etag(valor: Any) -> str:
+        contenido = json.dumps(valor, default=str, sort_keys=True, separators=(",", ":"))
+        return '"' + hashlib.blake2b(contenido.encode("utf-8"), digest_size=12).hexdigest() + '"'
+
+    def consultar(self, espacio: str, clave: Hashable) -> Optional[Entrada]:
+        with self._lock:
+            completa = self._clave(espacio, clave)
+            entrada = self._entradas.get(completa)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            if entrada.expira < time.monotonic():
+                del self._entradas[completa]
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(completa)
+            self.aciertos += 1
+            return entrada
+
+    def guardar(self, espacio: str, clave: Hashable, valor: Any, version: Optional[int] = None) -> Entrada:
+        entrada = Entrada(valor, self._calcular_etag(valor), time.monotonic() + self.ttl)
+        with self._lock:
+            # Si hubo una invalidación mientras se cargaba el valor, no se guarda
+            if version is not None and version != self._versiones.get(espacio, 0):
+                return entrada
+            completa = self._clave(espacio, clave)
+            self._entradas[completa] = entrada
+            self._entradas.move_to_end(completa)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+                self.desalojos += 1
+        return entrada
+
+    def obtener(self, espacio: str, clave: Hashable, cargar: Callable[[], Any]) -> Entrada:
+        entrada = self.consultar(espacio, clave)
+        if entrada is None:
+            version = self._versiones.get(espacio, 0)
+            entrada = self.guardar(espacio, clave, cargar(), version)
+        return entrada
+
+    async def obtener_async(self, espacio: str, clave: Hashable, cargar: Callable[[], Any]) -> Entrada:
+        entrada = self.consultar(espacio, clave)
+        if entrada is None:
+            version = self._versiones.get(espacio, 0)
+            entrada = self.guardar(espacio, clave, await cargar(), version)
+        return entrada
+
+    def version(self, espacio: str) -> int:
+        return self._versiones.get(espacio, 0)
+
+    def invalidar(self, *espacios: str) -> None:
+        with self._lock:
+            for espacio in espacios:
+                self._versiones[espacio] = self._versiones.get(espacio, 0) + 1
+                self.invalidaciones += 1
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "maximo": self.maximo,
+                "ttl": self.ttl,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "ratio_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+                "desalojos": self.desalojos,
+                "invalidaciones": self.invalidaciones,
+            }
+
+class CacheReportes:
+    """Cache en disco de PDFs ya generados, direccionada por contenido.
+
+    La clave es un hash del tipo de reporte, los filtros normalizados y la
+    versión de los datos de las tablas que usa. Cuando el tamaño total supera
+    `maximo_bytes` se borran primero los archivos usados hace más tiempo.
+    """
+
+    def __init__(self, directorio: str, maximo_bytes: int = 256 * 1024 * 1024):
+        self.directorio = directorio
+        self.maximo_bytes = maximo_bytes
+        self._lock = threading.Lock()
+        self._archivos: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        os.makedirs(directorio, exist_ok=True)
+        self._cargar_indice()
+
+    def _cargar_indice(self) -> None:
+        existentes = []
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            if nombre.endswith(".pdf") and os.path.isfile(ruta):
+                info = os.stat(ruta)
+                existentes.append((info.st_mtime, nombre[:-4], info.st_size))
+        for _, clave, tamano in sorted(existentes):
+            self._archivos[clave] = tamano
+            self._total += tamano
+
+    @staticmethod
+    def clave(tipo: str, filtros: Optional[dict], version: str) -> str:
+        contenido = json.dumps({"tipo": tipo, "filtros": filtros or {}, "version": version},
+                               default=str, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, f"{clave}.pdf")
+
+    def obtener(self, clave: str) -> Optional[bytes]:
+        with self._lock:
+            if clave not in self._archivos:
+                self.fallos += 1
+                return None
+            self._archivos.move_to_end(clave)
+        try:
+            with open(self._ruta(clave), "rb") as archivo:
+                datos = archivo.read()
+            os.utime(self._ruta(clave))
+        except OSError:
+            with self._lock:
+                self._total -= self._archivos.pop(clave, 0)
+                self.fallos += 1
+            return None
+        with self._lock:
+            self.aciertos += 1
+        return datos
+
+    def guardar(self, clave: str, datos) -> None:
+        """Guarda `datos`, que pueden ser bytes o un archivo binario abierto."""
+        ruta = self._ruta(clave)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "wb") as archivo:
+            if isinstance(datos, (bytes, bytearray)):
+                archivo.write(datos)
+            else:
+                shutil.copyfileobj(datos, archivo)
+            tamano = archivo.tell()
+        if tamano > self.maximo_bytes:
+            os.remove(temporal)
+            return
+        os.replace(temporal, ruta)
+        with self._lock:
+            self._total -= self._archivos.pop(clave, 0)
+            self._archivos[clave] = tamano
+            self._total += tamano
+            while self._total > self.maximo_bytes and self._archivos:
+                antigua, tamano = self._archivos.popitem(last=False)
+                self._total -= tamano
+                self.desalojos += 1
+                try:
+                    os.remove(self._ruta(antigua))
+                except OSError:
+                    pass
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "archivos": len(self._archivos),
+                "bytes": self._total,
+                "maximo_bytes": self.maximo_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "ratio_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+                "desalojos": self.desalojos,
+            }
@@ -0,0 +1,158 @@
+"""SQL de los servicios de main.py.
+
+Vive aparte para que `python migrar.py verificar` ejecute EXPLAIN sobre las
+mismas consultas que lanzan los servicios sin importar main (que abre los
+pools al cargarse). Las consultas que dependen de filtros se construyen con
+funciones que devuelven (query, valores).
+"""
+from datetime import date
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+COLUMNAS_LIBRO = ("id", "titulo", "autor", "disponible")
+COLUMNAS_USUARIO = ("id", "nombre", "correo")
+
+SQL_LIBROS_DISPONIBLES = "SELECT id, titulo, autor, disponible FROM libro WHERE disponible = 1 ORDER BY id"
+
+SQL_LIBROS_INDICE = "SELECT id, titulo, autor, disponible FROM libro ORDER BY id"
+
+SQL_ULTIMO_CAMBIO_LIBRO = "SELECT COALESCE(MAX(id), 0) AS ultimo FROM libro_cambio"
+
+SQL_CAMBIOS_LIBRO = "SELECT id, id_libro FROM libro_cambio WHERE id > %s ORDER BY id"
+
+def cambios_libro(n: int) -> str:
+    # Cambios que faltaban en la lectura anterior (ids de transacciones sin confirmar)
+    return f"SELECT id, id_libro FROM libro_cambio WHERE id IN ({', '.join(['%s'] * n)})"
+
+def libros_por_id(n: int) -> str:
+    return f"SELECT id, titulo, autor, disponible FROM libro WHERE id IN ({', '.join(['%s'] * n)})"
+
+SQL_PRESTAMOS_INFO = """
+    SELECT p.id, l.titulo as libro, u.nombre as usuario,
+           p.fecha_prestamo, p.fecha_devolucion, p.devuelto
+    FROM prestamo p
+    JOIN libro l ON p.id_libro = l.id
+    JOIN usuario u ON p.id_usuario = u.id
+"""
+
+SQL_PRESTAMOS_VENCIDOS = "SELECT id FROM prestamo WHERE devuelto = 0 AND fecha_devolucion < %s ORDER BY id"
+
+SQL_NO_LEIDAS = """
+    SELECT (SELECT COUNT(*) FROM notificaciones WHERE usuario_id = u.id AND leida = 0) AS no_leidas
+    FROM usuario u WHERE u.id = %s
+"""
+
+SQL_CREAR_TIPO_REPORTE = "INSERT INTO tipo_reporte (descripcion) VALUES (%s)"
+
+SQL_LISTAR_REPORTES = """
+    SELECT r.id, r.fecha, tr.descripcion AS tipo_descripcion
+    FROM reporte r
+    JOIN tipo_reporte tr ON r.tipo_reporte = tr.id
+    ORDER BY r.fecha DESC
+"""
+
+def pagina_crud(tabla: str, columnas: Iterable[str], after_id: Optional[int], limite: Optional[int],
+                filtros: Dict[str, Any], prefijos: Dict[str, str]) -> Tuple[str, list]:
+    """Consulta de ServicioCRUD.listar_pagina: igualdades, prefijos LIKE y cursor por id."""
+    condiciones = []
+    valores = []
+    if after_id is not None:
+        condiciones.append("id > %s")
+        valores.append(after_id)
+    for columna, valor in filtros.items():
+        condiciones.append(f"{columna} = %s")
+        valores.append(valor)
+    for columna, prefijo in prefijos.items():
+        condiciones.append(f"{columna} LIKE %s ESCAPE '\\\\'")
+        valores.append(prefijo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+
+    query = f"SELECT {', '.join(columnas) or '*'} FROM {tabla}"
+    if condiciones:
+        query += " WHERE " + " AND ".join(condiciones)
+    query += " ORDER BY id"
+    if limite is not None:
+        # Se pide una fila de más para saber si existe otra página
+        query += " LIMIT %s"
+        valores.append(limite + 1)
+    return query, valores
+
+def pagina_prestamos(after_id: Optional[int], limite: Optional[int], filtros: Dict[str, Any],
+                     hoy: Optional[date] = None) -> Tuple[str, list]:
+    """Consulta de ServicioPrestamos.listar_pagina; el estado ya viene validado."""
+    condiciones = []
+    valores = []
+    if after_id is not None:
+        condiciones.append("p.id > %s")
+        valores.append(after_id)
+    estado = filtros.get("estado")
+    if estado in ("activo", "vencido"):
+        condiciones.append("p.devuelto = 0")
+    elif estado == "devuelto":
+        condiciones.append("p.devuelto = 1")
+    if estado == "vencido":
+        condiciones.append("p.fecha_devolucion < %s")
+        valores.append(hoy or date.today())
+    for filtro, condicion in (("id_usuario", "p.id_usuario = %s"), ("id_libro", "p.id_libro = %s"),
+                              ("desde", "p.fecha_prestamo >= %s"), ("hasta", "p.fecha_prestamo <= %s")):
+        if filtro in filtros:
+            condiciones.append(condicion)
+            valores.append(filtros[filtro])
+
+    query = SQL_PRESTAMOS_INFO
+    if condiciones:
+        query += " WHERE " + " AND ".join(condiciones)
+    query += " ORDER BY p.id"
+    if limite is not None:
+        # Se pide una fila de más para saber si hay otra página
+        query += " LIMIT %s"
+        valores.append(limite + 1)
+    return query, valores
+
+def condicion_notificaciones(antes: Optional[tuple], since_id: Optional[int]) -> tuple:
+    """Condición y orden de la página: por (fecha, id) descendente o, con since_id, solo las nuevas."""
+    if since_id is not None:
+        return "n.id > %s", [since_id], "n.id ASC"
+    if antes:
+        fecha, id = antes
+        return "(n.fecha < %s OR (n.fecha = %s AND n.id < %s))", [fecha, fecha, id], "n.fecha DESC, n.id DESC"
+    return "1 = 1", [], "n.fecha DESC, n.id DESC"
+
+def pagina_notificaciones(condicion: str, orden: str) -> str:
+    return f"""
+        SELECT n.id, n.usuario_id, u.nombre AS usuario, n.mensaje, n.fecha, n.leida
+        FROM notificaciones n
+        JOIN usuario u ON n.usuario_id = u.id
+        WHERE {condicion}
+        ORDER BY {orden}
+        LIMIT %s
+    """
+
+def pagina_notificaciones_usuario(condicion: str, orden: str) -> str:
+    # Parámetros: id_usuario dos veces, los de la condición y el límite
+    return f"""
+        SELECT u.nombre AS usuario, u.no_leidas, n.id, n.usuario_id, n.mensaje, n.fecha, n.leida
+        FROM (
+            SELECT id, nombre,
+                   (SELECT COUNT(*) FROM notificaciones WHERE usuario_id = %s AND leida = 0) AS no_leidas
+            FROM usuario WHERE id = %s
+        ) u
+        LEFT JOIN notificaciones n ON n.usuario_id = u.id AND {condicion}
+        ORDER BY {orden}
+        LIMIT %s
+    """
+
+def recordatorios_previos(n: int) -> str:
+    marcadores = ", ".join(["%s"] * n)
+    return f"SELECT id FROM notificaciones WHERE id_prestamo IN ({marcadores}) AND dia_recordatorio = %s"
+
+def insertar_recordatorios(n: int) -> str:
+    marcadores = ", ".join(["%s"] * n)
+    return f"""
+        INSERT IGNORE INTO notificaciones (usuario_id, mensaje, fecha, id_prestamo, dia_recordatorio)
+        SELECT p.id_usuario,
+               CONCAT('Recordatorio: el préstamo de "', l.titulo, '" venció el ',
+                      CAST(p.fecha_devolucion AS CHAR)),
+               CURRENT_TIMESTAMP, p.id, %s
+        FROM prestamo p
+        JOIN libro l ON p.id_libro = l.id
+        WHERE p.id IN ({marcadores}) AND p.devuelto = 0 AND p.id_usuario IS NOT NULL
+    """
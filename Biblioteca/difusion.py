@@ -0,0 +1,104 @@
+import asyncio
+from typing import Any, Dict, Optional
+
+class Suscripcion:
+    """Conexión de un cliente al difusor, con su propia cola acotada."""
+
+    def __init__(self, id_usuario: int, maximo: int):
+        self.id_usuario = id_usuario
+        self.cola: "asyncio.Queue[Optional[dict]]" = asyncio.Queue(maxsize=maximo)
+        self.descartadas = 0
+        self.cerrada = False
+
+    async def recibir(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """Siguiente mensaje; None si la suscripción se cerró. Lanza TimeoutError tras `timeout` segundos."""
+        if self.cerrada and self.cola.empty():
+            return None
+        mensaje = await asyncio.wait_for(self.cola.get(), timeout)
+        if mensaje is not None:
+            self.descartadas = 0
+        return mensaje
+
+    def _cerrar(self) -> None:
+        self.cerrada = True
+        # Se vacía la cola para que el aviso de cierre quepa y se lea enseguida
+        while not self.cola.empty():
+            self.cola.get_nowait()
+        self.cola.put_nowait(None)
+
+class DifusorNotificaciones:
+    """Pub/sub en proceso: reparte cada mensaje a las suscripciones de su usuario.
+
+    Cada suscripción tiene una cola de `max_cola` mensajes. Si un cliente no la
+    vacía a tiempo se descartan sus mensajes más antiguos; cuando acumula
+    `max_descartes` descartes seguidos se le desconecta (el cliente se vuelve a
+    conectar con since_id y recupera lo perdido de la BD). Solo alcanza a los
+    clientes conectados a este proceso.
+    """
+
+    def __init__(self, max_cola: int = 100, max_descartes: int = 100, max_suscripciones: int = 10000):
+        self.max_cola = max_cola
+        self.max_descartes = max_descartes
+        self.max_suscripciones = max_suscripciones
+        self._suscripciones: Dict[int, set] = {}
+        self._total = 0
+        self.publicados = 0
+        self.entregados = 0
+        self.descartados = 0
+        self.desconectados = 0
+
+    def suscribir(self, id_usuario: int) -> Optional[Suscripcion]:
+        """Nueva suscripción para el usuario, o None si se alcanzó `max_suscripciones`."""
+        if self._total >= self.max_suscripciones:
+            return None
+        suscripcion = Suscripcion(id_usuario, self.max_cola)
+        self._suscripciones.setdefault(id_usuario, set()).add(suscripcion)
+        self._total += 1
+        return suscripcion
+
+    def cancelar(self, suscripcion: Suscripcion) -> None:
+        suscripciones = self._suscripciones.get(suscripcion.id_usuario)
+        if suscripciones and suscripcion in suscripciones:
+            suscripciones.discard(suscripcion)
+            self._total -= 1
+            if not suscripciones:
+                del self._suscripciones[suscripcion.id_usuario]
+
+    def publicar(self, id_usuario: int, mensaje: Dict[str, Any]) -> int:
+        """Encola el mensaje para cada conexión del usuario y devuelve a cuántas llegó."""
+        self.publicados += 1
+        entregados = 0
+        for suscripcion in list(self._suscripciones.get(id_usuario, ())):
+            if suscripcion.cerrada:
+                continue
+            if suscripcion.cola.full():
+                suscripcion.cola.get_nowait()
+                suscripcion.descartadas += 1
+                self.descartados += 1
+                if suscripcion.descartadas >= self.max_descartes:
+                    suscripcion._cerrar()
+                    self.cancelar(suscripcion)
+                    self.desconectados += 1
+                    continue
+            suscripcion.cola.put_nowait(mensaje)
+            entregados += 1
+        self.entregados += entregados
+        return entregados
+
+    def cerrar(self) -> None:
+        for suscripciones in list(self._suscripciones.values()):
+            for suscripcion in list(suscripciones):
+                suscripcion._cerrar()
+                self.cancelar(suscripcion)
+
+    def estadisticas(self) -> dict:
+        return {
+            "suscripciones": self._total,
+            "usuarios": len(self._suscripciones),
+            "max_suscripciones": self.max_suscripciones,
+            "max_cola": self.max_cola,
+            "publicados": self.publicados,
+            "entregados": self.entregados,
+            "descartados": self.descartados,
+            "desconectados": self.desconectados,
+        }
@@ -0,0 +1,241 @@
+--
+-- Esquema de biblioteca.sql con las migraciones 0001-0009 aplicadas, en dialecto SQLite.
+-- Lo ejecuta el backend SQLite (bd_sqlite.py) sobre una base sin tablas. Cada migración
+-- nueva de MySQL debe reflejarse aquí; las sentencias son idempotentes. COLLATE NOCASE
+-- imita la colación utf8mb4_general_ci (y permite usar el índice en LIKE 'x%')
+--
+
+CREATE TABLE IF NOT EXISTS libro (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  titulo VARCHAR(255) NOT NULL COLLATE NOCASE,
+  autor VARCHAR(255) NOT NULL COLLATE NOCASE,
+  disponible TINYINT DEFAULT 1,
+  carga CHAR(32) DEFAULT NULL
+);
+CREATE INDEX IF NOT EXISTS libro_disponible_id ON libro (disponible, id);
+CREATE INDEX IF NOT EXISTS libro_carga ON libro (carga);
+CREATE INDEX IF NOT EXISTS libro_autor_id ON libro (autor, id);
+CREATE INDEX IF NOT EXISTS libro_titulo ON libro (titulo);
+
+CREATE TABLE IF NOT EXISTS usuario (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  nombre VARCHAR(255) NOT NULL,
+  correo VARCHAR(255) NOT NULL COLLATE NOCASE,
+  usuario VARCHAR(50) COLLATE NOCASE,
+  hashed_password VARCHAR(100)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS usuario_correo ON usuario (correo);
+CREATE UNIQUE INDEX IF NOT EXISTS usuario_usuario ON usuario (usuario);
+
+CREATE TABLE IF NOT EXISTS prestamo (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  id_libro INTEGER REFERENCES libro (id),
+  id_usuario INTEGER REFERENCES usuario (id),
+  fecha_prestamo DATE NOT NULL,
+  fecha_devolucion DATE DEFAULT NULL,
+  devuelto TINYINT DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS prestamo_vencidos ON prestamo (devuelto, fecha_devolucion);
+CREATE INDEX IF NOT EXISTS prestamo_devuelto_id ON prestamo (devuelto, id);
+CREATE INDEX IF NOT EXISTS prestamo_usuario_devuelto ON prestamo (id_usuario, devuelto, id);
+CREATE INDEX IF NOT EXISTS prestamo_libro_devuelto ON prestamo (id_libro, devuelto, id);
+CREATE INDEX IF NOT EXISTS prestamo_fecha_prestamo ON prestamo (fecha_prestamo, id);
+
+CREATE TABLE IF NOT EXISTS notificaciones (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  usuario_id INTEGER NOT NULL REFERENCES usuario (id) ON DELETE CASCADE,
+  mensaje TEXT NOT NULL,
+  fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+  leida TINYINT NOT NULL DEFAULT 0,
+  id_prestamo INTEGER DEFAULT NULL,
+  dia_recordatorio DATE DEFAULT NULL
+);
+CREATE INDEX IF NOT EXISTS notificaciones_usuario_fecha ON notificaciones (usuario_id, fecha, id);
+CREATE INDEX IF NOT EXISTS notificaciones_fecha_id ON notificaciones (fecha, id);
+CREATE INDEX IF NOT EXISTS notificaciones_usuario_leida ON notificaciones (usuario_id, leida);
+CREATE INDEX IF NOT EXISTS notificaciones_usuario_id ON notificaciones (usuario_id, id);
+CREATE UNIQUE INDEX IF NOT EXISTS notificaciones_recordatorio ON notificaciones (id_prestamo, dia_recordatorio);
+
+CREATE TABLE IF NOT EXISTS tipo_reporte (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  descripcion VARCHAR(100) DEFAULT NULL COLLATE NOCASE
+);
+CREATE UNIQUE INDEX IF NOT EXISTS tipo_reporte_descripcion ON tipo_reporte (descripcion);
+INSERT OR IGNORE INTO tipo_reporte (id, descripcion) VALUES (1, 'Tabla'), (2, 'Grafico'), (3, 'Comprobante');
+
+CREATE TABLE IF NOT EXISTS reporte (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+  tipo_reporte INTEGER REFERENCES tipo_reporte (id)
+);
+CREATE INDEX IF NOT EXISTS reporte_fecha ON reporte (fecha);
+
+CREATE TABLE IF NOT EXISTS trabajo_reporte (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  tipo VARCHAR(100) NOT NULL,
+  filtros TEXT DEFAULT NULL,
+  estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+  error TEXT DEFAULT NULL,
+  archivo VARCHAR(255) DEFAULT NULL,
+  creado DATETIME DEFAULT CURRENT_TIMESTAMP,
+  actualizado DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS trabajo_reporte_estado ON trabajo_reporte (estado);
+-- ON UPDATE current_timestamp() de MySQL
+CREATE TRIGGER IF NOT EXISTS trabajo_reporte_actualizado AFTER UPDATE ON trabajo_reporte
+BEGIN
+  UPDATE trabajo_reporte SET actualizado = CURRENT_TIMESTAMP WHERE id = NEW.id;
+END;
+
+CREATE TABLE IF NOT EXISTS estadistica_libro (
+  id_libro INTEGER PRIMARY KEY,
+  prestamos INTEGER NOT NULL DEFAULT 0,
+  activos INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS estadistica_libro_prestamos ON estadistica_libro (prestamos);
+
+CREATE TABLE IF NOT EXISTS estadistica_mes (
+  mes CHAR(7) NOT NULL,
+  slot TINYINT NOT NULL DEFAULT 0,
+  prestamos INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (mes, slot)
+);
+
+CREATE TABLE IF NOT EXISTS estadistica_usuario (
+  id_usuario INTEGER PRIMARY KEY,
+  prestamos INTEGER NOT NULL DEFAULT 0,
+  activos INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS estadistica_usuario_prestamos ON estadistica_usuario (prestamos);
+
+-- Versión de cada tabla de los reportes (migración 0007). SQLite tiene un único
+-- escritor, así que basta con una ranura
+CREATE TABLE IF NOT EXISTS version_tabla (
+  tabla VARCHAR(64) NOT NULL,
+  ranura TINYINT NOT NULL DEFAULT 0,
+  version INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (tabla, ranura)
+);
+CREATE TRIGGER IF NOT EXISTS libro_version_insert AFTER INSERT ON libro
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('libro', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS libro_version_update AFTER UPDATE ON libro
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('libro', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS libro_version_delete AFTER DELETE ON libro
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('libro', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS usuario_version_insert AFTER INSERT ON usuario
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('usuario', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS usuario_version_update AFTER UPDATE ON usuario
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('usuario', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS usuario_version_delete AFTER DELETE ON usuario
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('usuario', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS prestamo_version_insert AFTER INSERT ON prestamo
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('prestamo', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS prestamo_version_update AFTER UPDATE ON prestamo
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('prestamo', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS prestamo_version_delete AFTER DELETE ON prestamo
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('prestamo', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS reporte_version_insert AFTER INSERT ON reporte
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('reporte', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS reporte_version_update AFTER UPDATE ON reporte
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('reporte', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS reporte_version_delete AFTER DELETE ON reporte
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('reporte', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS tipo_reporte_version_insert AFTER INSERT ON tipo_reporte
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('tipo_reporte', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS tipo_reporte_version_update AFTER UPDATE ON tipo_reporte
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('tipo_reporte', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS tipo_reporte_version_delete AFTER DELETE ON tipo_reporte
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('tipo_reporte', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS estadistica_libro_version_insert AFTER INSERT ON estadistica_libro
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('estadistica_libro', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS estadistica_libro_version_update AFTER UPDATE ON estadistica_libro
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('estadistica_libro', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS estadistica_libro_version_delete AFTER DELETE ON estadistica_libro
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('estadistica_libro', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS estadistica_mes_version_insert AFTER INSERT ON estadistica_mes
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('estadistica_mes', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS estadistica_mes_version_update AFTER UPDATE ON estadistica_mes
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('estadistica_mes', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS estadistica_mes_version_delete AFTER DELETE ON estadistica_mes
+BEGIN
+  INSERT INTO version_tabla (tabla, ranura, version) VALUES ('estadistica_mes', 0, 1)
+  ON CONFLICT (tabla, ranura) DO UPDATE SET version = version + 1;
+END;
+
+-- Registro de cambios de libro para los índices de búsqueda (migración 0009)
+CREATE TABLE IF NOT EXISTS libro_cambio (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  id_libro INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS libro_cambio_insert AFTER INSERT ON libro
+BEGIN
+  INSERT INTO libro_cambio (id_libro) VALUES (NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS libro_cambio_update AFTER UPDATE ON libro
+BEGIN
+  INSERT INTO libro_cambio (id_libro) VALUES (NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS libro_cambio_delete AFTER DELETE ON libro
+BEGIN
+  INSERT INTO libro_cambio (id_libro) VALUES (OLD.id);
+END;
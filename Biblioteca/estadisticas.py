@@ -0,0 +1,152 @@
+"""Estadísticas de préstamos preagregadas.
+
+Los contadores por libro, por mes y por usuario se actualizan en la misma
+transacción que crea o devuelve un préstamo, de modo que las consultas del
+reporte gráfico y del API no recorren la tabla prestamo. Si los contadores se
+desincronizan (carga directa en la BD, datos previos) se reconstruyen con:
+
+    python estadisticas.py reconstruir
+"""
+import random
+import sys
+from datetime import date
+from typing import List, Optional
+
+# El mes actual lo actualizan todos los préstamos: se reparte en varias filas
+# (slots) para que las transacciones concurrentes no esperen por el mismo bloqueo
+SLOTS_MES = 8
+
+SQL_TOP_LIBROS = """
+    SELECT e.id_libro, l.titulo, e.prestamos, e.activos
+    FROM estadistica_libro e
+    JOIN libro l ON e.id_libro = l.id
+    ORDER BY e.prestamos DESC
+    LIMIT %s
+"""
+
+SQL_PRESTAMOS_POR_MES = """
+    SELECT mes, SUM(prestamos) AS prestamos
+    FROM estadistica_mes
+    GROUP BY mes
+    ORDER BY mes
+"""
+
+SQL_PRESTAMOS_POR_USUARIO = """
+    SELECT e.id_usuario, u.nombre AS usuario, e.prestamos, e.activos
+    FROM estadistica_usuario e
+    JOIN usuario u ON e.id_usuario = u.id
+"""
+
+async def registrar_prestamo(cursor, id_libro: int, id_usuario: int, fecha: date) -> None:
+    await cursor.execute(
+        """INSERT INTO estadistica_libro (id_libro, prestamos, activos) VALUES (%s, 1, 1)
+           ON DUPLICATE KEY UPDATE prestamos = prestamos + 1, activos = activos + 1""",
+        (id_libro,)
+    )
+    await cursor.execute(
+        """INSERT INTO estadistica_usuario (id_usuario, prestamos, activos) VALUES (%s, 1, 1)
+           ON DUPLICATE KEY UPDATE prestamos = prestamos + 1, activos = activos + 1""",
+        (id_usuario,)
+    )
+    await cursor.execute(
+        """INSERT INTO estadistica_mes (mes, slot, prestamos) VALUES (%s, %s, 1)
+           ON DUPLICATE KEY UPDATE prestamos = prestamos + 1""",
+        (fecha.strftime("%Y-%m"), random.randrange(SLOTS_MES))
+    )
+
+async def registrar_devoluciones(cursor, prestamos: List[dict]) -> None:
+    """Resta un préstamo activo por cada fila (con id_libro e id_usuario) a su libro y usuario."""
+    if not prestamos:
+        return
+    # Un libro tiene como mucho un préstamo activo; un usuario puede tener varios
+    libros = [p["id_libro"] for p in prestamos]
+    await cursor.execute(
+        f"UPDATE estadistica_libro SET activos = GREATEST(activos - 1, 0) "
+        f"WHERE id_libro IN ({', '.join(['%s'] * len(libros))})",
+        libros
+    )
+    por_usuario = {}
+    for p in prestamos:
+        por_usuario[p["id_usuario"]] = por_usuario.get(p["id_usuario"], 0) + 1
+    por_cantidad = {}
+    for id_usuario, cantidad in por_usuario.items():
+        por_cantidad.setdefault(cantidad, []).append(id_usuario)
+    for cantidad, usuarios in por_cantidad.items():
+        await cursor.execute(
+            f"UPDATE estadistica_usuario SET activos = GREATEST(activos - %s, 0) "
+            f"WHERE id_usuario IN ({', '.join(['%s'] * len(usuarios))})",
+            [cantidad] + usuarios
+        )
+
+class ServicioEstadisticas:
+    def __init__(self, bd):
+        self.bd = bd
+
+    async def top_libros(self, n: int = 5) -> List[dict]:
+        async with self.bd.obtener_cursor() as (cursor, _):
+            await cursor.execute(SQL_TOP_LIBROS, (n,))
+            return await cursor.fetchall()
+
+    async def prestamos_por_mes(self, desde: Optional[str] = None, hasta: Optional[str] = None) -> List[dict]:
+        async with self.bd.obtener_cursor() as (cursor, _):
+            await cursor.execute(SQL_PRESTAMOS_POR_MES)
+            meses = await cursor.fetchall()
+        return [
+            {"mes": row["mes"], "prestamos": int(row["prestamos"])}
+            for row in meses
+            if (not desde or row["mes"] >= desde) and (not hasta or row["mes"] <= hasta)
+        ]
+
+    async def prestamos_por_usuario(self, n: int = 10) -> List[dict]:
+        async with self.bd.obtener_cursor() as (cursor, _):
+            await cursor.execute(SQL_PRESTAMOS_POR_USUARIO + " ORDER BY e.prestamos DESC LIMIT %s", (n,))
+            return await cursor.fetchall()
+
+    async def prestamos_de_usuario(self, id_usuario: int) -> Optional[dict]:
+        async with self.bd.obtener_cursor() as (cursor, _):
+            await cursor.execute(SQL_PRESTAMOS_POR_USUARIO + " WHERE e.id_usuario = %s", (id_usuario,))
+            return await cursor.fetchone()
+
+def recalcular(cursor) -> dict:
+    """Rehace los contadores desde la tabla prestamo sin hacer commit."""
+    cursor.execute("DELETE FROM estadistica_libro")
+    cursor.execute("DELETE FROM estadistica_usuario")
+    cursor.execute("DELETE FROM estadistica_mes")
+    cursor.execute("""
+        INSERT INTO estadistica_libro (id_libro, prestamos, activos)
+        SELECT id_libro, COUNT(*), SUM(devuelto = 0)
+        FROM prestamo
+        WHERE id_libro IS NOT NULL
+        GROUP BY id_libro
+    """)
+    libros = cursor.rowcount
+    cursor.execute("""
+        INSERT INTO estadistica_usuario (id_usuario, prestamos, activos)
+        SELECT id_usuario, COUNT(*), SUM(devuelto = 0)
+        FROM prestamo
+        WHERE id_usuario IS NOT NULL
+        GROUP BY id_usuario
+    """)
+    usuarios = cursor.rowcount
+    cursor.execute("""
+        INSERT INTO estadistica_mes (mes, slot, prestamos)
+        SELECT DATE_FORMAT(fecha_prestamo, '%Y-%m'), 0, COUNT(*)
+        FROM prestamo
+        GROUP BY DATE_FORMAT(fecha_prestamo, '%Y-%m')
+    """)
+    meses = cursor.rowcount
+    return {"libros": libros, "usuarios": usuarios, "meses": meses}
+
+def reconstruir(bd) -> dict:
+    """Recalcula todos los contadores desde la tabla prestamo en una transacción."""
+    with bd.obtener_cursor() as (cursor, conexion):
+        resultado = recalcular(cursor)
+        conexion.commit()
+    return resultado
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["reconstruir"]:
+        print("Uso: python estadisticas.py reconstruir")
+        sys.exit(1)
+    from conexion_bd import ConexionBD
+    print(reconstruir(ConexionBD()))
@@ -0,0 +1,85 @@
+import logging
+from io import BytesIO
+from typing import Any, Dict, List
+
+from reportlab.lib.units import inch
+from reportlab.platypus import Image
+
+logger = logging.getLogger("uvicorn.error")
+
+# Plantillas reutilizables: tamaño de la figura, estilo y tamaño final dentro del PDF
+PLANTILLAS = {
+    "prestamos": {
+        "figsize": (8, 5),
+        "dpi": 100,
+        "color_barras": "#4e73df",
+        "color_linea": "#16ad76",
+        "rotacion": 45,
+        "ancho": 6 * inch,
+        "alto": 4 * inch,
+    },
+}
+
+def _crear_figura(plantilla: Dict[str, Any]):
+    # API orientada a objetos de matplotlib: cada figura tiene su propio canvas Agg
+    # y no se toca el estado global de pyplot, por lo que es seguro en hilos.
+    # Se importa aquí para no pagar la carga de matplotlib al arrancar la app.
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figura = Figure(figsize=plantilla["figsize"], dpi=plantilla["dpi"])
+    FigureCanvasAgg(figura)
+    return figura
+
+def _como_imagen(figura, plantilla: Dict[str, Any]) -> Image:
+    buf = BytesIO()
+    figura.savefig(buf, format="png", bbox_inches="tight")
+    buf.seek(0)
+    return Image(buf, width=plantilla["ancho"], height=plantilla["alto"])
+
+def _como_dibujo(figura, plantilla: Dict[str, Any]):
+    # svglib convierte el SVG en un Drawing de reportlab: el gráfico queda vectorial
+    # dentro del PDF. Es opcional; sin él se usa la imagen PNG.
+    try:
+        from svglib.svglib import svg2rlg
+    except ImportError:
+        logger.warning("svglib no está instalado, el gráfico se incrusta como PNG")
+        return None
+    buf = BytesIO()
+    figura.savefig(buf, format="svg", bbox_inches="tight")
+    buf.seek(0)
+    dibujo = svg2rlg(buf)
+    escala_x = plantilla["ancho"] / dibujo.width
+    escala_y = plantilla["alto"] / dibujo.height
+    dibujo.scale(escala_x, escala_y)
+    dibujo.width, dibujo.height = plantilla["ancho"], plantilla["alto"]
+    return dibujo
+
+def grafica_prestamos(libros_data: List[dict], meses_data: List[dict], vectorial: bool = False,
+                      plantilla: str = "prestamos"):
+    """Devuelve un flowable con el top de libros prestados y los préstamos por mes."""
+    conf = PLANTILLAS[plantilla]
+    figura = _crear_figura(conf)
+    arriba, abajo = figura.subplots(2, 1)
+
+    arriba.bar([row["titulo"] for row in libros_data], [row["prestamos"] for row in libros_data],
+               color=conf["color_barras"])
+    arriba.set_title("Top 5 Libros Más Prestados")
+    arriba.tick_params(axis="x", labelrotation=conf["rotacion"])
+    arriba.set_xlabel("Título del Libro")
+    arriba.set_ylabel("Número de Préstamos")
+
+    abajo.plot([row["mes"] for row in meses_data], [row["prestamos"] for row in meses_data],
+               marker="o", color=conf["color_linea"])
+    abajo.set_title("Préstamos por Mes")
+    abajo.set_xlabel("Mes")
+    abajo.set_ylabel("Número de Préstamos")
+    abajo.tick_params(axis="x", labelrotation=conf["rotacion"])
+
+    figura.tight_layout()
+
+    if vectorial:
+        dibujo = _como_dibujo(figura, conf)
+        if dibujo is not None:
+            return dibujo
+    return _como_imagen(figura, conf)
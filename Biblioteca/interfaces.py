@@ -5,31 +5,47 @@ from datetime import date
 # Interfaz para servicios CRUD
 class IServicioCRUD(ABC):
     @abstractmethod
-    def listar(self):
+    async def listar(self):
         pass
 
     @abstractmethod
-    def crear(self, datos: dict):
+    async def obtener(self, id: int):
         pass
 
     @abstractmethod
-    def actualizar(self, id: int, datos: dict):
+    async def existe(self, id: int):
         pass
 
     @abstractmethod
-    def eliminar(self, id: int):
+    async def crear(self, datos: dict):
+        pass
+
+    @abstractmethod
+    async def actualizar(self, id: int, datos: dict):
+        pass
+
+    @abstractmethod
+    async def eliminar(self, id: int):
         pass
 
 # Interfaz para servicio de inventario
 class IServicioInventario(ABC):
     @abstractmethod
-    def obtener_disponibles(self):
+    async def obtener_disponibles(self):
         pass
 
 # Interfaz para servicio de prestamos
 class IServicioPrestamos(ABC):
     @abstractmethod
-    def crear_prestamo(self, id_libro: int, id_usuario: int):
+    async def crear_prestamo(self, id_libro: int, id_usuario: int):
+        pass
+
+    @abstractmethod
+    async def devolver(self, id_prestamo: int):
+        pass
+
+    @abstractmethod
+    async def devolver_masivo(self, ids: List[int]):
         pass
 
 #Interfaz para servicio de reportes tiene su docstring para saber que hace
@@ -50,17 +66,19 @@ class IServicioReportes(ABC):
 # Interfaz para servicio de notificaciones
 class IServicioNotificaciones(ABC):
     @abstractmethod
-    def enviar_notificacion(self, id_usuario: int, mensaje: str) -> dict:
+    async def enviar_notificacion(self, id_usuario: int, mensaje: str) -> dict:
         pass
 
     @abstractmethod
-    def listar_todas(self) -> List[dict]:
+    async def listar_todas(self, antes: Optional[str] = None, since_id: Optional[int] = None,
+                           limite: int = 100) -> List[dict]:
         pass
 
     @abstractmethod
-    def listar_por_usuario(self, id_usuario: int) -> List[dict]:
+    async def listar_por_usuario(self, id_usuario: int, antes: Optional[str] = None,
+                                 since_id: Optional[int] = None, limite: int = 100) -> List[dict]:
         pass
 
     @abstractmethod
-    def crear(self, usuario_id: int, mensaje: str) -> dict:
+    async def crear(self, usuario_id: int, mensaje: str) -> dict:
         pass
\ No newline at end of file
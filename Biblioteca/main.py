@@ -1,32 +1,58 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response, Query, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 import pandas as pd
-import matplotlib.pyplot as plt
 from abc import ABC
 from typing import Optional, Dict, Any
-from datetime import date
+from datetime import date, datetime
 import os
+import asyncio
+import random
+import time
 import tempfile
 from pathlib import Path
 import logging
 from typing import List
-from pydantic import BaseModel
-from conexion_bd import ConexionBD
+from pydantic import BaseModel, ValidationError
+import pymysql
+import mysql.connector
+from conexion_bd import ConexionBD, ConexionBDAsync
+from cache import CacheLecturas, CacheReportes, Entrada
+from trabajos import ColaReportes
+from graficos import grafica_prestamos
+from busqueda import IndiceLibros, SincronizacionLibros
+from difusion import DifusorNotificaciones
+from login import LoginRequest, LoginResponse, ServicioLogin, coste_del_entorno
+import metricas
+import estadisticas
+import consultas
 from io import BytesIO
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Image, Spacer
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors
 from reportlab.lib.units import inch
 from reportlab.lib.utils import ImageReader
 import json
-import tempfile
+import csv
+import io
+import codecs
+import uuid
+from collections import deque
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("uvicorn.error")
 
+# Fracción de peticiones que se registran en el log; las lentas y los errores 5xx siempre
+TASA_LOG_PETICIONES = 0.01
+UMBRAL_PETICION_LENTA = 1.0
+
+# Tamaño a partir del cual un PDF en construcción pasa de memoria a un temporal en disco
+UMBRAL_MEMORIA_REPORTE = 8 * 1024 * 1024
+
 # Modelos Pydantic
 class Libro(BaseModel):
     id: int
@@ -62,6 +88,9 @@ class PrestamoInfo(BaseModel):
     fecha_devolucion: date
     devuelto: bool
 
+class DevolucionMasiva(BaseModel):
+    ids: List[int]
+
 class ReporteConfig(BaseModel):
     tipo: str
     filtros: Optional[Dict[str, Any]] = None
@@ -88,72 +117,472 @@ app.add_middleware(
 static_path = Path(__file__).parent / "static"
 app.mount("/static", StaticFiles(directory=static_path, html=True), name="static")
 
+peticiones_http = metricas.registro.contador(
+    "biblioteca_http_peticiones_total", "Peticiones HTTP atendidas", ("metodo", "ruta", "estado"))
+duracion_http = metricas.registro.histograma(
+    "biblioteca_http_duracion_segundos", "Latencia de las peticiones HTTP hasta enviar la cabecera", ("metodo", "ruta"))
+en_curso_http = metricas.registro.medidor(
+    "biblioteca_http_en_curso", "Peticiones HTTP en curso", ("metodo",))
+consultas_peticion = metricas.registro.histograma(
+    "biblioteca_http_consultas_bd", "Consultas SQL por petición", ("ruta",), metricas.BUCKETS_CONSULTAS)
+tiempo_bd_peticion = metricas.registro.histograma(
+    "biblioteca_http_tiempo_bd_segundos", "Tiempo en consultas SQL por petición", ("ruta",))
+render_reporte = metricas.registro.histograma(
+    "biblioteca_reporte_render_segundos", "Tiempo de generación de reportes", ("tipo", "origen"), metricas.BUCKETS_RENDER)
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    logger.info(f"Request: {request.method} {request.url}")
-    response = await call_next(request)
-    logger.info(f"Response: {response.status_code}")
-    return response
+    inicio = time.perf_counter()
+    acumulado, token = metricas.iniciar_peticion()
+    en_curso_http.sumar(1, metodo=request.method)
+    estado = 500
+    try:
+        response = await call_next(request)
+        estado = response.status_code
+        return response
+    finally:
+        duracion = time.perf_counter() - inicio
+        en_curso_http.sumar(-1, metodo=request.method)
+        metricas.terminar_peticion(token)
+        # La plantilla de la ruta y no la URL, para no crear una serie por id
+        ruta = getattr(request.scope.get("route"), "path", "desconocida")
+        peticiones_http.incrementar(metodo=request.method, ruta=ruta, estado=estado)
+        duracion_http.observar(duracion, metodo=request.method, ruta=ruta)
+        consultas_peticion.observar(acumulado[0], ruta=ruta)
+        tiempo_bd_peticion.observar(acumulado[1], ruta=ruta)
+        if estado >= 500 or duracion >= UMBRAL_PETICION_LENTA or random.random() < TASA_LOG_PETICIONES:
+            logger.info(
+                "peticion metodo=%s ruta=%s estado=%s ms=%.1f consultas=%d bd_ms=%.1f",
+                request.method, request.url.path, estado, duracion * 1000, acumulado[0], acumulado[1] * 1000,
+            )
 
 @app.get("/")
 async def read_root():
     return FileResponse("static/index.html")
 
-# Instancia de ConexionBD
+# Instancias de ConexionBD: el pool síncrono lo usan los reportes (que se
+# generan en el threadpool) y el asíncrono los servicios de las peticiones
 bd = ConexionBD()
+bd_async = ConexionBDAsync()
+
+# Cache de lecturas del catálogo, invalidada por las escrituras de cada tabla
+cache_lecturas = CacheLecturas(maximo=1024, ttl=30.0)
+
+# Índice de búsqueda del catálogo; se carga al arrancar y lo mantienen las escrituras
+# de este proceso y, cada INTERVALO_INDICE segundos, las de los demás (libro_cambio)
+indice_libros = IndiceLibros()
+sincronizacion_libros = SincronizacionLibros(bd, indice_libros)
+INTERVALO_INDICE = 2.0
+
+# Reparto en tiempo real de notificaciones a los clientes WebSocket/SSE de este proceso
+difusor = DifusorNotificaciones()
+
+# Intervalo de los mensajes de mantenimiento en las conexiones de push
+LATIDO_PUSH = 15.0
+
+@app.on_event("startup")
+async def iniciar_cola_reportes():
+    await cola_reportes.iniciar()
+
+@app.on_event("startup")
+async def cargar_indice_libros():
+    # En segundo plano y en un hilo, para no ocupar el bucle de eventos: mientras carga,
+    # las búsquedas ven el catálogo parcial
+    async def cargar():
+        try:
+            await asyncio.to_thread(sincronizacion_libros.cargar)
+        except Exception as e:
+            logger.error(f"Error al cargar el índice de búsqueda: {e}")
+        logger.info(f"Índice de búsqueda cargado: {len(indice_libros)} libros")
+
+    async def sincronizar():
+        await app.state.carga_indice
+        while True:
+            await asyncio.sleep(INTERVALO_INDICE)
+            hilo = asyncio.ensure_future(asyncio.to_thread(sincronizacion_libros.sincronizar))
+            try:
+                await asyncio.shield(hilo)
+            except asyncio.CancelledError:
+                # El hilo usa el pool síncrono: se espera a que acabe antes de cerrarlo
+                await asyncio.gather(hilo, return_exceptions=True)
+                raise
+            except Exception as e:
+                logger.warning(f"Error al sincronizar el índice de búsqueda: {e}")
+
+    app.state.carga_indice = asyncio.create_task(cargar())
+    app.state.sincronizacion_indice = asyncio.create_task(sincronizar())
+
+@app.on_event("shutdown")
+async def cerrar_pool():
+    sincronizacion_libros.detener()
+    app.state.sincronizacion_indice.cancel()
+    await asyncio.gather(app.state.carga_indice, app.state.sincronizacion_indice, return_exceptions=True)
+    difusor.cerrar()
+    cola_reportes.cerrar()
+    servicio_login.cerrar()
+    bd.cerrar()
+    await bd_async.cerrar()
+
+@app.get("/bd/pool/", response_model=Dict[str, Any])
+async def estadisticas_pool():
+    return {"backend": bd.backend.nombre, "sync": bd.estadisticas(), "async": bd_async.estadisticas()}
+
+@app.get("/cache/", response_model=Dict[str, Any])
+async def estadisticas_cache():
+    return {
+        "lecturas": cache_lecturas.estadisticas(),
+        "reportes": servicio_reportes.cache.estadisticas(),
+        "busqueda": {**indice_libros.estadisticas(), **sincronizacion_libros.estadisticas()},
+    }
+
+@metricas.registro.colector
+def _metricas_componentes():
+    for pool, datos in (("sync", bd.estadisticas()), ("async", bd_async.estadisticas())):
+        for campo in ("abiertas", "libres", "prestadas", "esperando"):
+            yield f"biblioteca_bd_pool_{campo}", "gauge", f"Conexiones {campo} del pool", {"pool": pool}, datos[campo]
+        yield "biblioteca_bd_pool_esperas_total", "counter", "Esperas por una conexión libre", {"pool": pool}, datos["esperas"]
+        yield ("biblioteca_bd_pool_espera_segundos_total", "counter", "Tiempo total esperando conexión",
+               {"pool": pool}, datos["tiempo_espera_total"])
+    for cache, datos in (("lecturas", cache_lecturas.estadisticas()), ("reportes", servicio_reportes.cache.estadisticas())):
+        yield "biblioteca_cache_aciertos_total", "counter", "Aciertos de cache", {"cache": cache}, datos["aciertos"]
+        yield "biblioteca_cache_fallos_total", "counter", "Fallos de cache", {"cache": cache}, datos["fallos"]
+        yield "biblioteca_cache_ratio_aciertos", "gauge", "Proporción de aciertos de cache", {"cache": cache}, datos["ratio_aciertos"]
+        yield "biblioteca_cache_desalojos_total", "counter", "Entradas desalojadas de cache", {"cache": cache}, datos["desalojos"]
+    yield "biblioteca_busqueda_libros", "gauge", "Libros en el índice de búsqueda", {}, len(indice_libros)
+    push = difusor.estadisticas()
+    yield "biblioteca_push_suscripciones", "gauge", "Conexiones de push abiertas", {}, push["suscripciones"]
+    yield "biblioteca_push_descartados_total", "counter", "Mensajes de push descartados", {}, push["descartados"]
+    yield ("biblioteca_reportes_trabajos_pendientes", "gauge", "Trabajos de reporte sin terminar", {},
+           cola_reportes.estadisticas()["pendientes"])
+    login = servicio_login.estadisticas()
+    yield "biblioteca_login_verificaciones_en_curso", "gauge", "Verificaciones bcrypt en curso o en cola", {}, login["en_curso"]
+    yield "biblioteca_login_verificaciones_total", "counter", "Verificaciones bcrypt hechas", {}, login["verificaciones"]
+    yield "biblioteca_login_rechazados_total", "counter", "Logins rechazados con 503 por cola llena", {}, login["rechazadas"]
+    for limite in ("usuario", "ip"):
+        yield ("biblioteca_login_limitados_total", "counter", "Logins rechazados con 429 por límite de intentos",
+               {"limite": limite}, login[f"limitados_{limite}"])
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def exponer_metricas():
+    return PlainTextResponse(metricas.registro.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/notificaciones/push/", response_model=Dict[str, Any])
+async def estadisticas_push():
+    return difusor.estadisticas()
+
+def _no_modificado(request: Request, entrada: Entrada) -> Optional[Response]:
+    etags = [e.strip() for e in request.headers.get("if-none-match", "").split(",")]
+    if entrada.etag in etags or "*" in etags:
+        return Response(status_code=304, headers={"ETag": entrada.etag})
+    return None
 
 # ---------------------------
 # Implementación de Servicios
 # ---------------------------
 
 class ServicioCRUD:
-    def __init__(self, tabla: str):
+    def __init__(self, tabla: str, columnas: tuple = (), unicos: tuple = (), indice=None,
+                 columna_carga: Optional[str] = None):
         self.tabla = tabla
-        self.bd = bd
-
-    def listar(self) -> List[dict]:
-        with self.bd.obtener_cursor() as (cursor, _):
-            cursor.execute(f"SELECT * FROM {self.tabla}")
-            result = cursor.fetchall()
-            if not result:
-                return []
-            if self.tabla == "libro":
-                for row in result:
-                    if 'disponible' in row:
-                        row['disponible'] = bool(row['disponible'])
-            return result
+        self.columnas = columnas
+        self.unicos = unicos
+        self.indice = indice
+        # Columna con la que crear_masivo marca cada lote para releer sus ids (ver _insertar_lote)
+        self.columna_carga = columna_carga
+        self.bd = bd_async
+        self._ids_consecutivos: Optional[bool] = None
+
+    def _validar_columnas(self, columnas) -> None:
+        invalidas = [c for c in columnas if c not in self.columnas]
+        if invalidas:
+            raise HTTPException(status_code=400, detail=f"Campos no válidos para {self.tabla}: {', '.join(invalidas)}")
+
+    async def listar(self, after_id: Optional[int] = None, limite: Optional[int] = None,
+                     campos: Optional[List[str]] = None, filtros: Optional[Dict[str, Any]] = None,
+                     prefijos: Optional[Dict[str, str]] = None) -> List[dict]:
+        filas, _ = await self.listar_pagina(after_id, limite, campos, filtros, prefijos)
+        return filas
+
+    async def listar_pagina(self, after_id: Optional[int] = None, limite: Optional[int] = None,
+                            campos: Optional[List[str]] = None, filtros: Optional[Dict[str, Any]] = None,
+                            prefijos: Optional[Dict[str, str]] = None):
+        """Devuelve (filas, siguiente_cursor) usando paginación por clave (id > after_id)."""
+        entrada = await self.listar_pagina_cache(after_id, limite, campos, filtros, prefijos)
+        return entrada.valor
+
+    async def listar_pagina_cache(self, after_id: Optional[int] = None, limite: Optional[int] = None,
+                                  campos: Optional[List[str]] = None, filtros: Optional[Dict[str, Any]] = None,
+                                  prefijos: Optional[Dict[str, str]] = None) -> Entrada:
+        filtros = {k: v for k, v in (filtros or {}).items() if v is not None}
+        prefijos = {k: v for k, v in (prefijos or {}).items() if v}
+        if campos:
+            # El id siempre se incluye porque es el cursor de la siguiente página
+            campos = ["id"] + [c for c in campos if c != "id"]
+        if self.columnas:
+            self._validar_columnas(list(campos or []) + list(filtros) + list(prefijos))
+        clave = ("listar", after_id, limite, tuple(campos or ()),
+                 tuple(sorted(filtros.items())), tuple(sorted(prefijos.items())))
+        return await cache_lecturas.obtener_async(
+            self.tabla, clave,
+            lambda: self._listar_pagina_bd(after_id, limite, campos, filtros, prefijos),
+        )
+
+    async def _listar_pagina_bd(self, after_id, limite, campos, filtros, prefijos):
+        # Sin proyección se leen las columnas del servicio, no SELECT *: usuario guarda también credenciales
+        query, valores = consultas.pagina_crud(self.tabla, campos or self.columnas, after_id, limite,
+                                               filtros, prefijos)
+        async with self.bd.obtener_cursor() as (cursor, _):
+            await cursor.execute(query, valores)
+            result = await cursor.fetchall()
+        if not result:
+            return [], None
+        result = list(result)
+        siguiente = None
+        if limite is not None and len(result) > limite:
+            result = result[:limite]
+            siguiente = result[-1]["id"]
+        if self.tabla == "libro":
+            for row in result:
+                if 'disponible' in row:
+                    row['disponible'] = bool(row['disponible'])
+        return result, siguiente
 
-    def crear(self, datos: dict) -> dict:
-        with self.bd.obtener_cursor() as (cursor, conexion):
+    async def crear(self, datos: dict) -> dict:
+        async with self.bd.obtener_cursor() as (cursor, conexion):
             columnas = ", ".join(datos.keys())
             marcadores = ", ".join(["%s"] * len(datos))
             valores = tuple(datos.values())
-            cursor.execute(f"INSERT INTO {self.tabla} ({columnas}) VALUES ({marcadores})", valores)
-            conexion.commit()
+            try:
+                await cursor.execute(f"INSERT INTO {self.tabla} ({columnas}) VALUES ({marcadores})", valores)
+            except pymysql.err.IntegrityError as e:
+                await conexion.rollback()
+                raise HTTPException(status_code=409, detail=f"Conflicto de integridad: {e.args[-1]}")
+            await conexion.commit()
+            cache_lecturas.invalidar(self.tabla)
+            if self.indice is not None:
+                self.indice.agregar(cursor.lastrowid, datos)
             return {"mensaje": f"{self.tabla} creado exitosamente", "id": cursor.lastrowid}
 
-    def actualizar(self, id: int, datos: dict) -> dict:
-        with self.bd.obtener_cursor() as (cursor, conexion):
+    async def crear_masivo(self, filas, lote: int = 500) -> dict:
+        """Inserta las filas de un iterable asíncrono de (numero_fila, datos) en una sola transacción.
+
+        Se insertan lotes de `lote` filas con un INSERT multi-fila; las filas que
+        repiten una columna única (en la carga o en la tabla, según la colación
+        de la columna) se omiten y se devuelven como errores junto con los
+        rangos de ids asignados.
+        """
+        errores = []
+        ids = []
+        insertadas = []
+        vistos = {campo: set() for campo in self.unicos}
+
+        async def insertar_lote(cursor, pendientes):
+            nuevas = await self._insertar_lote(cursor, pendientes, errores)
+            ids.extend(id for id, _ in nuevas)
+            if self.indice is not None:
+                insertadas.extend(nuevas)
+
+        async def insertar(cursor, conexion):
+            pendientes = []
+            async for numero, datos in filas:
+                duplicado = next((c for c in self.unicos if str(datos[c]).lower() in vistos[c]), None)
+                if duplicado:
+                    errores.append({"fila": numero, "error": f"{duplicado} duplicado en la carga: {datos[duplicado]}"})
+                    continue
+                for campo in self.unicos:
+                    vistos[campo].add(str(datos[campo]).lower())
+                pendientes.append((numero, datos))
+                if len(pendientes) >= lote:
+                    await insertar_lote(cursor, pendientes)
+                    pendientes = []
+            if pendientes:
+                await insertar_lote(cursor, pendientes)
+
+        try:
+            # Sin reintentos: las filas llegan en streaming y no se pueden volver a leer
+            await self.bd.transaccion(insertar, reintentos=0)
+        except pymysql.err.IntegrityError as e:
+            raise HTTPException(status_code=409, detail=f"Carga cancelada por conflicto de integridad: {e.args[-1]}")
+        cache_lecturas.invalidar(self.tabla)
+        if self.indice is not None:
+            for id, datos in insertadas:
+                self.indice.agregar(id, datos)
+
+        rangos = []
+        for id in sorted(ids):
+            if rangos and id == rangos[-1][1] + 1:
+                rangos[-1][1] = id
+            else:
+                rangos.append([id, id])
+        return {
+            "mensaje": f"{len(ids)} registros de {self.tabla} creados",
+            "insertados": len(ids),
+            "ids": {"desde": rangos[0][0], "hasta": rangos[-1][1]} if rangos else None,
+            "rangos": rangos,
+            "errores": sorted(errores, key=lambda e: e["fila"]),
+        }
+
+    async def _insertar_lote(self, cursor, pendientes: List[tuple], errores: List[dict]) -> List[tuple]:
+        """Inserta las filas que no chocan con una columna única; devuelve [(id, datos)]."""
+        for campo in self.unicos:
+            valores = [datos[campo] for _, datos in pendientes]
+            await cursor.execute(
+                f"SELECT {campo} FROM {self.tabla} WHERE {campo} IN ({', '.join(['%s'] * len(valores))})",
+                valores
+            )
+            existentes = {str(row[campo]).lower() for row in await cursor.fetchall()}
+            if existentes:
+                for numero, datos in pendientes:
+                    if str(datos[campo]).lower() in existentes:
+                        errores.append({"fila": numero, "error": f"{campo} ya registrado: {datos[campo]}"})
+                pendientes = [(n, d) for n, d in pendientes if str(d[campo]).lower() not in existentes]
+        if not pendientes:
+            return []
+
+        columnas = list(pendientes[0][1].keys())
+        valores = [[datos[c] for c in columnas] for _, datos in pendientes]
+        consecutivos = await self._consecutivos(cursor)
+        carga = None
+        if not consecutivos and not self.unicos and self.columna_carga:
+            carga = uuid.uuid4().hex
+            columnas.append(self.columna_carga)
+            for fila in valores:
+                fila.append(carga)
+        if not consecutivos and not self.unicos and not carga:
+            return await self._insertar_filas(cursor, columnas, valores, pendientes, errores)
+
+        marcadores = "(" + ", ".join(["%s"] * len(columnas)) + ")"
+        try:
+            await cursor.execute(
+                f"INSERT INTO {self.tabla} ({', '.join(columnas)}) VALUES {', '.join([marcadores] * len(valores))}",
+                [v for fila in valores for v in fila]
+            )
+        except pymysql.err.IntegrityError:
+            if not self.unicos:
+                raise
+            # Duplicado que solo ve la colación de la columna (acentos, espacios finales): el INSERT
+            # fallido no deja filas y el lote se repite fila a fila para saber cuáles chocan
+            return await self._insertar_filas(cursor, columnas, valores, pendientes, errores)
+
+        if consecutivos:
+            primero = cursor.lastrowid
+            return [(primero + i, datos) for i, (_, datos) in enumerate(pendientes)]
+        if carga:
+            await cursor.execute(
+                f"SELECT id FROM {self.tabla} WHERE {self.columna_carga} = %s ORDER BY id", (carga,)
+            )
+        else:
+            campo = self.unicos[0]
+            await cursor.execute(
+                f"SELECT id, {campo} FROM {self.tabla} WHERE {campo} IN ({', '.join(['%s'] * len(valores))})",
+                [datos[campo] for _, datos in pendientes]
+            )
+            # El lote entró entero, así que las filas encontradas son exactamente las suyas
+            asignados = {row[campo]: row["id"] for row in await cursor.fetchall()}
+            return [(asignados[datos[campo]], datos) for _, datos in pendientes]
+        # Dentro de un INSERT los ids crecen en el orden de VALUES aunque no sean consecutivos
+        return [(row["id"], datos) for row, (_, datos) in zip(await cursor.fetchall(), pendientes)]
+
+    async def _insertar_filas(self, cursor, columnas: List[str], valores: List[list], pendientes: List[tuple],
+                              errores: List[dict]) -> List[tuple]:
+        """Inserta fila a fila; las que violan una clave única quedan como error de su fila."""
+        nuevas = []
+        sql = f"INSERT INTO {self.tabla} ({', '.join(columnas)}) VALUES ({', '.join(['%s'] * len(columnas))})"
+        for fila, (numero, datos) in zip(valores, pendientes):
+            try:
+                await cursor.execute(sql, fila)
+            except pymysql.err.IntegrityError as e:
+                if not self.unicos:
+                    raise
+                errores.append({"fila": numero, "error": f"Conflicto de integridad: {e.args[-1]}"})
+                continue
+            nuevas.append((cursor.lastrowid, datos))
+        return nuevas
+
+    async def _consecutivos(self, cursor) -> bool:
+        """Si los ids de un INSERT multi-fila son consecutivos y basta con el primero (lastrowid).
+
+        SQLite tiene un solo escritor; InnoDB los reserva de una vez salvo con
+        innodb_autoinc_lock_mode=2 (el valor por defecto desde MySQL 8.0).
+        """
+        if self._ids_consecutivos is None:
+            if self.bd.backend.nombre == "sqlite":
+                self._ids_consecutivos = True
+            else:
+                await cursor.execute("SELECT @@innodb_autoinc_lock_mode AS modo")
+                self._ids_consecutivos = int((await cursor.fetchone())["modo"]) < 2
+        return self._ids_consecutivos
+
+    async def obtener(self, id: int, campos: Optional[List[str]] = None) -> Optional[dict]:
+        if campos and self.columnas:
+            self._validar_columnas(campos)
+        async with self.bd.obtener_cursor() as (cursor, _):
+            await cursor.execute(f"SELECT {', '.join(campos or self.columnas) or '*'} FROM {self.tabla} WHERE id = %s",
+                                 (id,))
+            row = await cursor.fetchone()
+        if row and self.tabla == "libro" and 'disponible' in row:
+            row['disponible'] = bool(row['disponible'])
+        return row
+
+    async def existe(self, id: int) -> bool:
+        async with self.bd.obtener_cursor() as (cursor, _):
+            await cursor.execute(f"SELECT 1 FROM {self.tabla} WHERE id = %s LIMIT 1", (id,))
+            return await cursor.fetchone() is not None
+
+    async def actualizar_si_existe(self, id: int, datos: dict) -> bool:
+        # Un solo UPDATE: rowcount (filas encontradas, ver CLIENT.FOUND_ROWS) indica si el id existía
+        async with self.bd.obtener_cursor() as (cursor, conexion):
             set_clause = ", ".join([f"{k} = %s" for k in datos.keys()])
             valores = list(datos.values()) + [id]
-            cursor.execute(f"UPDATE {self.tabla} SET {set_clause} WHERE id = %s", valores)
-            conexion.commit()
-            return {"mensaje": f"{self.tabla} actualizado"}
-
-    def eliminar(self, id: int) -> dict:
-        with self.bd.obtener_cursor() as (cursor, conexion):
-            cursor.execute(f"DELETE FROM {self.tabla} WHERE id = %s", (id,))
-            conexion.commit()
-            return {"mensaje": f"{self.tabla} eliminado"}
+            await cursor.execute(f"UPDATE {self.tabla} SET {set_clause} WHERE id = %s", valores)
+            await conexion.commit()
+            cache_lecturas.invalidar(self.tabla)
+            if cursor.rowcount > 0 and self.indice is not None:
+                self.indice.actualizar(id, datos)
+            return cursor.rowcount > 0
+
+    async def eliminar_si_existe(self, id: int) -> bool:
+        async with self.bd.obtener_cursor() as (cursor, conexion):
+            await cursor.execute(f"DELETE FROM {self.tabla} WHERE id = %s", (id,))
+            await conexion.commit()
+            cache_lecturas.invalidar(self.tabla)
+            if self.indice is not None:
+                self.indice.quitar(id)
+            return cursor.rowcount > 0
+
+    async def actualizar(self, id: int, datos: dict) -> dict:
+        if not await self.actualizar_si_existe(id, datos):
+            raise HTTPException(status_code=404, detail=f"{self.tabla.capitalize()} no encontrado")
+        return {"mensaje": f"{self.tabla} actualizado"}
+
+    async def eliminar(self, id: int) -> dict:
+        if not await self.eliminar_si_existe(id):
+            raise HTTPException(status_code=404, detail=f"{self.tabla.capitalize()} no encontrado")
+        return {"mensaje": f"{self.tabla} eliminado"}
+
+    async def exportar(self, lote: int = 1000):
+        query = f"SELECT {', '.join(self.columnas) if self.columnas else '*'} FROM {self.tabla} ORDER BY id"
+        async for filas in self.bd.iterar(query, lote=lote):
+            if self.tabla == "libro":
+                for row in filas:
+                    row['disponible'] = bool(row['disponible'])
+            yield filas
 
 class ServicioInventario:
     def __init__(self):
-        self.bd = bd
+        self.bd = bd_async
 
-    def obtener_disponibles(self) -> List[dict]:
-        with self.bd.obtener_cursor() as (cursor, _):
-            cursor.execute("SELECT id, titulo, autor, disponible FROM libro WHERE disponible = 1 AND disponible IS NOT NULL")
-            result = cursor.fetchall()
+    async def obtener_disponibles(self) -> List[dict]:
+        return (await self.obtener_disponibles_cache()).valor
+
+    async def obtener_disponibles_cache(self) -> Entrada:
+        # Depende de libro.disponible, así que vive en el espacio de la tabla libro
+        return await cache_lecturas.obtener_async("libro", ("disponibles",), self._obtener_disponibles_bd)
+
+    async def _obtener_disponibles_bd(self) -> List[dict]:
+        async with self.bd.obtener_cursor() as (cursor, _):
+            await cursor.execute(consultas.SQL_LIBROS_DISPONIBLES)
+            result = await cursor.fetchall()
             if not result:
                 return []
             for row in result:
@@ -162,61 +591,195 @@ class ServicioInventario:
             return result
 
 class ServicioPrestamos:
-    def __init__(self):
-        self.bd = bd
+    columnas = ("id", "libro", "usuario", "fecha_prestamo", "fecha_devolucion", "devuelto")
 
-    def crear_prestamo(self, prestamo: PrestamoCreate) -> dict:
-        with self.bd.obtener_cursor() as (cursor, conexion):
-            cursor.execute("SELECT disponible FROM libro WHERE id = %s", (prestamo.id_libro,))
-            libro = cursor.fetchone()
-            
-            if not libro or not libro['disponible']:
+    def __init__(self):
+        self.bd = bd_async
+
+    async def crear_prestamo(self, prestamo: PrestamoCreate) -> dict:
+        devuelto = 1 if prestamo.devuelto else 0
+
+        fecha_devolucion = prestamo.fecha_devolucion
+        if isinstance(fecha_devolucion, str):
+            try:
+                fecha_devolucion = date.fromisoformat(fecha_devolucion)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Formato de fecha_devolucion inválido. Use YYYY-MM-DD.")
+
+        async def registrar(cursor, conexion):
+            # El UPDATE condicional reserva el libro y bloquea su fila hasta el commit:
+            # si otra petición lo prestó antes, no encuentra filas y no hay doble préstamo
+            await cursor.execute(
+                "UPDATE libro SET disponible = FALSE WHERE id = %s AND disponible = 1",
+                (prestamo.id_libro,)
+            )
+            if cursor.rowcount != 1:
                 raise HTTPException(status_code=400, detail="Libro no disponible")
+            try:
+                await cursor.execute(
+                    "INSERT INTO prestamo (id_libro, id_usuario, fecha_prestamo, fecha_devolucion, devuelto) VALUES (%s, %s, %s, %s, %s)",
+                    (prestamo.id_libro, prestamo.id_usuario, date.today(), fecha_devolucion, devuelto)
+                )
+            except pymysql.err.IntegrityError:
+                raise HTTPException(status_code=404, detail="Usuario no encontrado")
+            id_prestamo = cursor.lastrowid
+            await estadisticas.registrar_prestamo(cursor, prestamo.id_libro, prestamo.id_usuario, date.today())
+            return id_prestamo
+
+        id_prestamo = await self.bd.transaccion(registrar)
+        cache_lecturas.invalidar("libro", "prestamo", "estadistica")
+        indice_libros.marcar_disponible(prestamo.id_libro, False)
+        return {"mensaje": "Préstamo registrado", "id": id_prestamo}
+
+    async def devolver(self, id_prestamo: int) -> dict:
+        resultado = await self.devolver_masivo([id_prestamo])
+        if resultado["no_encontrados"]:
+            raise HTTPException(status_code=404, detail="Préstamo no encontrado")
+        if resultado["ya_devueltos"]:
+            raise HTTPException(status_code=409, detail="El préstamo ya fue devuelto")
+        return {"mensaje": "Devolución registrada", "id": id_prestamo}
+
+    async def devolver_masivo(self, ids: List[int]) -> dict:
+        """Marca los préstamos como devueltos y sus libros como disponibles en una transacción.
+
+        Los ids inexistentes o ya devueltos no cancelan el resto: se informan aparte.
+        """
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return {"devueltos": [], "ya_devueltos": [], "no_encontrados": []}
+
+        async def registrar(cursor, conexion):
+            # FOR UPDATE: una devolución concurrente del mismo préstamo espera y luego lo ve devuelto
+            await cursor.execute(
+                f"SELECT id, id_libro, id_usuario, devuelto FROM prestamo "
+                f"WHERE id IN ({', '.join(['%s'] * len(ids))}) FOR UPDATE",
+                ids
+            )
+            filas = await cursor.fetchall()
+            activos = [row for row in filas if not row["devuelto"]]
+            if activos:
+                await cursor.execute(
+                    f"UPDATE prestamo SET devuelto = 1 WHERE id IN ({', '.join(['%s'] * len(activos))})",
+                    [row["id"] for row in activos]
+                )
+                libros = [row["id_libro"] for row in activos if row["id_libro"] is not None]
+                if libros:
+                    await cursor.execute(
+                        f"UPDATE libro SET disponible = 1 WHERE id IN ({', '.join(['%s'] * len(libros))})",
+                        libros
+                    )
+                await estadisticas.registrar_devoluciones(
+                    cursor, [row for row in activos if row["id_libro"] is not None and row["id_usuario"] is not None]
+                )
+            return filas, activos
+
+        filas, activos = await self.bd.transaccion(registrar)
+        if activos:
+            cache_lecturas.invalidar("libro", "prestamo", "estadistica")
+            for row in activos:
+                if row["id_libro"] is not None:
+                    indice_libros.marcar_disponible(row["id_libro"], True)
+        encontrados = {row["id"] for row in filas}
+        return {
+            "devueltos": [row["id"] for row in activos],
+            "ya_devueltos": [row["id"] for row in filas if row["devuelto"]],
+            "no_encontrados": [id for id in ids if id not in encontrados],
+        }
 
-            devuelto = 1 if prestamo.devuelto else 0
-            
-            fecha_devolucion = prestamo.fecha_devolucion
-            if isinstance(fecha_devolucion, str):
-                try:
-                    fecha_devolucion = date.fromisoformat(fecha_devolucion)
-                except ValueError:
-                    raise HTTPException(status_code=400, detail="Formato de fecha_devolucion inválido. Use YYYY-MM-DD.")
+    async def listar_prestamos(self, after_id: Optional[int] = None, limite: Optional[int] = None,
+                               filtros: Optional[Dict[str, Any]] = None) -> List[dict]:
+        filas, _ = await self.listar_pagina(after_id, limite, filtros)
+        return filas
+
+    async def listar_pagina(self, after_id: Optional[int] = None, limite: Optional[int] = None,
+                            filtros: Optional[Dict[str, Any]] = None):
+        """Devuelve (préstamos, siguiente_cursor) filtrando por estado, usuario, libro y fechas.
+
+        estado: 'activo' (sin devolver), 'vencido' (sin devolver y pasada la
+        fecha de devolución) o 'devuelto'. desde/hasta acotan fecha_prestamo.
+        """
+        filtros = {k: v for k, v in (filtros or {}).items() if v is not None}
+        estado = filtros.get("estado")
+        if estado not in (None, "activo", "vencido", "devuelto"):
+            raise HTTPException(status_code=400, detail=f"Estado de préstamo no válido: {estado}")
+        query, valores = consultas.pagina_prestamos(after_id, limite, filtros)
+        async with self.bd.obtener_cursor() as (cursor, _):
+            await cursor.execute(query, valores)
+            result = await cursor.fetchall()
+        siguiente = None
+        if limite is not None and len(result) > limite:
+            result = result[:limite]
+            siguiente = result[-1]["id"]
+        for row in result:
+            row['devuelto'] = bool(row['devuelto'])
+        return result, siguiente
+
+    async def exportar(self, lote: int = 1000):
+        async for filas in self.bd.iterar(consultas.SQL_PRESTAMOS_INFO + " ORDER BY p.id", lote=lote):
+            for row in filas:
+                row['devuelto'] = bool(row['devuelto'])
+            yield filas
+
+class ListaFlowables(list):
+    """Lista de flowables para doc.build que se rellena bajo demanda.
+
+    reportlab consume la lista desde el principio mientras len() > 0, así que
+    los generadores registrados con agregar_perezoso solo se materializan de
+    uno en uno a medida que se maquetan las páginas.
+    """
 
-            cursor.execute(
-                "INSERT INTO prestamo (id_libro, id_usuario, fecha_prestamo, fecha_devolucion, devuelto) VALUES (%s, %s, %s, %s, %s)",
-                (prestamo.id_libro, prestamo.id_usuario, date.today(), fecha_devolucion, devuelto)
-            )
-            
-            cursor.execute(
-                "UPDATE libro SET disponible = FALSE WHERE id = %s",
-                (prestamo.id_libro,)
-            )
-            
-            conexion.commit()
-            return {"mensaje": "Préstamo registrado"}
+    def __init__(self):
+        super().__init__()
+        self._pendientes = deque()
 
-    def listar_prestamos(self) -> List[dict]:
-        with self.bd.obtener_cursor() as (cursor, _):
-            cursor.execute("""
-                SELECT p.id, l.titulo as libro, u.nombre as usuario, 
-                       p.fecha_prestamo, p.fecha_devolucion, p.devuelto
-                FROM prestamo p
-                JOIN libro l ON p.id_libro = l.id
-                JOIN usuario u ON p.id_usuario = u.id
-            """)
-            result = cursor.fetchall()
-            if not result:
-                return []
-            for row in result:
-                if 'devuelto' in row:
-                    row['devuelto'] = bool(row['devuelto'])
-            return result
+    def append(self, flowable) -> None:
+        if self._pendientes:
+            self._pendientes.append(iter([flowable]))
+        else:
+            super().append(flowable)
+
+    def agregar_perezoso(self, generador) -> None:
+        self._pendientes.append(generador)
+
+    def __len__(self) -> int:
+        while list.__len__(self) < 2 and self._pendientes:
+            try:
+                super().append(next(self._pendientes[0]))
+            except StopIteration:
+                self._pendientes.popleft()
+        return list.__len__(self)
+
+    def cerrar(self) -> None:
+        # Libera las conexiones de los generadores que no llegaron a agotarse
+        while self._pendientes:
+            generador = self._pendientes.popleft()
+            if hasattr(generador, "close"):
+                generador.close()
 
 class ServicioReportes(ABC):
+    # Tablas de las que depende cada reporte, para calcular la versión de sus datos
+    TABLAS_REPORTE = {
+        ("tabla", "libros"): ("libro",),
+        ("tabla", "usuarios"): ("usuario",),
+        ("tabla", "disponibles"): ("libro",),
+        ("tabla", "prestamos"): ("prestamo", "libro", "usuario"),
+        ("tabla", "reportes"): ("reporte", "tipo_reporte"),
+        ("grafico", None): ("estadistica_libro", "estadistica_mes", "libro"),
+        ("comprobante", None): ("prestamo", "libro", "usuario"),
+    }
+
     def __init__(self):
-        self.bd = ConexionBD()
+        self.bd = bd
         self.template_dir = os.path.join(os.path.dirname(__file__), "templates")
-        self.tipos_reporte = self._cargar_tipos_reporte()
+        self.cache = CacheReportes(os.path.join(os.path.dirname(__file__), "temp", "cache_reportes"))
+        # Se cargan en el primer uso: importar la app (workers, procesos de reportes) no abre conexiones
+        self._tipos_reporte: Optional[Dict[str, int]] = None
+
+    @property
+    def tipos_reporte(self) -> Dict[str, int]:
+        if self._tipos_reporte is None:
+            self._tipos_reporte = self._cargar_tipos_reporte()
+        return self._tipos_reporte
 
     def _cargar_tipos_reporte(self) -> Dict[str, int]:
         with self.bd.obtener_cursor() as (cursor, _):
@@ -225,6 +788,12 @@ class ServicioReportes(ABC):
         return {tipo["descripcion"].lower(): tipo["id"] for tipo in tipos}
 
     def listar_tipos_reporte(self) -> List[Dict[str, Any]]:
+        return self.listar_tipos_reporte_cache().valor
+
+    def listar_tipos_reporte_cache(self) -> Entrada:
+        return cache_lecturas.obtener("tipo_reporte", ("listar",), self._listar_tipos_reporte_bd)
+
+    def _listar_tipos_reporte_bd(self) -> List[Dict[str, Any]]:
         with self.bd.obtener_cursor() as (cursor, _):
             cursor.execute("SELECT id, descripcion FROM tipo_reporte")
             return cursor.fetchall()
@@ -232,13 +801,15 @@ class ServicioReportes(ABC):
     def crear_tipo_reporte(self, descripcion: str) -> int:
         descripcion = descripcion.lower()
         with self.bd.obtener_cursor() as (cursor, conexion):
-            cursor.execute("SELECT id FROM tipo_reporte WHERE LOWER(descripcion) = %s", (descripcion,))
-            if cursor.fetchone():
+            # La clave única de descripcion (colación sin mayúsculas) detecta el duplicado
+            try:
+                cursor.execute(consultas.SQL_CREAR_TIPO_REPORTE, (descripcion,))
+            except mysql.connector.errors.IntegrityError:
                 raise HTTPException(status_code=400, detail=f"El tipo de reporte '{descripcion}' ya existe")
-            cursor.execute("INSERT INTO tipo_reporte (descripcion) VALUES (%s)", (descripcion,))
             conexion.commit()
             tipo_id = cursor.lastrowid
-        self.tipos_reporte = self._cargar_tipos_reporte()
+        cache_lecturas.invalidar("tipo_reporte")
+        self._tipos_reporte = None
         return tipo_id
 
     def crear_reporte(self, tipo_reporte: str) -> int:
@@ -256,22 +827,55 @@ class ServicioReportes(ABC):
 
     def listar_reportes(self) -> List[Dict[str, Any]]:
         with self.bd.obtener_cursor() as (cursor, _):
-            cursor.execute("""
-                SELECT r.id, r.fecha, tr.descripcion AS tipo_descripcion
-                FROM reporte r
-                JOIN tipo_reporte tr ON r.tipo_reporte = tr.id
-                ORDER BY r.fecha DESC
-            """)
+            cursor.execute(consultas.SQL_LISTAR_REPORTES)
             result = cursor.fetchall()
         return result
 
+    def _normalizar_filtros(self, tipo: str, filtros: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        filtros = dict(filtros or {})
+        if tipo == "tabla":
+            filtros["tabla"] = filtros.get("tabla", "prestamos")
+        elif tipo == "comprobante" and "id_prestamo" in filtros:
+            filtros["id_prestamo"] = str(filtros["id_prestamo"])
+        return filtros
+
+    def _version_datos(self, tablas: tuple) -> str:
+        # Contadores de version_tabla: se incrementan en la misma transacción que cada escritura,
+        # sobreviven a los reinicios y cubren lo que escriban otros procesos
+        versiones = self.bd.version_tablas(tablas)
+        return ";".join(f"{t}:{versiones.get(t, 0)}" for t in sorted(tablas))
+
+    def _clave_cache(self, tipo: str, filtros: Dict[str, Any]) -> Optional[str]:
+        tablas = self.TABLAS_REPORTE.get((tipo, filtros.get("tabla") if tipo == "tabla" else None))
+        if not tablas:
+            return None
+        return self.cache.clave(tipo, filtros, self._version_datos(tablas))
+
     def generar_reporte(self, tipo: str, filtros: Optional[Dict[str, Any]] = None) -> bytes:
+        archivo, _ = self.generar_reporte_archivo(tipo, filtros)
+        with archivo:
+            return archivo.read()
+
+    def generar_reporte_archivo(self, tipo: str, filtros: Optional[Dict[str, Any]] = None):
+        """Genera el PDF y devuelve (archivo, tamaño) con el archivo posicionado al inicio.
+
+        El documento se construye en memoria y solo pasa a un temporal en disco si
+        supera UMBRAL_MEMORIA_REPORTE; el temporal se borra al cerrar el archivo.
+        """
+        inicio = time.perf_counter()
         reporte_id = self.crear_reporte(tipo)
-        print(f"Reporte registrado con ID: {reporte_id}")  # Depuración
+        logger.debug("Reporte registrado con ID: %s", reporte_id)
         config = ReporteConfig(tipo=tipo.lower(), filtros=filtros)
-        buffer = BytesIO()
+        clave = self._clave_cache(config.tipo, self._normalizar_filtros(config.tipo, config.filtros))
+        if clave:
+            pdf_data = self.cache.obtener(clave)
+            if pdf_data is not None:
+                render_reporte.observar(time.perf_counter() - inicio, tipo=config.tipo, origen="cache")
+                return BytesIO(pdf_data), len(pdf_data)
+
+        buffer = tempfile.SpooledTemporaryFile(max_size=UMBRAL_MEMORIA_REPORTE, mode="w+b")
         doc = SimpleDocTemplate(buffer, pagesize=A4)
-        elements = []
+        elements = ListaFlowables()
 
         styles = getSampleStyleSheet()
         title_style = styles['Heading1']
@@ -284,133 +888,123 @@ class ServicioReportes(ABC):
         elif config.tipo == "comprobante":
             self._generar_comprobante_reporte(elements, config.filtros, title_style, normal_style)
         else:
+            buffer.close()
             raise HTTPException(status_code=400, detail="Tipo de reporte no soportado")
 
-        doc.build(elements)
-        pdf_data = buffer.getvalue()
-        buffer.close()
-        return pdf_data
+        try:
+            doc.build(elements)
+            tamano = buffer.tell()
+            render_reporte.observar(time.perf_counter() - inicio, tipo=config.tipo, origen="render")
+            buffer.seek(0)
+            if clave:
+                self.cache.guardar(clave, buffer)
+                buffer.seek(0)
+        except Exception:
+            buffer.close()
+            raise
+        finally:
+            elements.cerrar()
+        return buffer, tamano
+
+    # Consulta, encabezado, formato de fila y ancho relativo de columnas de cada tabla
+    TABLAS_TABULARES = {
+        'libros': (
+            "SELECT id, titulo, autor, disponible FROM libro ORDER BY id",
+            ["ID", "Título", "Autor", "Disponible"],
+            lambda row: [str(row["id"]), row["titulo"], row["autor"], "Sí" if row["disponible"] else "No"],
+            [1, 5, 4, 2],
+        ),
+        'usuarios': (
+            "SELECT id, nombre, correo FROM usuario ORDER BY id",
+            ["ID", "Nombre", "Correo"],
+            lambda row: [str(row["id"]), row["nombre"], row["correo"]],
+            [1, 5, 6],
+        ),
+        'disponibles': (
+            "SELECT id, titulo, autor FROM libro WHERE disponible = 1 ORDER BY id",
+            ["ID", "Título", "Autor"],
+            lambda row: [str(row["id"]), row["titulo"], row["autor"]],
+            [1, 6, 5],
+        ),
+        'prestamos': (
+            consultas.SQL_PRESTAMOS_INFO + " ORDER BY p.id",
+            ["ID", "Libro", "Usuario", "Fecha Préstamo", "Fecha Devolución", "Devuelto"],
+            lambda row: [str(row["id"]), row["libro"], row["usuario"], str(row["fecha_prestamo"]),
+                         str(row["fecha_devolucion"] or "N/A"), "Sí" if row["devuelto"] else "No"],
+            [1, 4, 3, 2.5, 2.5, 1.5],
+        ),
+        'reportes': (
+            """
+                SELECT r.id, r.fecha, tr.descripcion AS tipo_descripcion
+                FROM reporte r
+                JOIN tipo_reporte tr ON r.tipo_reporte = tr.id
+                ORDER BY r.id
+            """,
+            ["ID", "Fecha", "Tipo"],
+            lambda row: [str(row["id"]), str(row["fecha"]), row["tipo_descripcion"]],
+            [1, 4, 3],
+        ),
+    }
+
+    # Filas por tabla: cada tabla ocupa como mucho una página y reportlab no tiene que partirla
+    FILAS_POR_TABLA = 35
+
+    ESTILO_TABLA = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 10),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
 
     def _generar_tabla_reporte(self, elements: List, filtros: Optional[Dict[str, Any]], title_style, normal_style) -> None:
         elements.append(Paragraph("Reporte de Tabla", title_style))
         elements.append(Spacer(1, 0.2 * inch))
 
-        with self.bd.obtener_cursor() as (cursor, _):
-            tabla = filtros.get('tabla', 'prestamos') if filtros else 'prestamos'
-            if tabla == 'libros':
-                cursor.execute("SELECT id, titulo, autor, disponible FROM libro")
-                result = cursor.fetchall()
-                data = [["ID", "Título", "Autor", "Disponible"]]
-                for row in result:
-                    disponible = "Sí" if row["disponible"] else "No"
-                    data.append([str(row["id"]), row["titulo"], row["autor"], disponible])
-            elif tabla == 'usuarios':
-                cursor.execute("SELECT id, nombre, correo FROM usuario")
-                result = cursor.fetchall()
-                data = [["ID", "Nombre", "Correo"]]
-                for row in result:
-                    data.append([str(row["id"]), row["nombre"], row["correo"]])
-            elif tabla == 'disponibles':
-                cursor.execute("SELECT id, titulo, autor FROM libro WHERE disponible = 1 AND disponible IS NOT NULL")
-                result = cursor.fetchall()
-                data = [["ID", "Título", "Autor"]]
-                for row in result:
-                    data.append([str(row["id"]), row["titulo"], row["autor"]])
-            elif tabla == 'prestamos':
-                cursor.execute("""
-                    SELECT p.id, l.titulo as libro, u.nombre as usuario, 
-                        p.fecha_prestamo, p.fecha_devolucion, p.devuelto
-                    FROM prestamo p
-                    JOIN libro l ON p.id_libro = l.id
-                    JOIN usuario u ON p.id_usuario = u.id
-                """)
-                result = cursor.fetchall()
-                data = [["ID", "Libro", "Usuario", "Fecha Préstamo", "Fecha Devolución", "Devuelto"]]
-                for row in result:
-                    devuelto = "Sí" if row["devuelto"] else "No"
-                    fecha_devolucion = row["fecha_devolucion"] or "N/A"
-                    data.append([str(row["id"]), row["libro"], row["usuario"], str(row["fecha_prestamo"]), str(fecha_devolucion), devuelto])
-            elif tabla == 'reportes':
-                cursor.execute("""
-                    SELECT r.id, r.fecha, tr.descripcion AS tipo_descripcion
-                    FROM reporte r
-                    JOIN tipo_reporte tr ON r.tipo_reporte = tr.id
-                """)
-                result = cursor.fetchall()
-                data = [["ID", "Fecha", "Tipo"]]
-                for row in result:
-                    data.append([str(row["id"]), str(row["fecha"]), row["tipo_descripcion"]])
-            else:
-                raise HTTPException(status_code=400, detail=f"Tabla no soportada: {tabla}")
-
-            table = Table(data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-                ('FONTSIZE', (0, 1), (-1, -1), 10),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            elements.append(table)
+        tabla = filtros.get('tabla', 'prestamos') if filtros else 'prestamos'
+        if tabla not in self.TABLAS_TABULARES:
+            raise HTTPException(status_code=400, detail=f"Tabla no soportada: {tabla}")
+        elements.agregar_perezoso(self._tablas_por_pagina(*self.TABLAS_TABULARES[tabla]))
+
+    def _tablas_por_pagina(self, query: str, encabezado: List[str], formatear, proporciones: List[float]):
+        # Las filas se leen del cursor de servidor por bloques y cada bloque se
+        # convierte en una tabla con el encabezado repetido, así la memoria no
+        # depende del tamaño de la tabla y el coste de maquetar es lineal
+        ancho = A4[0] - 2 * inch
+        col_widths = [ancho * p / sum(proporciones) for p in proporciones]
+        vacia = True
+        for filas in self.bd.iterar(query, lote=self.FILAS_POR_TABLA):
+            vacia = False
+            table = Table([encabezado] + [formatear(row) for row in filas], colWidths=col_widths, repeatRows=1)
+            table.setStyle(self.ESTILO_TABLA)
+            yield table
+        if vacia:
+            table = Table([encabezado], colWidths=col_widths, repeatRows=1)
+            table.setStyle(self.ESTILO_TABLA)
+            yield table
 
     def _generar_grafica_reporte(self, elements: List, filtros: Optional[Dict[str, Any]], title_style, normal_style) -> None:
         elements.append(Paragraph("Reporte de Análisis de Préstamos", title_style))
         elements.append(Spacer(1, 0.2 * inch))
 
+        # Contadores preagregados (ver estadisticas.py) en lugar de agrupar toda la tabla prestamo
         with self.bd.obtener_cursor() as (cursor, _):
-            cursor.execute("""
-                SELECT l.titulo, COUNT(p.id) as prestamos
-                FROM prestamo p
-                JOIN libro l ON p.id_libro = l.id
-                GROUP BY p.id_libro, l.titulo
-                ORDER BY prestamos DESC
-                LIMIT 5
-            """)
+            cursor.execute(estadisticas.SQL_TOP_LIBROS, (5,))
             libros_data = cursor.fetchall()
 
-            cursor.execute("""
-                SELECT DATE_FORMAT(p.fecha_prestamo, '%Y-%m') as mes, COUNT(p.id) as prestamos
-                FROM prestamo p
-                GROUP BY mes
-                ORDER BY mes
-            """)
+            cursor.execute(estadisticas.SQL_PRESTAMOS_POR_MES)
             meses_data = cursor.fetchall()
 
-        # Generar el gráfico
-        plt.figure(figsize=(8, 5))
-        plt.subplot(2, 1, 1)
-        plt.bar([row["titulo"] for row in libros_data], [row["prestamos"] for row in libros_data])
-        plt.title("Top 5 Libros Más Prestados")
-        plt.xticks(rotation=45)
-        plt.xlabel("Título del Libro")
-        plt.ylabel("Número de Préstamos")
-
-        plt.subplot(2, 1, 2)
-        plt.plot([row["mes"] for row in meses_data], [row["prestamos"] for row in meses_data], marker='o')
-        plt.title("Préstamos por Mes")
-        plt.xlabel("Mes")
-        plt.ylabel("Número de Préstamos")
-        plt.xticks(rotation=45)
-
-        plt.tight_layout()
-
-        # En lugar de guardar en un archivo, guardar en un buffer de memoria
-        import io
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches="tight")
-        buf.seek(0)  # Volver al inicio del buffer
-        plt.close()
-
-        # Usar el buffer directamente con Image
+        # Generar el gráfico (vectorial con filtros {"formato": "svg"})
+        vectorial = bool(filtros) and filtros.get("formato") == "svg"
         try:
-            img = Image(buf, width=6*inch, height=4*inch)
-            elements.append(img)
+            elements.append(grafica_prestamos(libros_data, meses_data, vectorial=vectorial))
         except Exception as e:
             # Mantener el error más informativo
             import traceback
@@ -447,195 +1041,762 @@ class ServicioReportes(ABC):
 # Servicio de notificaciones
 class ServicioNotificaciones(ABC):
         def __init__(self):
-            self.bd = bd
+            self.bd = bd_async
+            self.ultimo_recordatorio: Optional[dict] = None
 
-        def enviar_notificacion(self, id_usuario: int, mensaje: str) -> dict:
+        async def enviar_notificacion(self, id_usuario: int, mensaje: str) -> dict:
+            # Aviso efímero: solo llega a los clientes conectados, no se guarda
+            entregadas = difusor.publicar(id_usuario, {"usuario_id": id_usuario, "mensaje": mensaje})
             return {
                 "id_usuario": id_usuario,
-                "mensaje": mensaje
+                "mensaje": mensaje,
+                "entregadas": entregadas
         }
 
-        def crear(self, usuario_id: int, mensaje: str) -> dict:
-            with self.bd.obtener_cursor() as (cursor, conexion):
-                cursor.execute("SELECT id FROM usuario WHERE id = %s", (usuario_id,))
-                if not cursor.fetchone():
+        async def crear(self, usuario_id: int, mensaje: str) -> dict:
+            # La clave foránea comprueba que el usuario existe, sin un SELECT previo
+            async with self.bd.obtener_cursor() as (cursor, conexion):
+                try:
+                    await cursor.execute(
+                        "INSERT INTO notificaciones (usuario_id, mensaje, fecha) VALUES (%s, %s, CURRENT_TIMESTAMP)",
+                        (usuario_id, mensaje)
+                    )
+                except pymysql.err.IntegrityError:
                     raise HTTPException(status_code=404, detail="Usuario no encontrado")
-                
-                cursor.execute(
-                    "INSERT INTO notificaciones (usuario_id, mensaje, fecha) VALUES (%s, %s, CURRENT_TIMESTAMP)",
-                    (usuario_id, mensaje)
+                await conexion.commit()
+                id_notificacion = cursor.lastrowid
+            difusor.publicar(usuario_id, {
+                "id": id_notificacion,
+                "usuario_id": usuario_id,
+                "mensaje": mensaje,
+                "fecha": datetime.now().isoformat(timespec="seconds"),
+                "leida": False,
+            })
+            return {"mensaje": "Notificación creada", "id": id_notificacion}
+
+        @staticmethod
+        def _leer_cursor(cursor: str) -> tuple:
+            try:
+                fecha, id = cursor.rsplit("_", 1)
+                return datetime.fromisoformat(fecha), int(id)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Cursor de notificaciones inválido")
+
+        @staticmethod
+        def _condicion_pagina(antes: Optional[str], since_id: Optional[int]) -> tuple:
+            """Condición y orden de la página: por (fecha, id) descendente o, con since_id, solo las nuevas."""
+            if since_id is None and antes:
+                return consultas.condicion_notificaciones(ServicioNotificaciones._leer_cursor(antes), None)
+            return consultas.condicion_notificaciones(None, since_id)
+
+        @staticmethod
+        def _siguiente(filas: List[dict], limite: int, since_id: Optional[int]) -> Optional[str]:
+            # Con since_id el cliente sigue desde el último id; si no, desde la última (fecha, id)
+            if since_id is not None:
+                return str(filas[-1]["id"]) if filas else str(since_id)
+            if len(filas) < limite:
+                return None
+            ultima = filas[-1]
+            return f"{ultima['fecha'].isoformat()}_{ultima['id']}"
+
+        async def listar_todas(self, antes: Optional[str] = None, since_id: Optional[int] = None,
+                               limite: int = 100) -> List[dict]:
+            filas, _ = await self.pagina_todas(antes, since_id, limite)
+            return filas
+
+        async def pagina_todas(self, antes: Optional[str] = None, since_id: Optional[int] = None,
+                               limite: int = 100) -> tuple:
+            """Devuelve (notificaciones, siguiente_cursor)."""
+            condicion, valores, orden = self._condicion_pagina(antes, since_id)
+            async with self.bd.obtener_cursor() as (cursor, _):
+                await cursor.execute(consultas.pagina_notificaciones(condicion, orden), valores + [limite])
+                filas = await cursor.fetchall()
+            for row in filas:
+                row['leida'] = bool(row['leida'])
+            return filas, self._siguiente(filas, limite, since_id)
+
+        async def listar_por_usuario(self, id_usuario: int, antes: Optional[str] = None,
+                                     since_id: Optional[int] = None, limite: int = 100) -> List[dict]:
+            filas, _, _ = await self.pagina_usuario(id_usuario, antes, since_id, limite)
+            return filas
+
+        async def pagina_usuario(self, id_usuario: int, antes: Optional[str] = None,
+                                 since_id: Optional[int] = None, limite: int = 100) -> tuple:
+            """Devuelve (notificaciones, siguiente_cursor, no_leidas) en una sola consulta.
+
+            El usuario es la tabla de la izquierda del LEFT JOIN: si no hay filas
+            no existe, y si hay una sin notificación la página está vacía.
+            """
+            condicion, valores, orden = self._condicion_pagina(antes, since_id)
+            async with self.bd.obtener_cursor() as (cursor, _):
+                await cursor.execute(consultas.pagina_notificaciones_usuario(condicion, orden),
+                                     [id_usuario, id_usuario] + valores + [limite])
+                resultado = await cursor.fetchall()
+            if not resultado:
+                raise HTTPException(status_code=404, detail="Usuario no encontrado")
+            no_leidas = int(resultado[0]["no_leidas"])
+            filas = []
+            for row in resultado:
+                if row["id"] is None:
+                    continue
+                del row["no_leidas"]
+                row['leida'] = bool(row['leida'])
+                filas.append(row)
+            return filas, self._siguiente(filas, limite, since_id), no_leidas
+
+        async def contar_no_leidas(self, id_usuario: int) -> int:
+            async with self.bd.obtener_cursor() as (cursor, _):
+                await cursor.execute(consultas.SQL_NO_LEIDAS, (id_usuario,))
+                row = await cursor.fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="Usuario no encontrado")
+            return int(row["no_leidas"])
+
+        async def crear_recordatorios_vencidos(self, lote: int = 5000) -> dict:
+            """Crea un recordatorio por cada préstamo vencido y sin devolver.
+
+            Los préstamos se insertan en lotes de `lote` con un INSERT ... SELECT
+            por lote, cada uno en su propia transacción. La clave única
+            (id_prestamo, dia_recordatorio) hace que repetir el proceso el mismo
+            día no duplique nada. Solo se leen de vuelta las filas de los usuarios
+            conectados al difusor, para enviárselas.
+            """
+            inicio = time.monotonic()
+            hoy = date.today()
+            async with self.bd.obtener_cursor() as (cursor, _):
+                await cursor.execute(consultas.SQL_PRESTAMOS_VENCIDOS, (hoy,))
+                vencidos = [row["id"] for row in await cursor.fetchall()]
+
+            creadas = 0
+            enviadas = 0
+            lotes = 0
+            for i in range(0, len(vencidos), lote):
+                ids = vencidos[i:i + lote]
+
+                async def insertar(cursor, conexion):
+                    # Con usuarios conectados se apartan los recordatorios que ya existían (de otra
+                    # ejecución de hoy) para no volver a enviarlos
+                    previos = None
+                    if difusor.estadisticas()["suscripciones"]:
+                        await cursor.execute(consultas.recordatorios_previos(len(ids)), ids + [hoy])
+                        previos = {row["id"] for row in await cursor.fetchall()}
+                    # IGNORE: los préstamos ya recordados hoy chocan con la clave única y se saltan
+                    await cursor.execute(consultas.insertar_recordatorios(len(ids)), [hoy] + ids)
+                    return cursor.rowcount, previos
+
+                insertadas, previos = await self.bd.transaccion(insertar)
+                creadas += insertadas
+                lotes += 1
+                if insertadas and previos is not None:
+                    enviadas += await self._publicar_recordatorios(ids, hoy, previos)
+
+            segundos = time.monotonic() - inicio
+            self.ultimo_recordatorio = {
+                "fecha": hoy.isoformat(),
+                "prestamos_vencidos": len(vencidos),
+                "creadas": creadas,
+                "omitidas": len(vencidos) - creadas,
+                "enviadas": enviadas,
+                "lotes": lotes,
+                "segundos": round(segundos, 3),
+                "por_segundo": round(creadas / segundos, 1) if segundos > 0 else 0.0,
+            }
+            logger.info(f"Recordatorios de préstamos vencidos: {self.ultimo_recordatorio}")
+            return self.ultimo_recordatorio
+
+        async def _publicar_recordatorios(self, ids_prestamo: List[int], dia: date, previos: set) -> int:
+            async with self.bd.obtener_cursor() as (cursor, _):
+                await cursor.execute(f"""
+                    SELECT id, usuario_id, mensaje, fecha, leida
+                    FROM notificaciones
+                    WHERE id_prestamo IN ({', '.join(['%s'] * len(ids_prestamo))})
+                      AND dia_recordatorio = %s
+                """, ids_prestamo + [dia])
+                filas = await cursor.fetchall()
+            enviadas = 0
+            for row in filas:
+                if row["id"] in previos:
+                    continue
+                row["leida"] = bool(row["leida"])
+                enviadas += difusor.publicar(row["usuario_id"], jsonable_encoder(row))
+            return enviadas
+
+        async def marcar_leidas(self, id_usuario: int, hasta_id: Optional[int] = None) -> int:
+            """Marca como leídas las notificaciones del usuario (hasta `hasta_id` inclusive)."""
+            condicion = " AND id <= %s" if hasta_id is not None else ""
+            async with self.bd.obtener_cursor() as (cursor, conexion):
+                await cursor.execute(
+                    f"UPDATE notificaciones SET leida = 1 WHERE usuario_id = %s AND leida = 0{condicion}",
+                    [id_usuario] + ([hasta_id] if hasta_id is not None else [])
                 )
-                conexion.commit()
-                return {"mensaje": "Notificación creada", "id": cursor.lastrowid}
-
-        def listar_todas(self) -> List[dict]:
-            with self.bd.obtener_cursor() as (cursor, _):
-                cursor.execute("""
-                    SELECT n.id, n.usuario_id, u.nombre AS usuario, n.mensaje, n.fecha
-                    FROM notificaciones n
-                    JOIN usuario u ON n.usuario_id = u.id
-                    ORDER BY n.fecha DESC
-                """)
-                return cursor.fetchall()
-
-        def listar_por_usuario(self, id_usuario: int) -> List[dict]:
-            with self.bd.obtener_cursor() as (cursor, _):
-                cursor.execute("SELECT id FROM usuario WHERE id = %s", (id_usuario,))
-                if not cursor.fetchone():
-                    raise HTTPException(status_code=404, detail="Usuario no encontrado")
-                
-                cursor.execute("""
-                    SELECT n.id, n.usuario_id, u.nombre AS usuario, n.mensaje, n.fecha
-                    FROM notificaciones n
-                    JOIN usuario u ON n.usuario_id = u.id
-                    WHERE n.usuario_id = %s
-                    ORDER BY n.fecha DESC
-                """, (id_usuario,))
-                return cursor.fetchall()
+                await conexion.commit()
+                return cursor.rowcount
 
 # Instancias de servicios
-servicio_libros = ServicioCRUD("libro")
-servicio_usuarios = ServicioCRUD("usuario")
+servicio_libros = ServicioCRUD("libro", consultas.COLUMNAS_LIBRO, indice=indice_libros,
+                               columna_carga="carga")
+servicio_usuarios = ServicioCRUD("usuario", consultas.COLUMNAS_USUARIO, unicos=("correo",))
 servicio_inventario = ServicioInventario()
 servicio_prestamos = ServicioPrestamos()
 servicio_notificaciones = ServicioNotificaciones()
 servicio_reportes = ServicioReportes()
+servicio_estadisticas = estadisticas.ServicioEstadisticas(bd_async)
+# Con BIBLIOTECA_COSTE_BCRYPT=N (ver `python login.py calibrar`) los hashes se recalculan a ese coste al entrar
+servicio_login = ServicioLogin(bd_async, coste_rehash=coste_del_entorno())
+cola_reportes = ColaReportes(bd_async, os.path.join(os.path.dirname(__file__), "temp", "trabajos"))
 
 # -------------------
 # Endpoints API REST
 # -------------------
 
+def _campos_query(campos: Optional[str]) -> Optional[List[str]]:
+    if not campos:
+        return None
+    return [c.strip() for c in campos.split(",") if c.strip()]
+
+def _respuesta_pagina(request: Request, response: Response, entrada: Entrada, proyectado: bool):
+    no_modificado = _no_modificado(request, entrada)
+    if no_modificado:
+        return no_modificado
+    filas, siguiente = entrada.valor
+    # El cursor de la siguiente página viaja en cabecera para no cambiar el formato de lista
+    headers = {"ETag": entrada.etag}
+    if siguiente is not None:
+        headers["X-Next-Cursor"] = str(siguiente)
+    if proyectado:
+        # Con proyección las filas no cumplen el modelo completo, se devuelven tal cual
+        return JSONResponse(content=jsonable_encoder(filas), headers=headers)
+    response.headers.update(headers)
+    return filas
+
 # Libros
 @app.get("/libros/", response_model=List[Libro])
-def listar_libros():
-    return servicio_libros.listar()
+async def listar_libros(
+    request: Request,
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    campos: Optional[str] = None,
+    autor: Optional[str] = None,
+    disponible: Optional[bool] = None,
+    titulo: Optional[str] = None,
+):
+    campos_lista = _campos_query(campos)
+    entrada = await servicio_libros.listar_pagina_cache(
+        after_id, limit, campos_lista,
+        filtros={"autor": autor, "disponible": disponible},
+        prefijos={"titulo": titulo},
+    )
+    return _respuesta_pagina(request, response, entrada, campos_lista is not None)
 
 @app.post("/libros/")
-def crear_libro(libro: LibroCreate):
-    return servicio_libros.crear({
+async def crear_libro(libro: LibroCreate):
+    return await servicio_libros.crear({
         "titulo": libro.titulo,
         "autor": libro.autor,
         "disponible": libro.disponible
     })
 
+@app.get("/libros/buscar/", response_model=Dict[str, Any])
+async def buscar_libros(
+    q: str = Query(..., min_length=1, max_length=200),
+    disponible: Optional[bool] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+):
+    resultados, total, exacto = indice_libros.buscar(q, disponible, limit, offset)
+    return {
+        "total": total,
+        "total_exacto": exacto,
+        "cargando": indice_libros.cargando,
+        "resultados": resultados,
+    }
+
+@app.get("/libros/{id}", response_model=Libro)
+async def obtener_libro(id: int):
+    libro = await servicio_libros.obtener(id)
+    if not libro:
+        raise HTTPException(status_code=404, detail="Libro no encontrado")
+    return libro
+
 @app.put("/libros/{id}")
-def actualizar_libro(id: int, libro: LibroCreate):
-    return servicio_libros.actualizar(id, {
+async def actualizar_libro(id: int, libro: LibroCreate):
+    return await servicio_libros.actualizar(id, {
         "titulo": libro.titulo,
         "autor": libro.autor,
         "disponible": libro.disponible
     })
 
 @app.delete("/libros/{id}")
-def eliminar_libro(id: int):
-    return servicio_libros.eliminar(id)
+async def eliminar_libro(id: int):
+    return await servicio_libros.eliminar(id)
 
 # Usuarios
 @app.get("/usuarios/", response_model=List[Usuario])
-def listar_usuarios():
-    return servicio_usuarios.listar()
+async def listar_usuarios(
+    request: Request,
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    campos: Optional[str] = None,
+    correo: Optional[str] = None,
+):
+    campos_lista = _campos_query(campos)
+    entrada = await servicio_usuarios.listar_pagina_cache(
+        after_id, limit, campos_lista, filtros={"correo": correo}
+    )
+    return _respuesta_pagina(request, response, entrada, campos_lista is not None)
 
 @app.post("/usuarios/")
-def crear_usuario(usuario: UsuarioCreate):
-    return servicio_usuarios.crear({
+async def crear_usuario(usuario: UsuarioCreate):
+    return await servicio_usuarios.crear({
         "nombre": usuario.nombre,
         "correo": usuario.correo
     })
-@app.put("/usuarios/{id}")
-def actualizar_usuario(id: int, usuario: UsuarioCreate):
-    usuarios = servicio_usuarios.listar()
-    if not any(u["id"] == id for u in usuarios):
+@app.get("/usuarios/{id}", response_model=Usuario)
+async def obtener_usuario(id: int):
+    usuario = await servicio_usuarios.obtener(id)
+    if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    servicio_usuarios.bd.ejecutar(
-        "UPDATE usuario SET nombre = %s, correo = %s WHERE id = %s",
-        (usuario.nombre, usuario.correo, id)
-    )
+    return usuario
+
+@app.put("/usuarios/{id}")
+async def actualizar_usuario(id: int, usuario: UsuarioCreate):
+    await servicio_usuarios.actualizar(id, {
+        "nombre": usuario.nombre,
+        "correo": usuario.correo
+    })
     return {"mensaje": "Usuario actualizado correctamente"}
 
 @app.delete("/usuarios/{id}")
-def eliminar_usuario(id: int):
-    usuarios = servicio_usuarios.listar()
-    if not any(u["id"] == id for u in usuarios):
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    servicio_usuarios.bd.ejecutar("DELETE FROM usuario WHERE id = %s", (id,))
+async def eliminar_usuario(id: int):
+    await servicio_usuarios.eliminar(id)
     return {"mensaje": "Usuario eliminado correctamente"}
 
+# Login
+@app.post("/login", response_model=LoginResponse)
+async def login(request: Request, datos: LoginRequest):
+    ip = request.client.host if request.client else None
+    usuario = await servicio_login.autenticar(datos.usuario, datos.password, ip)
+    return LoginResponse(mensaje="Login exitoso", usuario=usuario)
+
+# Carga masiva (JSON o CSV en streaming)
+def _validar_fila(modelo, numero: int, fila: Dict[str, Any], errores: List[dict]) -> Optional[dict]:
+    try:
+        return dict(modelo(**fila))
+    except ValidationError as e:
+        detalle = "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+        errores.append({"fila": numero, "error": detalle})
+        return None
+
+async def _filas_json(filas: List[Dict[str, Any]], modelo, errores: List[dict]):
+    for numero, fila in enumerate(filas, start=1):
+        datos = _validar_fila(modelo, numero, fila, errores)
+        if datos is not None:
+            yield numero, datos
+
+async def _filas_csv(request: Request, modelo, errores: List[dict]):
+    # Se decodifica y parsea el cuerpo a medida que llega, sin cargarlo entero en memoria.
+    # Un único csv.reader lee de una cola de líneas y solo se le pide el siguiente registro
+    # cuando la cola tiene uno completo (comillas cerradas): un campo entre comillas puede
+    # tener saltos de línea y quedar repartido entre bloques
+    decodificador = codecs.getincrementaldecoder("utf-8-sig")()
+    lineas = deque()
+    lector = csv.reader(iter(lineas.popleft, None))
+    pendiente = ""
+    abiertas = False
+    encabezado = None
+    numero = 0
+
+    def procesar(texto: str, final: bool = False):
+        nonlocal pendiente, abiertas, encabezado, numero
+        partes = (pendiente + texto).split("\n")
+        pendiente = "" if final else partes.pop()
+        for parte in partes:
+            lineas.append(parte + "\n")
+            abiertas ^= parte.count('"') % 2 == 1
+            if abiertas:
+                continue
+            valores = next(lector)
+            if not valores:
+                continue
+            if encabezado is None:
+                encabezado = [v.strip() for v in valores]
+                continue
+            numero += 1
+            datos = _validar_fila(modelo, numero, dict(zip(encabezado, valores)), errores)
+            if datos is not None:
+                yield numero, datos
+        if final and abiertas:
+            errores.append({"fila": numero + 1, "error": "comillas sin cerrar al final del CSV"})
+
+    async for bloque in request.stream():
+        for fila in procesar(decodificador.decode(bloque)):
+            yield fila
+    for fila in procesar(decodificador.decode(b"", final=True), final=True):
+        yield fila
+
+async def _importar(servicio: ServicioCRUD, filas, errores: List[dict], lote: int) -> dict:
+    resultado = await servicio.crear_masivo(filas, lote)
+    resultado["errores"] = sorted(errores + resultado["errores"], key=lambda e: e["fila"])
+    return resultado
+
+@app.post("/libros/bulk/")
+async def crear_libros_masivo(filas: List[Dict[str, Any]], lote: int = Query(500, ge=1, le=5000)):
+    errores = []
+    return await _importar(servicio_libros, _filas_json(filas, LibroCreate, errores), errores, lote)
+
+@app.post("/libros/bulk/csv/")
+async def crear_libros_masivo_csv(request: Request, lote: int = Query(500, ge=1, le=5000)):
+    errores = []
+    return await _importar(servicio_libros, _filas_csv(request, LibroCreate, errores), errores, lote)
+
+@app.post("/usuarios/bulk/")
+async def crear_usuarios_masivo(filas: List[Dict[str, Any]], lote: int = Query(500, ge=1, le=5000)):
+    errores = []
+    return await _importar(servicio_usuarios, _filas_json(filas, UsuarioCreate, errores), errores, lote)
+
+@app.post("/usuarios/bulk/csv/")
+async def crear_usuarios_masivo_csv(request: Request, lote: int = Query(500, ge=1, le=5000)):
+    errores = []
+    return await _importar(servicio_usuarios, _filas_csv(request, UsuarioCreate, errores), errores, lote)
+
 # Inventario
 @app.get("/inventario/disponibles/", response_model=List[Libro])
-def obtener_disponibles():
-    return servicio_inventario.obtener_disponibles()
+async def obtener_disponibles(request: Request, response: Response):
+    entrada = await servicio_inventario.obtener_disponibles_cache()
+    no_modificado = _no_modificado(request, entrada)
+    if no_modificado:
+        return no_modificado
+    response.headers["ETag"] = entrada.etag
+    return entrada.valor
 
 # Préstamos
 @app.post("/prestamos/")
-def crear_prestamo(prestamo: PrestamoCreate):
-    return servicio_prestamos.crear_prestamo(prestamo)
+async def crear_prestamo(prestamo: PrestamoCreate):
+    return await servicio_prestamos.crear_prestamo(prestamo)
 
 @app.get("/prestamos/", response_model=List[PrestamoInfo])
-def listar_prestamos():
-    return servicio_prestamos.listar_prestamos()
+async def listar_prestamos(
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    estado: Optional[str] = None,
+    id_usuario: Optional[int] = None,
+    id_libro: Optional[int] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+):
+    filas, siguiente = await servicio_prestamos.listar_pagina(after_id, limit, {
+        "estado": estado, "id_usuario": id_usuario, "id_libro": id_libro, "desde": desde, "hasta": hasta,
+    })
+    if siguiente is not None:
+        response.headers["X-Next-Cursor"] = str(siguiente)
+    return filas
+
+@app.post("/prestamos/{id_prestamo}/devolucion/")
+async def devolver_prestamo(id_prestamo: int):
+    return await servicio_prestamos.devolver(id_prestamo)
+
+@app.post("/prestamos/devoluciones/", response_model=Dict[str, List[int]])
+async def devolver_prestamos(devolucion: DevolucionMasiva):
+    if len(devolucion.ids) > 5000:
+        raise HTTPException(status_code=400, detail="Máximo 5000 préstamos por petición")
+    return await servicio_prestamos.devolver_masivo(devolucion.ids)
+
+# Estadísticas de préstamos
+@app.get("/estadisticas/libros/", response_model=List[Dict[str, Any]])
+async def estadisticas_libros(n: int = Query(5, ge=1, le=100)):
+    entrada = await cache_lecturas.obtener_async(
+        "estadistica", ("libros", n), lambda: servicio_estadisticas.top_libros(n)
+    )
+    return entrada.valor
 
-# Reportes
-@app.get("/reportes/", response_class=FileResponse)
-async def generar_reporte(tipo: str, filtros: Optional[str] = None):
+@app.get("/estadisticas/meses/", response_model=List[Dict[str, Any]])
+async def estadisticas_meses(desde: Optional[str] = None, hasta: Optional[str] = None):
+    entrada = await cache_lecturas.obtener_async(
+        "estadistica", ("meses", desde, hasta), lambda: servicio_estadisticas.prestamos_por_mes(desde, hasta)
+    )
+    return entrada.valor
+
+@app.get("/estadisticas/usuarios/", response_model=List[Dict[str, Any]])
+async def estadisticas_usuarios(n: int = Query(10, ge=1, le=100)):
+    return await servicio_estadisticas.prestamos_por_usuario(n)
+
+@app.get("/estadisticas/usuarios/{id_usuario}", response_model=Dict[str, Any])
+async def estadisticas_usuario(id_usuario: int):
+    resultado = await servicio_estadisticas.prestamos_de_usuario(id_usuario)
+    if not resultado:
+        return {"id_usuario": id_usuario, "prestamos": 0, "activos": 0}
+    return resultado
+
+@app.post("/estadisticas/reconstruir/", response_model=Dict[str, Any])
+def reconstruir_estadisticas():
+    resultado = estadisticas.reconstruir(bd)
+    cache_lecturas.invalidar("estadistica")
+    return resultado
+
+# Exportación en streaming (NDJSON o CSV, memoria constante)
+def _valor_json(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return str(valor)
+
+async def _lotes_ndjson(lotes):
+    async for filas in lotes:
+        yield "".join(json.dumps(fila, default=_valor_json, ensure_ascii=False) + "\n" for fila in filas)
+
+async def _lotes_csv(lotes, columnas):
+    buffer = io.StringIO()
+    escritor = csv.DictWriter(buffer, fieldnames=columnas, extrasaction="ignore")
+    escritor.writeheader()
+    yield buffer.getvalue()
+    async for filas in lotes:
+        buffer.seek(0)
+        buffer.truncate()
+        escritor.writerows(filas)
+        yield buffer.getvalue()
+
+@app.get("/exportar/{recurso}")
+async def exportar(recurso: str, formato: str = "ndjson", lote: int = Query(1000, ge=1, le=10000)):
+    servicios = {
+        "libros": servicio_libros,
+        "usuarios": servicio_usuarios,
+        "prestamos": servicio_prestamos,
+    }
+    if recurso not in servicios:
+        raise HTTPException(status_code=404, detail=f"Recurso no exportable: {recurso}")
+    servicio = servicios[recurso]
+    lotes = servicio.exportar(lote)
+    if formato == "ndjson":
+        contenido, media_type = _lotes_ndjson(lotes), "application/x-ndjson"
+    elif formato == "csv":
+        contenido, media_type = _lotes_csv(lotes, list(servicio.columnas)), "text/csv; charset=utf-8"
+    else:
+        raise HTTPException(status_code=400, detail="Formato no soportado, use ndjson o csv")
+    extension = "ndjson" if formato == "ndjson" else "csv"
+    return StreamingResponse(
+        contenido,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={recurso}.{extension}"},
+    )
+
+# Reportes (síncronos: FastAPI los ejecuta en el threadpool y no bloquean el event loop)
+def _nombre_archivo_reporte(tipo: str, filtros_dict: Optional[Dict[str, Any]]) -> str:
+    # Determinar el nombre del archivo según el tipo de reporte
+    if tipo.lower() == "tabla":
+        tabla = filtros_dict.get('tabla', 'prestamos') if filtros_dict else 'prestamos'
+        return f"reporte_{tabla}.pdf"
+    elif tipo.lower() == "grafico":
+        parametro = filtros_dict.get('parametro', 'libro_mas_solicitado') if filtros_dict else 'libro_mas_solicitado'
+        return f"{parametro}.pdf"
+    elif tipo.lower() == "comprobante":
+        # Generar un número incremental simple para el nombre (sin guardar en BD)
+        with servicio_reportes.bd.obtener_cursor() as (cursor, _):
+            cursor.execute("SELECT COUNT(*) as count FROM reporte WHERE tipo_reporte = (SELECT id FROM tipo_reporte WHERE descripcion = 'comprobante')")
+            count = cursor.fetchone()['count'] + 1
+        return f"comprobante_{count}.pdf"
+    return "reporte.pdf"
+
+def _leer_por_bloques(archivo, tamano_bloque: int = 64 * 1024):
+    try:
+        while True:
+            bloque = archivo.read(tamano_bloque)
+            if not bloque:
+                break
+            yield bloque
+    finally:
+        archivo.close()
+
+@app.get("/reportes/", response_class=Response)
+def generar_reporte(tipo: str, filtros: Optional[str] = None):
     try:
         filtros_dict = None
         if filtros:
             filtros_dict = json.loads(filtros)
         
-        pdf_data = servicio_reportes.generar_reporte(tipo, filtros_dict)
-        
-        # Determinar el nombre del archivo según el tipo de reporte
-        if tipo.lower() == "tabla":
-            tabla = filtros_dict.get('tabla', 'prestamos') if filtros_dict else 'prestamos'
-            filename = f"reporte_{tabla}.pdf"
-        elif tipo.lower() == "grafico":
-            parametro = filtros_dict.get('parametro', 'libro_mas_solicitado') if filtros_dict else 'libro_mas_solicitado'
-            filename = f"{parametro}.pdf"
-        elif tipo.lower() == "comprobante":
-            # Generar un número incremental simple para el nombre (sin guardar en BD)
-            with servicio_reportes.bd.obtener_cursor() as (cursor, _):
-                cursor.execute("SELECT COUNT(*) as count FROM reporte WHERE tipo_reporte = (SELECT id FROM tipo_reporte WHERE LOWER(descripcion) = 'comprobante')")
-                count = cursor.fetchone()['count'] + 1
-            filename = f"comprobante_{count}.pdf"
-        else:
-            filename = "reporte.pdf"
-
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_pdf:
-            temp_pdf.write(pdf_data)
-            response = FileResponse(temp_pdf.name, filename=filename, media_type="application/pdf")
-            response.headers["Content-Disposition"] = f"attachment; filename={filename}"
-            return response
+        archivo, tamano = servicio_reportes.generar_reporte_archivo(tipo, filtros_dict)
+        filename = _nombre_archivo_reporte(tipo, filtros_dict)
+        headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+        if tamano <= UMBRAL_MEMORIA_REPORTE:
+            with archivo:
+                return Response(content=archivo.read(), media_type="application/pdf", headers=headers)
+        # Reportes grandes: se envían desde el temporal en disco, que se borra al terminar
+        headers["Content-Length"] = str(tamano)
+        return StreamingResponse(_leer_por_bloques(archivo), media_type="application/pdf", headers=headers)
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al generar reporte: {str(e)}")
 
+# Trabajos de reporte en segundo plano
+@app.post("/reportes/trabajos/", status_code=202)
+async def enviar_trabajo_reporte(config: ReporteConfig):
+    return await cola_reportes.enviar(config.tipo, config.filtros)
+
+@app.get("/reportes/trabajos/{id_trabajo}", response_model=Dict[str, Any])
+async def estado_trabajo_reporte(id_trabajo: int):
+    return await cola_reportes.estado(id_trabajo)
+
+@app.get("/reportes/trabajos/{id_trabajo}/pdf", response_class=FileResponse)
+async def descargar_trabajo_reporte(id_trabajo: int):
+    ruta = await cola_reportes.ruta_pdf(id_trabajo)
+    trabajo = await cola_reportes.estado(id_trabajo)
+    filename = await run_in_threadpool(_nombre_archivo_reporte, trabajo["tipo"], trabajo["filtros"])
+    return FileResponse(ruta, filename=filename, media_type="application/pdf")
+
 @app.get("/reportes/listar/", response_model=List[Dict[str, Any]])
-async def listar_reportes():
+def listar_reportes():
     return servicio_reportes.listar_reportes()
 
 @app.get("/tipos_reporte/", response_model=List[Dict[str, Any]])
-async def listar_tipos_reporte():
-    return servicio_reportes.listar_tipos_reporte()
+def listar_tipos_reporte(request: Request, response: Response):
+    entrada = servicio_reportes.listar_tipos_reporte_cache()
+    no_modificado = _no_modificado(request, entrada)
+    if no_modificado:
+        return no_modificado
+    response.headers["ETag"] = entrada.etag
+    return entrada.valor
 
 @app.post("/tipos_reporte/", response_model=int)
-async def crear_tipo_reporte(tipo: TipoReporteCreate):
+def crear_tipo_reporte(tipo: TipoReporteCreate):
     return servicio_reportes.crear_tipo_reporte(tipo.descripcion)
 
 # Notificaciones
 @app.post("/notificaciones/")
-def crear_notificacion(notificacion: Notificacion):
-    return servicio_notificaciones.crear(notificacion.usuario_id, notificacion.mensaje)
+async def crear_notificacion(notificacion: Notificacion):
+    return await servicio_notificaciones.crear(notificacion.usuario_id, notificacion.mensaje)
+
+def _respuesta_feed(filas: List[dict], siguiente: Optional[str], since_id: Optional[int],
+                    no_leidas: Optional[int] = None) -> JSONResponse:
+    # Con since_id la cabecera lleva el id desde el que seguir; si no, el cursor de la siguiente página
+    headers = {}
+    if since_id is not None:
+        headers["X-Last-Id"] = siguiente
+    elif siguiente is not None:
+        headers["X-Next-Cursor"] = siguiente
+    if no_leidas is not None:
+        headers["X-No-Leidas"] = str(no_leidas)
+    return JSONResponse(content=jsonable_encoder(filas), headers=headers)
 
 @app.get("/notificaciones/", response_model=List[Dict[str, Any]])
-def listar_notificaciones():
-    return servicio_notificaciones.listar_todas()
+async def listar_notificaciones(
+    cursor: Optional[str] = None,
+    since_id: Optional[int] = Query(None, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+):
+    filas, siguiente = await servicio_notificaciones.pagina_todas(cursor, since_id, limit)
+    return _respuesta_feed(filas, siguiente, since_id)
 
 @app.get("/notificaciones/usuario/{id_usuario}", response_model=List[Dict[str, Any]])
-def listar_notificaciones_usuario(id_usuario: int):
-    return servicio_notificaciones.listar_por_usuario(id_usuario)
-
+async def listar_notificaciones_usuario(
+    id_usuario: int,
+    cursor: Optional[str] = None,
+    since_id: Optional[int] = Query(None, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+):
+    filas, siguiente, no_leidas = await servicio_notificaciones.pagina_usuario(id_usuario, cursor, since_id, limit)
+    return _respuesta_feed(filas, siguiente, since_id, no_leidas)
+
+@app.get("/notificaciones/usuario/{id_usuario}/no_leidas/", response_model=Dict[str, int])
+async def contar_notificaciones_no_leidas(id_usuario: int):
+    return {"no_leidas": await servicio_notificaciones.contar_no_leidas(id_usuario)}
+
+@app.post("/notificaciones/usuario/{id_usuario}/leidas/", response_model=Dict[str, int])
+async def marcar_notificaciones_leidas(id_usuario: int, hasta_id: Optional[int] = None):
+    return {"marcadas": await servicio_notificaciones.marcar_leidas(id_usuario, hasta_id)}
+
+async def _abrir_push(id_usuario: int, since_id: Optional[int]):
+    """Suscribe al usuario y devuelve (suscripción, notificaciones perdidas desde since_id).
+
+    Se suscribe antes de leer las perdidas para no dejar un hueco entre ambas;
+    los duplicados se filtran por id al enviar.
+    """
+    suscripcion = difusor.suscribir(id_usuario)
+    if suscripcion is None:
+        raise HTTPException(status_code=503, detail="Demasiadas conexiones de notificaciones",
+                            headers={"Retry-After": "30"})
+    try:
+        if since_id is not None:
+            pendientes, _, _ = await servicio_notificaciones.pagina_usuario(id_usuario, since_id=since_id, limite=500)
+        else:
+            await servicio_notificaciones.contar_no_leidas(id_usuario)
+            pendientes = []
+    except BaseException:
+        difusor.cancelar(suscripcion)
+        raise
+    return suscripcion, pendientes
+
+async def _mensajes_push(suscripcion, pendientes: List[dict]):
+    """Notificaciones perdidas y luego las nuevas; None cada LATIDO_PUSH segundos sin mensajes."""
+    ultimo_id = 0
+    for notificacion in pendientes:
+        ultimo_id = notificacion["id"]
+        yield jsonable_encoder(notificacion)
+    while True:
+        try:
+            mensaje = await suscripcion.recibir(timeout=LATIDO_PUSH)
+        except asyncio.TimeoutError:
+            yield None
+            continue
+        if mensaje is None:
+            return
+        if mensaje.get("id") is not None and mensaje["id"] <= ultimo_id:
+            continue
+        yield mensaje
+
+@app.websocket("/ws/notificaciones/{id_usuario}")
+async def push_notificaciones_ws(websocket: WebSocket, id_usuario: int, since_id: Optional[int] = None):
+    try:
+        suscripcion, pendientes = await _abrir_push(id_usuario, since_id)
+    except HTTPException as e:
+        # 1008: usuario inexistente; 1013: servidor saturado, reintentar más tarde
+        await websocket.close(code=1008 if e.status_code == 404 else 1013, reason=str(e.detail))
+        return
+    await websocket.accept()
+    try:
+        async for mensaje in _mensajes_push(suscripcion, pendientes):
+            await websocket.send_json(mensaje if mensaje is not None else {"tipo": "latido"})
+        # El difusor cerró la suscripción por consumidor lento
+        await websocket.close(code=1013, reason="Consumidor lento, reconecte con since_id")
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        difusor.cancelar(suscripcion)
+
+@app.get("/notificaciones/usuario/{id_usuario}/stream")
+async def push_notificaciones_sse(request: Request, id_usuario: int, since_id: Optional[int] = Query(None, ge=0)):
+    # EventSource reenvía el último id recibido al reconectar
+    ultimo = request.headers.get("last-event-id")
+    if since_id is None and ultimo and ultimo.isdigit():
+        since_id = int(ultimo)
+    suscripcion, pendientes = await _abrir_push(id_usuario, since_id)
+
+    async def eventos():
+        try:
+            async for mensaje in _mensajes_push(suscripcion, pendientes):
+                if await request.is_disconnected():
+                    break
+                if mensaje is None:
+                    yield ": latido\n\n"
+                    continue
+                id_evento = f"id: {mensaje['id']}\n" if mensaje.get("id") is not None else ""
+                yield f"{id_evento}event: notificacion\ndata: {json.dumps(mensaje, default=str)}\n\n"
+        finally:
+            difusor.cancelar(suscripcion)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/notificaciones/recordatorios/", response_model=Dict[str, Any])
+async def crear_recordatorios_vencidos(lote: int = Query(5000, ge=1, le=20000)):
+    return await servicio_notificaciones.crear_recordatorios_vencidos(lote)
+
+@app.get("/notificaciones/recordatorios/", response_model=Optional[Dict[str, Any]])
+async def ultimo_recordatorio_vencidos():
+    return servicio_notificaciones.ultimo_recordatorio
 
 @app.post("/notificaciones/enviar/")
-def enviar_notificacion(notificacion: Notificacion):
-    return servicio_notificaciones.enviar_notificacion(notificacion.usuario_id, notificacion.mensaje)
\ No newline at end of file
+async def enviar_notificacion(notificacion: Notificacion):
+    return await servicio_notificaciones.enviar_notificacion(notificacion.usuario_id, notificacion.mensaje)
\ No newline at end of file
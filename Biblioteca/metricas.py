@@ -0,0 +1,228 @@
+"""Métricas en proceso con exposición en formato de texto de Prometheus.
+
+Contadores, medidores e histogramas con etiquetas, protegidos por un lock
+porque los reportes se generan en el threadpool. Las métricas que ya llevan
+otros componentes (pools, caches) se leen al exponer mediante colectores.
+El tiempo de BD de cada petición se acumula en una ContextVar que abre el
+middleware y alimentan los cursores de conexion_bd.
+"""
+import contextvars
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Límites superiores de los buckets de latencia, en segundos
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BUCKETS_RENDER = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _etiquetas(nombres: Tuple[str, ...], valores: Tuple[str, ...], extra: str = "") -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _numero(valor: float) -> str:
+    if valor == math.inf:
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+
+    def _clave(self, etiquetas: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+
+    def exponer(self) -> List[str]:
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"] + self._lineas()
+
+    def _lineas(self) -> List[str]:
+        raise NotImplementedError
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self._valores: Dict[Tuple[str, ...], float] = {}
+
+    def incrementar(self, cantidad: float = 1, **etiquetas) -> None:
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def _lineas(self) -> List[str]:
+        with self._lock:
+            valores = list(self._valores.items())
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}" for clave, valor in valores]
+
+class Medidor(_Metrica):
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self._valores: Dict[Tuple[str, ...], float] = {}
+
+    def sumar(self, cantidad: float = 1, **etiquetas) -> None:
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def fijar(self, valor: float, **etiquetas) -> None:
+        with self._lock:
+            self._valores[self._clave(etiquetas)] = valor
+
+    def _lineas(self) -> List[str]:
+        with self._lock:
+            valores = list(self._valores.items())
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}" for clave, valor in valores]
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (),
+                 buckets: Iterable[float] = BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        # Por combinación de etiquetas: [conteos por bucket (no acumulados)..., +Inf], suma
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observar(self, valor: float, **etiquetas) -> None:
+        clave = self._clave(etiquetas)
+        posicion = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][posicion] += 1
+            serie[1] += valor
+
+    def _lineas(self) -> List[str]:
+        with self._lock:
+            series = [(clave, list(conteos), suma) for clave, (conteos, suma) in self._series.items()]
+        lineas = []
+        for clave, conteos, suma in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (math.inf,), conteos):
+                acumulado += conteo
+                le = 'le="' + _numero(limite) + '"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {acumulado}")
+        return lineas
+
+class Registro:
+    def __init__(self):
+        self._metricas: List[_Metrica] = []
+        self._colectores: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]] = []
+
+    def registrar(self, metrica: _Metrica) -> _Metrica:
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()) -> Contador:
+        return self.registrar(Contador(nombre, ayuda, etiquetas))
+
+    def medidor(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()) -> Medidor:
+        return self.registrar(Medidor(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (),
+                   buckets: Iterable[float] = BUCKETS_LATENCIA) -> Histograma:
+        return self.registrar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def colector(self, funcion: Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]):
+        """Registra una función que devuelve (nombre, tipo, ayuda, etiquetas, valor) al exponer."""
+        self._colectores.append(funcion)
+        return funcion
+
+    def exponer(self) -> str:
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.exponer())
+        # El formato exige que las muestras de una métrica vayan juntas
+        familias: Dict[str, list] = {}
+        for funcion in self._colectores:
+            for nombre, tipo, ayuda, etiquetas, valor in funcion():
+                if nombre not in familias:
+                    familias[nombre] = [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"]
+                nombres = tuple(etiquetas)
+                familias[nombre].append(
+                    f"{nombre}{_etiquetas(nombres, tuple(etiquetas[n] for n in nombres))} {_numero(valor)}")
+        for muestras in familias.values():
+            lineas.extend(muestras)
+        return "\n".join(lineas) + "\n"
+
+registro = Registro()
+
+consultas_bd = registro.contador(
+    "biblioteca_bd_consultas_total", "Consultas SQL ejecutadas", ("pool",))
+tiempo_bd = registro.contador(
+    "biblioteca_bd_consultas_segundos_total", "Tiempo total en consultas SQL", ("pool",))
+
+# [consultas, segundos] de la petición en curso; None fuera de una petición
+_bd_peticion: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("bd_peticion", default=None)
+
+def iniciar_peticion() -> Tuple[list, contextvars.Token]:
+    acumulado = [0, 0.0]
+    return acumulado, _bd_peticion.set(acumulado)
+
+def terminar_peticion(token: contextvars.Token) -> None:
+    _bd_peticion.reset(token)
+
+def registrar_consulta(pool: str, segundos: float) -> None:
+    consultas_bd.incrementar(pool=pool)
+    tiempo_bd.incrementar(segundos, pool=pool)
+    acumulado = _bd_peticion.get()
+    if acumulado is not None:
+        acumulado[0] += 1
+        acumulado[1] += segundos
+
+class CursorMedido:
+    """Envuelve un cursor y mide sus execute/executemany; el resto se delega."""
+
+    def __init__(self, cursor, pool: str):
+        self._cursor = cursor
+        self._pool = pool
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+    def execute(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        finally:
+            registrar_consulta(self._pool, time.perf_counter() - inicio)
+
+    def executemany(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.executemany(*args, **kwargs)
+        finally:
+            registrar_consulta(self._pool, time.perf_counter() - inicio)
+
+class CursorMedidoAsync(CursorMedido):
+    async def execute(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return await self._cursor.execute(*args, **kwargs)
+        finally:
+            registrar_consulta(self._pool, time.perf_counter() - inicio)
+
+    async def executemany(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return await self._cursor.executemany(*args, **kwargs)
+        finally:
+            registrar_consulta(self._pool, time.perf_counter() - inicio)
@@ -0,0 +1,27 @@
+--
+-- Índices para las consultas frecuentes de los servicios
+--
+
+-- Inventario de disponibles y paginación por disponibilidad: WHERE disponible = 1 ORDER BY id
+ALTER TABLE `libro`
+  ADD KEY `disponible_id` (`disponible`, `id`),
+  ADD KEY `autor_id` (`autor`, `id`),
+  ADD KEY `titulo` (`titulo`);
+
+-- Notificaciones de un usuario ordenadas por fecha: WHERE usuario_id = %s ORDER BY fecha DESC.
+-- El nuevo índice sirve también a la clave foránea, así que el antiguo sobra
+ALTER TABLE `notificaciones`
+  ADD KEY `usuario_fecha` (`usuario_id`, `fecha`, `id`),
+  ADD KEY `fecha_id` (`fecha`, `id`);
+
+ALTER TABLE `notificaciones`
+  DROP KEY `usuario_id`;
+
+-- Listado de reportes: ORDER BY fecha DESC
+ALTER TABLE `reporte`
+  ADD KEY `fecha` (`fecha`);
+
+-- Descripción única sin distinguir mayúsculas: la colación utf8mb4_general_ci ya compara
+-- sin mayúsculas ni acentos, así que basta con WHERE descripcion = %s (sin LOWER)
+ALTER TABLE `tipo_reporte`
+  ADD UNIQUE KEY `descripcion` (`descripcion`);
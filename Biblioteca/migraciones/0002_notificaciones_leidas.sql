@@ -0,0 +1,10 @@
+--
+-- Estado de lectura de las notificaciones y accesos del feed incremental
+--
+
+-- Contador de no leídas: WHERE usuario_id = %s AND leida = 0.
+-- Consulta incremental: WHERE usuario_id = %s AND id > %s
+ALTER TABLE `notificaciones`
+  ADD COLUMN `leida` tinyint(1) NOT NULL DEFAULT 0,
+  ADD KEY `usuario_leida` (`usuario_id`, `leida`),
+  ADD KEY `usuario_id` (`usuario_id`, `id`);
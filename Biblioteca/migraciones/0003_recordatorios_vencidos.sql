@@ -0,0 +1,13 @@
+--
+-- Recordatorios de préstamos vencidos
+--
+
+-- Un recordatorio por préstamo y día: la clave única hace idempotente la generación
+ALTER TABLE `notificaciones`
+  ADD COLUMN `id_prestamo` int(11) DEFAULT NULL,
+  ADD COLUMN `dia_recordatorio` date DEFAULT NULL,
+  ADD UNIQUE KEY `recordatorio` (`id_prestamo`, `dia_recordatorio`);
+
+-- Préstamos vencidos: WHERE devuelto = 0 AND fecha_devolucion < %s
+ALTER TABLE `prestamo`
+  ADD KEY `vencidos` (`devuelto`, `fecha_devolucion`);
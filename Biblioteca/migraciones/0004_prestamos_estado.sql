@@ -0,0 +1,16 @@
+--
+-- Consultas de circulación: préstamos por estado, usuario, libro y fecha
+--
+
+-- Activos/devueltos paginados por id: WHERE devuelto = %s AND id > %s ORDER BY id
+-- Historial de un usuario o libro: WHERE id_usuario = %s AND devuelto = %s AND id > %s.
+-- Los índices compuestos sirven también a las claves foráneas, así que los antiguos sobran
+ALTER TABLE `prestamo`
+  ADD KEY `devuelto_id` (`devuelto`, `id`),
+  ADD KEY `usuario_devuelto` (`id_usuario`, `devuelto`, `id`),
+  ADD KEY `libro_devuelto` (`id_libro`, `devuelto`, `id`),
+  ADD KEY `fecha_prestamo` (`fecha_prestamo`, `id`);
+
+ALTER TABLE `prestamo`
+  DROP KEY `id_usuario`,
+  DROP KEY `id_libro`;
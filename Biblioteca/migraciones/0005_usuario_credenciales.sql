@@ -0,0 +1,13 @@
+--
+-- Credenciales de acceso en la tabla usuario
+--
+
+-- login.py autenticaba contra una tabla `users` aparte y con su propio pool.
+-- Las cuentas pasan a la tabla usuario; los lectores sin acceso las dejan a NULL.
+-- Las cuentas existentes se copian a mano, casando cada una con su lector:
+--   UPDATE usuario u JOIN users s ON s.nombre = u.nombre
+--     SET u.usuario = s.usuario, u.hashed_password = s.hashed_password;
+ALTER TABLE `usuario`
+  ADD COLUMN `usuario` varchar(50) DEFAULT NULL,
+  ADD COLUMN `hashed_password` varchar(100) DEFAULT NULL,
+  ADD UNIQUE KEY `usuario` (`usuario`);
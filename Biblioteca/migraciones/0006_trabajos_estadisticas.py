@@ -0,0 +1,5 @@
+"""Rellena los contadores de estadísticas con los préstamos ya existentes."""
+from estadisticas import recalcular
+
+def aplicar(cursor) -> None:
+    recalcular(cursor)
@@ -0,0 +1,42 @@
+--
+-- Cola de trabajos de reportes y contadores de estadísticas
+--
+
+-- trabajo_reporte guarda los PDFs que ColaReportes genera en segundo plano.
+CREATE TABLE IF NOT EXISTS `trabajo_reporte` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `tipo` varchar(100) NOT NULL,
+  `filtros` text DEFAULT NULL,
+  `estado` varchar(20) NOT NULL DEFAULT 'pendiente',
+  `error` text DEFAULT NULL,
+  `archivo` varchar(255) DEFAULT NULL,
+  `creado` datetime DEFAULT current_timestamp(),
+  `actualizado` datetime DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+  PRIMARY KEY (`id`),
+  KEY `estado` (`estado`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- Contadores que mantiene estadisticas.py al prestar y devolver. Se rellenan
+-- desde prestamo con 0006_trabajos_estadisticas.py en la misma migración.
+CREATE TABLE IF NOT EXISTS `estadistica_libro` (
+  `id_libro` int(11) NOT NULL,
+  `prestamos` int(11) NOT NULL DEFAULT 0,
+  `activos` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id_libro`),
+  KEY `prestamos` (`prestamos`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `estadistica_mes` (
+  `mes` char(7) NOT NULL,
+  `slot` tinyint(4) NOT NULL DEFAULT 0,
+  `prestamos` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`mes`, `slot`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `estadistica_usuario` (
+  `id_usuario` int(11) NOT NULL,
+  `prestamos` int(11) NOT NULL DEFAULT 0,
+  `activos` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id_usuario`),
+  KEY `prestamos` (`prestamos`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
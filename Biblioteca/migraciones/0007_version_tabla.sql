@@ -0,0 +1,88 @@
+--
+-- Versión persistente de las tablas de las que dependen los reportes
+--
+
+-- La caché de PDFs (ServicioReportes) usaba UPDATE_TIME de information_schema,
+-- que InnoDB no persiste y que tiene resolución de segundos. Cada escritura en
+-- estas tablas suma 1 a su contador en la misma transacción, así que la clave
+-- de la caché cambia exactamente cuando cambian los datos, también tras un
+-- reinicio o si escribe otro proceso.
+-- El contador se reparte en 16 ranuras por conexión para que las escrituras
+-- concurrentes no esperen a la misma fila; la versión es la suma de ranuras.
+-- Con binlog activo, crear triggers puede requerir log_bin_trust_function_creators.
+CREATE TABLE IF NOT EXISTS `version_tabla` (
+  `tabla` varchar(64) NOT NULL,
+  `ranura` tinyint(4) NOT NULL,
+  `version` bigint(20) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`tabla`, `ranura`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TRIGGER `libro_version_insert` AFTER INSERT ON `libro` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('libro', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `libro_version_update` AFTER UPDATE ON `libro` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('libro', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `libro_version_delete` AFTER DELETE ON `libro` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('libro', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+
+CREATE TRIGGER `usuario_version_insert` AFTER INSERT ON `usuario` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('usuario', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `usuario_version_update` AFTER UPDATE ON `usuario` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('usuario', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `usuario_version_delete` AFTER DELETE ON `usuario` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('usuario', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+
+CREATE TRIGGER `prestamo_version_insert` AFTER INSERT ON `prestamo` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('prestamo', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `prestamo_version_update` AFTER UPDATE ON `prestamo` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('prestamo', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `prestamo_version_delete` AFTER DELETE ON `prestamo` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('prestamo', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+
+CREATE TRIGGER `reporte_version_insert` AFTER INSERT ON `reporte` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('reporte', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `reporte_version_update` AFTER UPDATE ON `reporte` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('reporte', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `reporte_version_delete` AFTER DELETE ON `reporte` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('reporte', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+
+CREATE TRIGGER `tipo_reporte_version_insert` AFTER INSERT ON `tipo_reporte` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('tipo_reporte', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `tipo_reporte_version_update` AFTER UPDATE ON `tipo_reporte` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('tipo_reporte', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `tipo_reporte_version_delete` AFTER DELETE ON `tipo_reporte` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('tipo_reporte', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+
+CREATE TRIGGER `estadistica_libro_version_insert` AFTER INSERT ON `estadistica_libro` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('estadistica_libro', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `estadistica_libro_version_update` AFTER UPDATE ON `estadistica_libro` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('estadistica_libro', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `estadistica_libro_version_delete` AFTER DELETE ON `estadistica_libro` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('estadistica_libro', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+
+CREATE TRIGGER `estadistica_mes_version_insert` AFTER INSERT ON `estadistica_mes` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('estadistica_mes', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `estadistica_mes_version_update` AFTER UPDATE ON `estadistica_mes` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('estadistica_mes', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
+CREATE TRIGGER `estadistica_mes_version_delete` AFTER DELETE ON `estadistica_mes` FOR EACH ROW
+  INSERT INTO `version_tabla` (`tabla`, `ranura`, `version`) VALUES ('estadistica_mes', CONNECTION_ID() % 16, 1)
+  ON DUPLICATE KEY UPDATE `version` = `version` + 1;
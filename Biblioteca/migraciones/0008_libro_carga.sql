@@ -0,0 +1,10 @@
+--
+-- Marca de la carga masiva que creó cada libro
+--
+
+-- libro no tiene columna única con la que releer los ids de un INSERT multi-fila.
+-- Con innodb_autoinc_lock_mode=2 esos ids no son consecutivos, así que
+-- ServicioCRUD.crear_masivo marca cada lote con un valor propio y los lee por él.
+ALTER TABLE `libro`
+  ADD COLUMN `carga` char(32) DEFAULT NULL,
+  ADD KEY `carga` (`carga`);
@@ -0,0 +1,21 @@
+--
+-- Registro de cambios de libro para los índices de búsqueda
+--
+
+-- Cada worker tiene su propio índice en memoria (busqueda.IndiceLibros) y solo
+-- veía sus propias escrituras. Los triggers apuntan el id de cada libro creado,
+-- modificado o borrado; cada worker lee las filas nuevas cada pocos segundos y
+-- relee esos libros (busqueda.SincronizacionLibros), que también borra las
+-- filas antiguas.
+CREATE TABLE IF NOT EXISTS `libro_cambio` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `id_libro` int(11) NOT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TRIGGER `libro_cambio_insert` AFTER INSERT ON `libro` FOR EACH ROW
+  INSERT INTO `libro_cambio` (`id_libro`) VALUES (NEW.`id`);
+CREATE TRIGGER `libro_cambio_update` AFTER UPDATE ON `libro` FOR EACH ROW
+  INSERT INTO `libro_cambio` (`id_libro`) VALUES (NEW.`id`);
+CREATE TRIGGER `libro_cambio_delete` AFTER DELETE ON `libro` FOR EACH ROW
+  INSERT INTO `libro_cambio` (`id_libro`) VALUES (OLD.`id`);
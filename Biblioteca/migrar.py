@@ -0,0 +1,324 @@
+"""Migraciones de esquema versionadas.
+
+biblioteca.sql crea el esquema base; los cambios posteriores viven en
+migraciones/ como archivos NNNN_descripcion.sql que se aplican una sola vez y
+en orden, registrándose en la tabla schema_migracion. Si junto al .sql hay un
+NNNN_descripcion.py con una función aplicar(cursor), se ejecuta después de las
+sentencias y antes del commit (para rellenar datos que no caben en SQL). Uso:
+
+    python migrar.py             aplica las migraciones pendientes
+    python migrar.py estado      lista las aplicadas y las pendientes
+    python migrar.py verificar   comprueba con EXPLAIN que las consultas usan índices
+
+`verificar` toma el SQL de los servicios de consultas.py (y de las constantes
+de login, trabajos y estadisticas), no copias, y exige que cada consulta use
+exactamente su índice, sin importar cuántas filas tenga la tabla.
+
+En MySQL el DDL hace commit implícito: si una sentencia falla, las anteriores
+de la misma migración quedan aplicadas y hay que corregirlo a mano.
+
+Con el backend SQLite (BIBLIOTECA_BD=sqlite:///...) el esquema se crea ya
+completo desde esquema_sqlite.sql, así que solo tiene sentido `verificar`, que
+usa EXPLAIN QUERY PLAN; los índices se llaman tabla_indice.
+"""
+import hashlib
+import importlib.util
+import os
+import re
+import sys
+from typing import List, Optional
+
+import consultas
+import estadisticas
+import login
+import trabajos
+
+DIRECTORIO = os.path.join(os.path.dirname(__file__), "migraciones")
+
+_ARCHIVO = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+def _feed(pagina, antes, since_id, previos: tuple) -> tuple:
+    # (query, valores) de una página de notificaciones tal como la piden los servicios
+    condicion, valores, orden = consultas.condicion_notificaciones(antes, since_id)
+    return pagina(condicion, orden), previos + tuple(valores) + (100,)
+
+# Consultas de los servicios y el índice que debe resolverlas. Se construyen con el
+# mismo SQL que ejecutan (consultas.py y las constantes de cada módulo); `alias` es
+# el nombre con el que la tabla aparece en el plan
+CONSULTAS = [
+    ("ServicioInventario.obtener_disponibles", "libro", "libro", "disponible_id",
+     consultas.SQL_LIBROS_DISPONIBLES, ()),
+    ("ServicioCRUD.listar_pagina (autor)", "libro", "libro", "autor_id",
+     *consultas.pagina_crud("libro", consultas.COLUMNAS_LIBRO, 0, 100, {"autor": "x"}, {})),
+    ("ServicioCRUD.listar_pagina (titulo)", "libro", "libro", "titulo",
+     *consultas.pagina_crud("libro", consultas.COLUMNAS_LIBRO, None, 100, {}, {"titulo": "x"})),
+    ("SincronizacionLibros.sincronizar", "libro_cambio", "libro_cambio", "PRIMARY",
+     consultas.SQL_CAMBIOS_LIBRO, (0,)),
+    ("SincronizacionLibros.sincronizar (libros)", "libro", "libro", "PRIMARY",
+     consultas.libros_por_id(2), (1, 2)),
+    ("ServicioCRUD.listar_pagina (correo)", "usuario", "usuario", "correo",
+     *consultas.pagina_crud("usuario", consultas.COLUMNAS_USUARIO, None, 100, {"correo": "x"}, {})),
+    ("ServicioLogin.autenticar", "usuario", "usuario", "usuario",
+     login.SQL_USUARIO_LOGIN, ("x",)),
+    ("ServicioNotificaciones.pagina_usuario", "notificaciones", "n", "usuario_fecha",
+     *_feed(consultas.pagina_notificaciones_usuario, None, None, (1, 1))),
+    ("ServicioNotificaciones.pagina_usuario (cursor)", "notificaciones", "n", "usuario_fecha",
+     *_feed(consultas.pagina_notificaciones_usuario, ("2024-01-01", 1), None, (1, 1))),
+    ("ServicioNotificaciones.pagina_usuario (since_id)", "notificaciones", "n", "usuario_id",
+     *_feed(consultas.pagina_notificaciones_usuario, None, 0, (1, 1))),
+    ("ServicioNotificaciones.pagina_usuario (no leídas)", "notificaciones", "notificaciones", "usuario_leida",
+     *_feed(consultas.pagina_notificaciones_usuario, None, None, (1, 1))),
+    ("ServicioNotificaciones.contar_no_leidas", "notificaciones", "notificaciones", "usuario_leida",
+     consultas.SQL_NO_LEIDAS, (1,)),
+    ("ServicioNotificaciones.pagina_todas", "notificaciones", "n", "fecha_id",
+     *_feed(consultas.pagina_notificaciones, None, None, ())),
+    ("ServicioNotificaciones.crear_recordatorios_vencidos", "prestamo", "prestamo", "vencidos",
+     consultas.SQL_PRESTAMOS_VENCIDOS, ("2024-01-01",)),
+    ("ServicioNotificaciones.crear_recordatorios_vencidos (previos)", "notificaciones", "notificaciones",
+     "recordatorio", consultas.recordatorios_previos(2), (1, 2, "2024-01-01")),
+    ("ServicioNotificaciones.crear_recordatorios_vencidos (insert)", "prestamo", "p", "PRIMARY",
+     consultas.insertar_recordatorios(2), ("2024-01-01", 1, 2)),
+    ("ServicioPrestamos.listar_pagina (estado)", "prestamo", "p", "devuelto_id",
+     *consultas.pagina_prestamos(0, 100, {"estado": "activo"})),
+    ("ServicioPrestamos.listar_pagina (usuario)", "prestamo", "p", "usuario_devuelto",
+     *consultas.pagina_prestamos(0, 100, {"estado": "activo", "id_usuario": 1})),
+    ("ServicioPrestamos.listar_pagina (libro)", "prestamo", "p", "libro_devuelto",
+     *consultas.pagina_prestamos(0, 100, {"id_libro": 1})),
+    ("ServicioPrestamos.listar_pagina (fechas)", "prestamo", "p", "fecha_prestamo",
+     *consultas.pagina_prestamos(None, 100, {"desde": "2024-01-01", "hasta": "2024-01-31"})),
+    ("ServicioReportes.listar_reportes", "reporte", "r", "fecha",
+     consultas.SQL_LISTAR_REPORTES, ()),
+    ("ColaReportes.iniciar", "trabajo_reporte", "trabajo_reporte", "estado",
+     trabajos.SQL_TRABAJOS_PENDIENTES, ()),
+    ("ColaReportes.iniciar (abandonados)", "trabajo_reporte", "trabajo_reporte", "estado",
+     trabajos.SQL_TRABAJOS_ABANDONADOS, ("2024-01-01 00:00:00",)),
+    ("ServicioEstadisticas.top_libros", "estadistica_libro", "e", "prestamos",
+     estadisticas.SQL_TOP_LIBROS, (5,)),
+]
+
+# Escrituras que dependen de una clave única para detectar el duplicado: EXPLAIN no
+# lo muestra, así que se comprueba que el índice exista y sea único
+CLAVES_UNICAS = [
+    ("ServicioReportes.crear_tipo_reporte", "tipo_reporte", "descripcion"),
+    ("ServicioCRUD.crear_masivo (usuario)", "usuario", "correo"),
+    ("ServicioNotificaciones.crear_recordatorios_vencidos", "notificaciones", "recordatorio"),
+]
+
+def _migraciones() -> List[tuple]:
+    encontradas = []
+    for nombre in sorted(os.listdir(DIRECTORIO)):
+        coincidencia = _ARCHIVO.match(nombre)
+        if coincidencia:
+            with open(os.path.join(DIRECTORIO, nombre), encoding="utf-8") as archivo:
+                contenido = archivo.read()
+            encontradas.append((int(coincidencia.group(1)), nombre, contenido))
+    return encontradas
+
+def _complemento(nombre: str):
+    """Módulo NNNN_descripcion.py que acompaña a la migración, o None."""
+    ruta = os.path.join(DIRECTORIO, nombre[:-len(".sql")] + ".py")
+    if not os.path.exists(ruta):
+        return None
+    spec = importlib.util.spec_from_file_location("migracion_" + nombre[:-len(".sql")], ruta)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+def _sentencias(contenido: str) -> List[str]:
+    # Una sentencia termina en una línea acabada en ';'; los comentarios -- se descartan
+    sentencias, actual = [], []
+    for linea in contenido.splitlines():
+        if linea.strip().startswith("--") or not linea.strip():
+            continue
+        actual.append(linea)
+        if linea.rstrip().endswith(";"):
+            sentencias.append("\n".join(actual).rstrip()[:-1])
+            actual = []
+    if actual:
+        sentencias.append("\n".join(actual))
+    return sentencias
+
+def _suma(contenido: str) -> str:
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+def _aplicadas(cursor) -> dict:
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migracion (
+          version int(11) NOT NULL PRIMARY KEY,
+          nombre varchar(255) NOT NULL,
+          suma char(64) NOT NULL,
+          aplicada datetime DEFAULT current_timestamp()
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+    cursor.execute("SELECT version, nombre, suma, aplicada FROM schema_migracion ORDER BY version")
+    return {row["version"]: row for row in cursor.fetchall()}
+
+def estado(bd) -> List[dict]:
+    with bd.obtener_cursor() as (cursor, _):
+        aplicadas = _aplicadas(cursor)
+    resultado = []
+    for version, nombre, contenido in _migraciones():
+        registro = aplicadas.get(version)
+        resultado.append({
+            "version": version,
+            "nombre": nombre,
+            "aplicada": registro["aplicada"] if registro else None,
+            # Un archivo editado después de aplicarse no se vuelve a ejecutar
+            "modificada": bool(registro) and registro["suma"] != _suma(contenido),
+        })
+    return resultado
+
+def aplicar(bd, hasta: Optional[int] = None) -> List[str]:
+    """Aplica en orden las migraciones pendientes (hasta la versión `hasta`)."""
+    hechas = []
+    with bd.obtener_cursor() as (cursor, conexion):
+        aplicadas = _aplicadas(cursor)
+        for version, nombre, contenido in _migraciones():
+            if version in aplicadas or (hasta is not None and version > hasta):
+                continue
+            for sentencia in _sentencias(contenido):
+                try:
+                    cursor.execute(sentencia)
+                except Exception as e:
+                    raise RuntimeError(f"{nombre}: error en la sentencia\n{sentencia}\n{e}") from e
+            complemento = _complemento(nombre)
+            if complemento is not None:
+                try:
+                    complemento.aplicar(cursor)
+                except Exception as e:
+                    raise RuntimeError(f"{nombre}: error en {complemento.__file__}\n{e}") from e
+            cursor.execute(
+                "INSERT INTO schema_migracion (version, nombre, suma) VALUES (%s, %s, %s)",
+                (version, nombre, _suma(contenido))
+            )
+            conexion.commit()
+            hechas.append(nombre)
+    return hechas
+
+def _plan_mysql(cursor, tabla: str, alias: str, indice: str, query: str, params) -> tuple:
+    cursor.execute(
+        "SELECT 1 FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s LIMIT 1",
+        (tabla, indice)
+    )
+    existe = cursor.fetchone() is not None
+    # Con tablas pequeñas el optimizador prefiere recorrerlas enteras aunque haya
+    # índice; max_seeks_for_key = 1 le hace estimar cada búsqueda por índice como
+    # muy barata, de modo que el plan es el que tendría con la tabla llena
+    cursor.execute("SET SESSION max_seeks_for_key = 1")
+    try:
+        cursor.execute("EXPLAIN " + query, params)
+        plan = next((row for row in cursor.fetchall() if row["table"] == alias), {})
+    finally:
+        cursor.execute("SET SESSION max_seeks_for_key = DEFAULT")
+    return existe, plan
+
+_USO_INDICE = re.compile(r"USING (?:COVERING )?INDEX (\w+)|USING INTEGER (PRIMARY KEY)")
+
+def _plan_sqlite(cursor, tabla: str, alias: str, indice: str, query: str, params) -> tuple:
+    # Se traduce al formato de EXPLAIN de MySQL; SQLite no estima filas, se cuentan.
+    # Sin ANALYZE el planificador supone tablas grandes, así que el plan no depende
+    # de cuántas filas haya
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = %s", (f"{tabla}_{indice}",))
+    existe = indice == "PRIMARY" or cursor.fetchone() is not None
+    cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+    detalles = [row["detail"] for row in cursor.fetchall()]
+    acceso = next((d for d in detalles if re.match(rf"(SEARCH|SCAN) {alias}\b", d)), "")
+    uso = _USO_INDICE.search(acceso)
+    usado = None
+    if uso:
+        usado = "PRIMARY" if uso.group(2) else uso.group(1)[len(tabla) + 1:]
+    cursor.execute(f"SELECT COUNT(*) AS filas FROM {tabla}")
+    return existe, {
+        "key": usado,
+        "type": acceso.split(" ", 1)[0] or None,
+        "rows": cursor.fetchone()["filas"],
+        "Extra": "; ".join(d for d in detalles if d != acceso) or None,
+    }
+
+def _es_unico(cursor, backend: str, tabla: str, indice: str) -> Optional[bool]:
+    """True si el índice existe y es único, False si no es único, None si no existe."""
+    if backend == "sqlite":
+        cursor.execute(f"PRAGMA index_list({tabla})")
+        fila = next((row for row in cursor.fetchall() if row["name"] == f"{tabla}_{indice}"), None)
+        return None if fila is None else bool(fila["unique"])
+    cursor.execute(
+        "SELECT NON_UNIQUE FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s LIMIT 1",
+        (tabla, indice)
+    )
+    fila = cursor.fetchone()
+    return None if fila is None else not int(fila["NON_UNIQUE"])
+
+def verificar(bd) -> List[dict]:
+    """Ejecuta EXPLAIN sobre CONSULTAS y comprueba CLAVES_UNICAS.
+
+    Una consulta solo pasa si el plan usa exactamente el índice esperado.
+    """
+    resultado = []
+    backend = bd.backend.nombre
+    planificar = _plan_sqlite if backend == "sqlite" else _plan_mysql
+    with bd.obtener_cursor() as (cursor, _):
+        for servicio, tabla, alias, indice, query, params in CONSULTAS:
+            existe, plan = planificar(cursor, tabla, alias, indice, query, params)
+            usado = plan.get("key")
+            if not existe:
+                veredicto = "falta el índice"
+            elif usado == indice:
+                veredicto = "ok"
+            elif usado:
+                veredicto = "otro índice"
+            else:
+                veredicto = "sin índice"
+            resultado.append({
+                "servicio": servicio,
+                "tabla": tabla,
+                "indice": indice,
+                "usado": usado,
+                "tipo": plan.get("type"),
+                "filas": int(plan.get("rows") or 0),
+                "extra": plan.get("Extra"),
+                "ok": veredicto == "ok",
+                "veredicto": veredicto,
+            })
+        for servicio, tabla, indice in CLAVES_UNICAS:
+            unico = _es_unico(cursor, backend, tabla, indice)
+            veredicto = {None: "falta el índice", False: "índice no único", True: "ok"}[unico]
+            resultado.append({
+                "servicio": servicio,
+                "tabla": tabla,
+                "indice": indice,
+                "usado": indice if unico is not None else None,
+                "tipo": "unique",
+                "filas": None,
+                "extra": None,
+                "ok": unico is True,
+                "veredicto": veredicto,
+            })
+    return resultado
+
+if __name__ == "__main__":
+    from conexion_bd import ConexionBD
+    orden = sys.argv[1:] or ["aplicar"]
+    bd = ConexionBD(tamano_pool=1, max_overflow=0)
+    if bd.backend.nombre == "sqlite" and orden in (["aplicar"], ["estado"]):
+        print("El backend SQLite crea el esquema completo desde esquema_sqlite.sql; "
+              "las migraciones son solo para MySQL")
+    elif orden == ["aplicar"]:
+        hechas = aplicar(bd)
+        print("\n".join(hechas) if hechas else "No hay migraciones pendientes")
+    elif orden == ["estado"]:
+        for migracion in estado(bd):
+            marca = "aplicada " + str(migracion["aplicada"]) if migracion["aplicada"] else "pendiente"
+            aviso = " (modificada tras aplicarse)" if migracion["modificada"] else ""
+            print(f"{migracion['nombre']}: {marca}{aviso}")
+    elif orden == ["verificar"]:
+        resultado = verificar(bd)
+        for fila in resultado:
+            filas = f", {fila['filas']} filas" if fila["filas"] is not None else ""
+            print(f"[{fila['veredicto']}] {fila['servicio']}: {fila['tabla']} "
+                  f"usa {fila['usado'] or '-'} (esperado {fila['indice']}; {fila['tipo']}{filas})")
+        sys.exit(0 if all(fila["ok"] for fila in resultado) else 1)
+    else:
+        print("Uso: python migrar.py [aplicar|estado|verificar]")
+        sys.exit(1)
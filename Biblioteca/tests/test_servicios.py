@@ -0,0 +1,289 @@
+"""Servicios de la app contra una base sembrada; ver conftest.py."""
+import asyncio
+import json
+from datetime import date, datetime, timedelta
+
+import bcrypt
+import pytest
+
+from ejecutar import TABLAS_REPORTE, verificar_doble_prestamo
+from login import VARIABLE_COSTE, coste_de, coste_del_entorno
+
+pytestmark = pytest.mark.anyio
+
+def _vencimiento() -> str:
+    return (date.today() + timedelta(days=21)).isoformat()
+
+async def test_libros_crud(entorno):
+    """CRUD de libros y su reflejo en el índice de búsqueda."""
+    cliente = entorno.cliente
+    libro = {"titulo": "Laberinto de ceniza verificado", "autor": "Clara Molina Serrano", "disponible": True}
+    creado = await cliente.post("/libros/", json=libro)
+    assert creado.status_code == 200
+    id_libro = creado.json()["id"]
+    assert (await cliente.get(f"/libros/{id_libro}")).json() == dict(libro, id=id_libro)
+
+    cambios = dict(libro, titulo="Laberinto de ceniza corregido")
+    assert (await cliente.put(f"/libros/{id_libro}", json=cambios)).status_code == 200
+    assert (await cliente.get(f"/libros/{id_libro}")).json()["titulo"] == cambios["titulo"]
+    buscado = await cliente.get("/libros/buscar/", params={"q": "laberinto ceniza corregido"})
+    assert any(r["id"] == id_libro for r in buscado.json()["resultados"])
+
+    assert (await cliente.delete(f"/libros/{id_libro}")).status_code == 200
+    assert (await cliente.get(f"/libros/{id_libro}")).status_code == 404
+    assert (await cliente.delete(f"/libros/{id_libro}")).status_code == 404
+    assert (await cliente.put(f"/libros/{id_libro}", json=libro)).status_code == 404
+
+async def test_indice_otros_procesos(entorno):
+    """Los libros que escribe otro proceso llegan al índice de búsqueda al sincronizar."""
+    cliente, bd = entorno.cliente, entorno.bd
+    sincronizar = entorno.main.sincronizacion_libros.sincronizar
+
+    async def buscar(q):
+        respuesta = await cliente.get("/libros/buscar/", params={"q": q})
+        return {r["id"]: r for r in respuesta.json()["resultados"]}
+
+    with bd.obtener_cursor() as (cursor, conexion):
+        cursor.execute("INSERT INTO libro (titulo, autor, disponible) VALUES (%s, %s, 1)",
+                       ("Cuaderno de otro worker", "Irene Ramos Gil"))
+        id_libro = cursor.lastrowid
+        conexion.commit()
+    assert id_libro not in await buscar("cuaderno otro worker")
+    await asyncio.to_thread(sincronizar)
+    assert (await buscar("cuaderno otro worker"))[id_libro]["disponible"] is True
+
+    bd.ejecutar("UPDATE libro SET disponible = 0 WHERE id = %s", (id_libro,))
+    await asyncio.to_thread(sincronizar)
+    assert (await buscar("cuaderno otro worker"))[id_libro]["disponible"] is False
+
+    bd.ejecutar("DELETE FROM libro WHERE id = %s", (id_libro,))
+    await asyncio.to_thread(sincronizar)
+    assert id_libro not in await buscar("cuaderno otro worker")
+
+async def test_libros_prefijo_con_comodines(entorno):
+    """% y _ en el prefijo del título se buscan literalmente."""
+    cliente = entorno.cliente
+    for titulo in ("C_programacion", "Cxprogramacion", "100% Python", "1000 Python"):
+        assert (await cliente.post("/libros/", json={"titulo": titulo, "autor": "Prueba", "disponible": True})
+                ).status_code == 200
+    for prefijo, esperado in (("C_", ["C_programacion"]), ("100%", ["100% Python"])):
+        respuesta = await cliente.get("/libros/", params={"titulo": prefijo})
+        assert [fila["titulo"] for fila in respuesta.json()] == esperado
+
+async def test_usuarios_correo_unico(entorno):
+    """Correo único en altas individuales y masivas."""
+    cliente = entorno.cliente
+    repetido = await cliente.post("/usuarios/", json={"nombre": "Repetido", "correo": "usuario1@biblioteca.test"})
+    assert repetido.status_code == 409
+    masivo = (await cliente.post("/usuarios/bulk/", json=[
+        {"nombre": "Nuevo Uno", "correo": "verificacion1@biblioteca.test"},
+        {"nombre": "Repetido", "correo": "USUARIO2@biblioteca.test"},
+        {"nombre": "Nuevo Dos", "correo": "verificacion1@biblioteca.test"},
+        {"nombre": "Sin correo"},
+    ])).json()
+    assert masivo["insertados"] == 1
+    assert [e["fila"] for e in masivo["errores"]] == [2, 3, 4]
+
+async def test_libros_masivo(entorno):
+    """Carga masiva: ids de las filas insertadas y filas inválidas informadas sin cancelar el resto."""
+    filas = [{"titulo": f"Cronica masiva {i}", "autor": "Hugo Castro Gil", "disponible": True} for i in range(5)]
+    filas.insert(2, {"titulo": "Sin autor"})
+    masivo = (await entorno.cliente.post("/libros/bulk/", params={"lote": 2}, json=filas)).json()
+    ids = [i for desde, hasta in masivo["rangos"] for i in range(desde, hasta + 1)]
+    assert masivo["insertados"] == 5 and len(ids) == 5
+    assert [e["fila"] for e in masivo["errores"]] == [3]
+    assert entorno.contar(
+        f"SELECT COUNT(*) AS n FROM libro WHERE titulo LIKE %s AND id IN ({', '.join(['%s'] * len(ids))})",
+        ["Cronica masiva %"] + ids) == 5
+
+async def test_doble_prestamo(entorno):
+    """Préstamos y devoluciones simultáneos del mismo libro: solo uno de cada tiene éxito."""
+    resultado = await verificar_doble_prestamo(entorno.cliente, entorno.datos, 200)
+    assert resultado["ok"], resultado
+
+async def test_devoluciones(entorno):
+    """Préstamo, devolución individual y devolución masiva con ids repetidos o inexistentes."""
+    cliente, datos = entorno.cliente, entorno.datos
+    id_usuario = datos["primeros"]["usuario"]
+    libres = [datos["disponibles_libres"].pop() for _ in range(2)]
+    prestamos = []
+    for id_libro in libres:
+        respuesta = await cliente.post("/prestamos/", json={
+            "id_libro": id_libro, "id_usuario": id_usuario, "fecha_devolucion": _vencimiento()})
+        assert respuesta.status_code == 200
+        prestamos.append(respuesta.json()["id"])
+    assert (await cliente.post("/prestamos/", json={
+        "id_libro": libres[0], "id_usuario": id_usuario, "fecha_devolucion": _vencimiento()})).status_code == 400
+    assert (await cliente.post("/prestamos/", json={
+        "id_libro": datos["disponibles_libres"][-1], "id_usuario": 0, "fecha_devolucion": _vencimiento()})
+            ).status_code == 404
+
+    assert (await cliente.post(f"/prestamos/{prestamos[0]}/devolucion/")).status_code == 200
+    masiva = (await cliente.post("/prestamos/devoluciones/", json={"ids": prestamos + [prestamos[1], 0]})).json()
+    assert (await cliente.post(f"/prestamos/{prestamos[0]}/devolucion/")).status_code == 409
+    assert (await cliente.post("/prestamos/0/devolucion/")).status_code == 404
+    assert masiva == {"devueltos": [prestamos[1]], "ya_devueltos": [prestamos[0]], "no_encontrados": [0]}
+    assert entorno.contar("SELECT COUNT(*) AS n FROM libro WHERE disponible = 1 AND id IN (%s, %s)", libres) == 2
+    datos["disponibles_libres"].extend(libres)
+
+async def test_prestamos_filtros(entorno):
+    """Filtros y paginación por cursor de los préstamos."""
+    cliente = entorno.cliente
+    activos, vistos, cursor, paginas = 0, set(), None, 0
+    while True:
+        params = {"estado": "activo", "limit": 500}
+        if cursor is not None:
+            params["after_id"] = cursor
+        pagina = await cliente.get("/prestamos/", params=params)
+        filas = pagina.json()
+        paginas += 1
+        activos += sum(1 for fila in filas if not fila["devuelto"])
+        vistos.update(fila["id"] for fila in filas)
+        cursor = pagina.headers.get("x-next-cursor")
+        if cursor is None or paginas > 1000:
+            break
+    assert activos == len(vistos) == entorno.contar("SELECT COUNT(*) AS n FROM prestamo WHERE devuelto = 0")
+
+    id_usuario = entorno.datos["primeros"]["usuario"] + 1
+    del_usuario = (await cliente.get("/prestamos/", params={"id_usuario": id_usuario})).json()
+    assert len(del_usuario) == entorno.contar("SELECT COUNT(*) AS n FROM prestamo WHERE id_usuario = %s",
+                                              (id_usuario,))
+    desde = (date.today() - timedelta(days=60)).isoformat()
+    recientes = (await cliente.get("/prestamos/", params={"desde": desde})).json()
+    assert all(fila["fecha_prestamo"] >= desde for fila in recientes)
+    assert len(recientes) == entorno.contar("SELECT COUNT(*) AS n FROM prestamo WHERE fecha_prestamo >= %s",
+                                            (desde,))
+    assert (await cliente.get("/prestamos/", params={"estado": "otro"})).status_code == 400
+
+async def test_notificaciones(entorno):
+    """Alta, feed, no leídas y marcado de notificaciones."""
+    cliente = entorno.cliente
+    id_usuario = entorno.datos["primeros"]["usuario"] + 2
+    nueva = await cliente.post("/notificaciones/", json={"usuario_id": id_usuario, "mensaje": "Verificación"})
+    assert nueva.status_code == 200
+    feed = await cliente.get(f"/notificaciones/usuario/{id_usuario}")
+    assert any(n["id"] == nueva.json()["id"] for n in feed.json())
+    no_leidas = (await cliente.get(f"/notificaciones/usuario/{id_usuario}/no_leidas/")).json()["no_leidas"]
+    assert no_leidas >= 1 and feed.headers.get("x-no-leidas") == str(no_leidas)
+    marcadas = (await cliente.post(f"/notificaciones/usuario/{id_usuario}/leidas/")).json()["marcadas"]
+    assert marcadas == no_leidas
+    assert (await cliente.get(f"/notificaciones/usuario/{id_usuario}/no_leidas/")).json()["no_leidas"] == 0
+    assert (await cliente.post("/notificaciones/", json={"usuario_id": 0, "mensaje": "Verificación"})
+            ).status_code == 404
+
+async def test_recordatorios(entorno):
+    """Recordatorios de vencidos: una segunda pasada el mismo día no duplica."""
+    primera = (await entorno.cliente.post("/notificaciones/recordatorios/")).json()
+    segunda = (await entorno.cliente.post("/notificaciones/recordatorios/")).json()
+    vencidos = entorno.contar("SELECT COUNT(*) AS n FROM prestamo WHERE devuelto = 0 AND fecha_devolucion < %s",
+                              (date.today(),))
+    assert primera["prestamos_vencidos"] == vencidos
+    assert primera["creadas"] + primera["omitidas"] == vencidos
+    assert segunda["creadas"] == 0 and segunda["omitidas"] == vencidos
+
+async def test_estadisticas(entorno):
+    """Estadísticas incrementales frente al recuento directo."""
+    top = (await entorno.cliente.get("/estadisticas/libros/", params={"n": 5})).json()
+    conteos = [fila["prestamos"] for fila in top]
+    assert conteos == sorted(conteos, reverse=True)
+    for fila in top:
+        assert fila["prestamos"] == entorno.contar("SELECT COUNT(*) AS n FROM prestamo WHERE id_libro = %s",
+                                                   (fila["id_libro"],))
+
+async def test_tipos_reporte(entorno):
+    """La descripción del tipo de reporte es única sin distinguir mayúsculas."""
+    assert (await entorno.cliente.post("/tipos_reporte/", json={"descripcion": "Verificación"})).status_code == 200
+    assert (await entorno.cliente.post("/tipos_reporte/", json={"descripcion": "VERIFICACIÓN"})).status_code == 400
+
+async def test_login(entorno):
+    """Login contra la tabla usuario, rehash opcional y límite de intentos por cuenta."""
+    cliente, bd = entorno.cliente, entorno.bd
+    id_usuario = entorno.datos["primeros"]["usuario"] + 3
+    with bd.obtener_cursor() as (cursor, conexion):
+        cursor.execute("UPDATE usuario SET usuario = %s, hashed_password = %s WHERE id = %s",
+                       ("verificacion", bcrypt.hashpw(b"clave", bcrypt.gensalt(4)).decode(), id_usuario))
+        conexion.commit()
+
+    async def entrar(usuario, password):
+        return await cliente.post("/login", json={"usuario": usuario, "password": password})
+
+    correcto = await entrar("VERIFICACION", "clave")
+    assert correcto.status_code == 200 and correcto.json()["usuario"]["id"] == id_usuario
+    assert (await entrar("verificacion", "otra")).status_code == 401
+    assert (await entrar("nadie", "clave")).status_code == 401
+    assert (await entrar("", "")).status_code == 401
+    # El hash nunca sale en las respuestas de usuarios
+    assert "hashed_password" not in (await cliente.get(f"/usuarios/{id_usuario}")).json()
+    listado = (await cliente.get("/usuarios/", params={"after_id": id_usuario - 1, "limit": 1})).json()
+    assert all("hashed_password" not in fila for fila in listado)
+
+    servicio_login = entorno.main.servicio_login
+    coste_rehash, servicio_login.coste_rehash = servicio_login.coste_rehash, 5
+    try:
+        await entrar("verificacion", "clave")
+        await asyncio.gather(*list(servicio_login._tareas))
+    finally:
+        servicio_login.coste_rehash = coste_rehash
+    with bd.obtener_cursor() as (cursor, _):
+        cursor.execute("SELECT hashed_password FROM usuario WHERE id = %s", (id_usuario,))
+        assert coste_de(cursor.fetchone()["hashed_password"]) == 5
+    assert (await entrar("verificacion", "clave")).status_code == 200
+
+    limitado = None
+    for _ in range(servicio_login.limite_usuario.capacidad + 1):
+        limitado = await entrar("verificacion", "otra")
+    assert limitado.status_code == 429 and int(limitado.headers.get("retry-after", 0)) > 0
+
+async def test_coste_del_entorno(monkeypatch):
+    """El coste de rehash sale de BIBLIOTECA_COSTE_BCRYPT y se valida."""
+    monkeypatch.delenv(VARIABLE_COSTE, raising=False)
+    assert coste_del_entorno() is None
+    monkeypatch.setenv(VARIABLE_COSTE, "12")
+    assert coste_del_entorno() == 12
+    for valor in ("3", "32", "doce"):
+        monkeypatch.setenv(VARIABLE_COSTE, valor)
+        with pytest.raises(ValueError):
+            coste_del_entorno()
+
+@pytest.mark.parametrize("tipo,filtros", [("tabla", {"tabla": tabla}) for tabla in TABLAS_REPORTE]
+                         + [("grafico", None), ("comprobante", "prestamo")])
+async def test_reportes(entorno, tipo, filtros):
+    """Cada tipo de reporte devuelve un PDF."""
+    if filtros == "prestamo":
+        filtros = {"id_prestamo": entorno.datos["primeros"]["prestamo"]}
+    params = {"tipo": tipo}
+    if filtros:
+        params["filtros"] = json.dumps(filtros)
+    respuesta = await entorno.cliente.get("/reportes/", params=params)
+    assert respuesta.status_code == 200 and respuesta.content.startswith(b"%PDF")
+
+async def test_reporte_desconocido(entorno):
+    assert (await entorno.cliente.get("/reportes/", params={"tipo": "otro"})).status_code == 400
+
+async def test_trabajos_abandonados(entorno):
+    """Al iniciar solo se retoman los trabajos en proceso sin actualizar desde hace tiempo."""
+    bd, cola = entorno.bd, entorno.main.cola_reportes
+    with bd.obtener_cursor() as (cursor, conexion):
+        cursor.execute("SELECT CURRENT_TIMESTAMP AS ahora")
+        ahora = cursor.fetchone()["ahora"]
+        if not isinstance(ahora, datetime):
+            ahora = datetime.fromisoformat(str(ahora))
+        ids = []
+        for actualizado in (ahora - timedelta(seconds=cola.abandonado_tras + 60), ahora):
+            cursor.execute("INSERT INTO trabajo_reporte (tipo, estado, actualizado) VALUES ('tabla', 'en_proceso', %s)",
+                           (actualizado,))
+            ids.append(cursor.lastrowid)
+        conexion.commit()
+    try:
+        pendientes = [trabajo["id"] for trabajo in await cola._recuperar()]
+        assert ids[0] in pendientes and ids[1] not in pendientes
+        assert entorno.contar("SELECT COUNT(*) AS n FROM trabajo_reporte WHERE id = %s AND estado = 'en_proceso'",
+                              (ids[1],)) == 1
+    finally:
+        bd.ejecutar(f"DELETE FROM trabajo_reporte WHERE id IN ({ids[0]}, {ids[1]})")
+
+async def test_indices(entorno):
+    """Cada consulta de los servicios usa su índice (migrar.py verificar)."""
+    import migrar
+    fallos = [f"{fila['servicio']}: {fila['veredicto']}" for fila in migrar.verificar(entorno.bd) if not fila["ok"]]
+    assert not fallos
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+import metricas
+
+logger = logging.getLogger("uvicorn.error")
+
+SQL_TRABAJOS_PENDIENTES = "SELECT id, tipo, filtros FROM trabajo_reporte WHERE estado = 'pendiente' ORDER BY id"
+
+SQL_TRABAJOS_ABANDONADOS = """
+    UPDATE trabajo_reporte SET estado = 'pendiente'
+    WHERE estado = 'en_proceso' AND actualizado < %s
+"""
+
+duracion_trabajos = metricas.registro.histograma(
+    "biblioteca_trabajo_reporte_segundos", "Duración de los trabajos de reporte en segundo plano",
+    ("tipo", "estado"), metricas.BUCKETS_RENDER)
+
+def renderizar_reporte(tipo: str, filtros: Optional[Dict[str, Any]], ruta: str) -> int:
+    # Se ejecuta en un proceso del pool: importa la app una sola vez por proceso
+    from main import servicio_reportes
+    try:
+        pdf_data = servicio_reportes.generar_reporte(tipo, filtros)
+    except HTTPException as e:
+        # HTTPException no se puede reconstruir al volver del proceso hijo
+        raise RuntimeError(str(e.detail))
+    # Temporal único: dos procesos con el mismo trabajo no escriben en el mismo archivo
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), prefix=os.path.basename(ruta) + ".",
+                                            suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as archivo:
+            archivo.write(pdf_data)
+        os.replace(temporal, ruta)
+    except BaseException:
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+        raise
+    return len(pdf_data)
+
+class ColaReportes:
+    """Cola de generación de reportes en segundo plano.
+
+    Los trabajos se registran en la tabla trabajo_reporte antes de encolarse,
+    así que los pendientes se recuperan al reiniciar. Los PDFs se generan en un
+    pool de procesos de `procesos` workers y se guardan en `directorio`; con
+    más de `max_pendientes` trabajos sin terminar se rechazan los nuevos. Al
+    iniciar solo se retoman los trabajos en proceso que llevan más de
+    `abandonado_tras` segundos sin actualizarse: los más recientes pueden
+    seguir generándose en otro worker de uvicorn.
+    """
+
+    def __init__(self, bd, directorio: str, procesos: int = 2, max_pendientes: int = 100,
+                 abandonado_tras: float = 600):
+        self.bd = bd
+        self.directorio = directorio
+        self.procesos = procesos
+        self.max_pendientes = max_pendientes
+        self.abandonado_tras = abandonado_tras
+        self._executor = None
+        self._tareas = {}
+
+    async def iniciar(self) -> None:
+        os.makedirs(self.directorio, exist_ok=True)
+        # spawn: los procesos hijos no heredan los sockets de los pools del padre
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.procesos,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        pendientes = await self._recuperar()
+        for trabajo in pendientes:
+            filtros = json.loads(trabajo["filtros"]) if trabajo["filtros"] else None
+            self._encolar(trabajo["id"], trabajo["tipo"], filtros)
+        if pendientes:
+            logger.info(f"Recuperados {len(pendientes)} trabajos de reporte pendientes")
+
+    async def _recuperar(self) -> list:
+        """Devuelve a pendiente los trabajos abandonados y lista todos los pendientes."""
+        async with self.bd.obtener_cursor() as (cursor, conexion):
+            # El corte se calcula con el reloj de la base: actualizado lo escribe ella
+            # (UTC en SQLite, zona horaria de la sesión en MySQL)
+            await cursor.execute("SELECT CURRENT_TIMESTAMP AS ahora")
+            ahora = (await cursor.fetchone())["ahora"]
+            if not isinstance(ahora, datetime):
+                ahora = datetime.fromisoformat(str(ahora))
+            await cursor.execute(SQL_TRABAJOS_ABANDONADOS, (ahora - timedelta(seconds=self.abandonado_tras),))
+            await cursor.execute(SQL_TRABAJOS_PENDIENTES)
+            pendientes = await cursor.fetchall()
+            await conexion.commit()
+        return pendientes
+
+    def cerrar(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _ruta(self, id_trabajo: int) -> str:
+        return os.path.join(self.directorio, f"trabajo_{id_trabajo}.pdf")
+
+    def _encolar(self, id_trabajo: int, tipo: str, filtros: Optional[Dict[str, Any]]) -> None:
+        tarea = asyncio.create_task(self._ejecutar(id_trabajo, tipo, filtros))
+        self._tareas[id_trabajo] = tarea
+        tarea.add_done_callback(lambda _: self._tareas.pop(id_trabajo, None))
+
+    async def enviar(self, tipo: str, filtros: Optional[Dict[str, Any]] = None) -> dict:
+        if len(self._tareas) >= self.max_pendientes:
+            raise HTTPException(
+                status_code=503,
+                detail="Cola de reportes llena, intente más tarde",
+                headers={"Retry-After": "30"},
+            )
+        async with self.bd.obtener_cursor() as (cursor, conexion):
+            await cursor.execute(
+                "INSERT INTO trabajo_reporte (tipo, filtros, estado) VALUES (%s, %s, 'pendiente')",
+                (tipo.lower(), json.dumps(filtros) if filtros else None)
+            )
+            await conexion.commit()
+            id_trabajo = cursor.lastrowid
+        self._encolar(id_trabajo, tipo.lower(), filtros)
+        return {"id": id_trabajo, "estado": "pendiente"}
+
+    async def _actualizar(self, id_trabajo: int, estado: str, **campos) -> int:
+        asignaciones = ", ".join(["estado = %s"] + [f"{k} = %s" for k in campos])
+        condicion = " AND estado = 'pendiente'" if estado == "en_proceso" else ""
+        async with self.bd.obtener_cursor() as (cursor, conexion):
+            await cursor.execute(
+                f"UPDATE trabajo_reporte SET {asignaciones} WHERE id = %s{condicion}",
+                [estado] + list(campos.values()) + [id_trabajo]
+            )
+            await conexion.commit()
+            return cursor.rowcount
+
+    async def _ejecutar(self, id_trabajo: int, tipo: str, filtros: Optional[Dict[str, Any]]) -> None:
+        # El UPDATE condicional reclama el trabajo: otro worker de uvicorn no lo repite
+        if not await self._actualizar(id_trabajo, "en_proceso"):
+            return
+        ruta = self._ruta(id_trabajo)
+        loop = asyncio.get_running_loop()
+        inicio = time.perf_counter()
+        try:
+            await loop.run_in_executor(self._executor, renderizar_reporte, tipo, filtros, ruta)
+        except Exception as e:
+            duracion_trabajos.observar(time.perf_counter() - inicio, tipo=tipo, estado="error")
+            logger.error(f"Trabajo de reporte {id_trabajo} fallido: {e}")
+            await self._actualizar(id_trabajo, "error", error=str(e))
+            return
+        duracion_trabajos.observar(time.perf_counter() - inicio, tipo=tipo, estado="completado")
+        await self._actualizar(id_trabajo, "completado", archivo=os.path.basename(ruta))
+
+    async def estado(self, id_trabajo: int) -> dict:
+        async with self.bd.obtener_cursor() as (cursor, _):
+            await cursor.execute(
+                "SELECT id, tipo, filtros, estado, error, creado, actualizado FROM trabajo_reporte WHERE id = %s",
+                (id_trabajo,)
+            )
+            trabajo = await cursor.fetchone()
+        if not trabajo:
+            raise HTTPException(status_code=404, detail="Trabajo de reporte no encontrado")
+        trabajo["filtros"] = json.loads(trabajo["filtros"]) if trabajo["filtros"] else None
+        return trabajo
+
+    async def ruta_pdf(self, id_trabajo: int) -> str:
+        trabajo = await self.estado(id_trabajo)
+        if trabajo["estado"] != "completado":
+            raise HTTPException(status_code=409, detail=f"El trabajo está en estado '{trabajo['estado']}'")
+        ruta = self._ruta(id_trabajo)
+        if not os.path.exists(ruta):
+            raise HTTPException(status_code=410, detail="El PDF del trabajo ya no está disponible")
+        return ruta
+
+    def estadisticas(self) -> dict:
+        return {
+            "procesos": self.procesos,
+            "max_pendientes": self.max_pendientes,
+            "pendientes": len(self._tareas),
+        }